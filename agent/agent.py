@@ -3,12 +3,19 @@ Monitoring Agent main program
 Periodically collects system metrics and sends to central server
 """
 import time
-import requests
 import logging
+import threading
 from datetime import datetime, timezone
 from config import Config
 from collectors.system import SystemCollector
 from collectors.network import NetworkCollector
+from collectors.host import HostCollector
+from collectors.highres import HighResSampler
+from instrumentation import REGISTRY, start_http_server
+from scheduler import Scheduler
+from spool import Spool
+from uploader import Uploader
+from wire import CompactEncoder
 
 # Configure logging
 logging.basicConfig(
@@ -17,38 +24,68 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+collector_seconds = REGISTRY.histogram(
+    'agent_collector_duration_seconds', 'Time taken by each collector', ('collector',))
+
 class MonitoringAgent:
     """Monitoring Agent main class"""
     
     def __init__(self):
         self.agent_id = Config.AGENT_ID
         self.agent_name = Config.AGENT_NAME
-        self.server_url = Config.API_ENDPOINT
+        self.server_url = Config.BATCH_ENDPOINT
         self.interval = Config.COLLECTION_INTERVAL
+        self.spool = None
+        self.uploader = None
+        
+        # Network results waiting to be attached to the next system sample
+        self._pending_checks = []
+        self._pending_lock = threading.Lock()
+        
+        SystemCollector.prime()
+        self.host_collector = HostCollector(
+            top_processes=Config.TOP_PROCESSES,
+            process_budget=Config.PROCESS_BUDGET_MS / 1000.0
+        ) if Config.EXTENDED_METRICS else None
+        self.highres = HighResSampler(Config.HIGHRES_BUFFER_SIZE) if Config.HIGHRES_INTERVAL else None
         
         logger.info(f"Agent initialized: {self.agent_name} (ID: {self.agent_id})")
         logger.info(f"Server URL: {self.server_url}")
-        logger.info(f"Collection interval: {self.interval}s")
+        logger.info(f"Collection interval: system {Config.SYSTEM_INTERVAL}s, "
+                    f"network {Config.NETWORK_INTERVAL}s")
     
-    def collect_metrics(self):
+    def collect_metrics(self, network_metrics=None):
         """Collect all metrics"""
         try:
             # Collect system metrics
-            system_metrics = SystemCollector.collect_all()
+            with collector_seconds.time(collector='system'):
+                system_metrics = SystemCollector.collect_all()
             
-            # Collect network metrics
-            network_metrics = NetworkCollector.collect_all(Config.NETWORK_TARGETS)
+            # Spikes between samples, from the high-resolution readings
+            if self.highres is not None:
+                summary = self.highres.summarize()
+                if summary:
+                    system_metrics['summary'] = summary
+            
+            # Collect network metrics unless they were gathered separately
+            if network_metrics is None:
+                network_metrics = self.run_network_checks()
             
             # Assemble data
             data = {
                 'agent_id': self.agent_id,
                 'agent_name': self.agent_name,
                 'timestamp': datetime.now(timezone.utc).isoformat(),
+                'interval': Config.SYSTEM_INTERVAL,
                 'system': system_metrics,
                 'network': network_metrics
             }
             
-            logger.info(f"Metrics collected - CPU: {system_metrics['cpu_percent']}%, "
+            if self.host_collector is not None:
+                with collector_seconds.time(collector='host'):
+                    data['host'] = self.host_collector.collect_all()
+            
+            logger.debug(f"Metrics collected - CPU: {system_metrics['cpu_percent']}%, "
                        f"Memory: {system_metrics['memory']['percent']}%, "
                        f"Disk: {system_metrics['disk']['percent']}%")
             
@@ -58,35 +95,91 @@ class MonitoringAgent:
             logger.error(f"Error collecting metrics: {e}")
             return None
     
+    def run_network_checks(self):
+        """Probe all configured network targets concurrently"""
+        with collector_seconds.time(collector='network'):
+            return NetworkCollector.collect_all(
+                Config.NETWORK_TARGETS,
+                max_workers=Config.NETWORK_MAX_CONCURRENCY,
+                deadline=Config.NETWORK_DEADLINE
+            )
+    
+    def collect_network(self):
+        """Scheduled job: run network checks and hold them for the next sample"""
+        checks = self.run_network_checks()
+        timestamp = datetime.now(timezone.utc).isoformat()
+        for check in checks:
+            check['timestamp'] = timestamp
+        
+        with self._pending_lock:
+            self._pending_checks.extend(checks)
+    
+    def collect_system(self):
+        """Scheduled job: collect a sample and hand it to the spool"""
+        with self._pending_lock:
+            checks, self._pending_checks = self._pending_checks, []
+        
+        data = self.collect_metrics(network_metrics=checks)
+        if data is None:
+            # Keep the checks for the next successful sample
+            with self._pending_lock:
+                self._pending_checks[:0] = checks
+            return
+        
+        self.send_metrics(data)
+    
+    def start_metrics_server(self, scheduler):
+        """Expose agent self-metrics for Prometheus if METRICS_PORT is set"""
+        REGISTRY.gauge('agent_spool_depth', 'Samples waiting in the spool')\
+            .set_function(lambda: self.spool.depth())
+        REGISTRY.counter('agent_spool_dropped_total', 'Samples evicted from a full or expired spool')\
+            .set_function(lambda: self.spool.dropped)
+        REGISTRY.gauge('agent_upload_failures', 'Consecutive failed upload attempts')\
+            .set_function(lambda: self.uploader.failures)
+        REGISTRY.counter('agent_scheduler_skipped_total', 'Collector ticks skipped because the previous run overran')\
+            .set_function(lambda: sum(job.skipped for job in scheduler.jobs))
+        if Config.METRICS_PORT:
+            start_http_server(Config.METRICS_PORT, Config.METRICS_HOST)
+    
+    def start_uploader(self):
+        """Open the spool and start the background uploader"""
+        self.spool = Spool(
+            Config.SPOOL_PATH,
+            max_samples=Config.SPOOL_MAX_SAMPLES,
+            max_age=Config.SPOOL_MAX_AGE
+        )
+        self.uploader = Uploader(
+            self.spool,
+            Config.BATCH_ENDPOINT,
+            batch_size=Config.UPLOAD_BATCH_SIZE,
+            backoff_base=Config.RETRY_BACKOFF_BASE,
+            backoff_max=Config.RETRY_BACKOFF_MAX,
+            compact=CompactEncoder(
+                Config.REGISTER_ENDPOINT,
+                Config.COMPACT_ENDPOINT,
+                Config.NETWORK_TARGETS
+            ) if Config.UPLOAD_PROTOCOL == 'compact' else None
+        )
+        self.uploader.start()
+        logger.info(f"Spool: {Config.SPOOL_PATH} ({self.spool.depth()} samples pending)")
+    
+    def stop_uploader(self):
+        """Stop the uploader; unsent samples stay in the spool"""
+        if self.uploader:
+            self.uploader.stop()
+            self.uploader.join(timeout=15)
+        if self.spool:
+            logger.info(f"Spool stats: {self.spool.stats()}")
+            self.spool.close()
+    
     def send_metrics(self, data):
-        """Send metrics to server"""
+        """Queue metrics for upload; never blocks on the network"""
         if data is None:
             return False
         
-        for attempt in range(Config.MAX_RETRIES):
-            try:
-                response = requests.post(
-                    self.server_url,
-                    json=data,
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    logger.info("Metrics sent successfully")
-                    return True
-                else:
-                    logger.warning(f"Server returned status {response.status_code}")
-                    
-            except requests.exceptions.ConnectionError:
-                logger.warning(f"Connection failed (attempt {attempt + 1}/{Config.MAX_RETRIES})")
-                if attempt < Config.MAX_RETRIES - 1:
-                    time.sleep(Config.RETRY_DELAY)
-            except Exception as e:
-                logger.error(f"Error sending metrics: {e}")
-                break
-        
-        logger.error("Failed to send metrics after all retries")
-        return False
+        self.spool.put(data)
+        self.uploader.wake()
+        return True
     
     def run_local_test(self, iterations=3):
         """Local test mode - collect data but don't send"""
@@ -106,6 +199,10 @@ class MonitoringAgent:
                 print(f"  CPU: {metrics['system']['cpu_percent']}%")
                 print(f"  Memory: {metrics['system']['memory']['percent']}%")
                 print(f"  Disk: {metrics['system']['disk']['percent']}%")
+                if 'summary' in metrics['system']:
+                    cpu = metrics['system']['summary']['cpu_percent']
+                    print(f"  CPU since last sample: min {cpu['min']}% / avg {cpu['avg']}% / "
+                          f"p95 {cpu['p95']}% / max {cpu['max']}% ({cpu['count']} readings)")
                 print(f"\nNetwork Checks:")
                 for check in metrics['network']:
                     status = check.get('status', 'unknown')
@@ -113,6 +210,14 @@ class MonitoringAgent:
                         print(f"  {check['host']}:{check['port']} - {status} ({check.get('latency_ms', 'N/A')}ms)")
                     elif 'url' in check:
                         print(f"  {check['url']} - {status} ({check.get('latency_ms', 'N/A')}ms)")
+                if 'host' in metrics:
+                    host = metrics['host']
+                    print(f"\nHost Metrics:")
+                    print(f"  Per-core CPU: {host['cpu_per_core']}")
+                    print(f"  Load: {host['load']}")
+                    print(f"  Disk I/O: {host['disk_io']}")
+                    print(f"  Network I/O: {host['net_io']}")
+                    print(f"  Processes: {host['process_count']}")
             
             if i < iterations - 1:
                 print(f"\nWaiting {self.interval} seconds...")
@@ -125,24 +230,22 @@ class MonitoringAgent:
     def run(self):
         """Main run loop"""
         logger.info("Agent started, collecting metrics...")
+        self.start_uploader()
         
-        while True:
-            try:
-                # Collect metrics
-                metrics = self.collect_metrics()
-                
-                # Send to server
-                self.send_metrics(metrics)
-                
-                # Wait for next collection
-                time.sleep(self.interval)
-                
-            except KeyboardInterrupt:
-                logger.info("Agent stopped by user")
-                break
-            except Exception as e:
-                logger.error(f"Unexpected error: {e}")
-                time.sleep(self.interval)
+        scheduler = Scheduler()
+        scheduler.add_job('system', Config.SYSTEM_INTERVAL, self.collect_system)
+        scheduler.add_job('network', Config.NETWORK_INTERVAL, self.collect_network)
+        if self.highres is not None:
+            scheduler.add_job('highres', Config.HIGHRES_INTERVAL, self.highres.sample)
+        self.start_metrics_server(scheduler)
+        
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            logger.info("Agent stopped by user")
+        finally:
+            scheduler.stop()
+            self.stop_uploader()
 
 if __name__ == '__main__':
     import sys
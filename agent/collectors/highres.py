@@ -0,0 +1,86 @@
+"""
+High-resolution sampler module
+Samples CPU and memory every few seconds into ring buffers and summarizes each reporting interval
+"""
+import math
+import threading
+from array import array
+import psutil
+
+
+class RingBuffer:
+    """Fixed-capacity float buffer; the oldest values are overwritten when full"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._values = array('d', bytes(8 * capacity))
+        self._written = 0
+        self._drained = 0
+
+    def append(self, value):
+        self._values[self._written % self.capacity] = value
+        self._written += 1
+
+    def drain(self):
+        """Values appended since the previous drain (at most capacity), oldest first"""
+        start = max(self._drained, self._written - self.capacity)
+        values = [self._values[i % self.capacity] for i in range(start, self._written)]
+        self._drained = self._written
+        return values
+
+
+def summarize(values):
+    """min, max, avg, nearest-rank p95 and count of a list of values"""
+    values = sorted(values)
+    rank = max(1, math.ceil(0.95 * len(values)))
+    return {
+        'min': values[0],
+        'max': values[-1],
+        'avg': round(sum(values) / len(values), 2),
+        'p95': values[rank - 1],
+        'count': len(values)
+    }
+
+
+class HighResSampler:
+    """
+    Fine-grained CPU and memory sampling between reports.
+
+    CPU percent is computed from its own cpu_times() deltas, so it does not
+    disturb the measurement window SystemCollector uses for the
+    point-in-time value.
+    """
+
+    def __init__(self, capacity=3600):
+        self.cpu = RingBuffer(capacity)
+        self.memory = RingBuffer(capacity)
+        self._lock = threading.Lock()
+        self._last_times = psutil.cpu_times()
+
+    @staticmethod
+    def _busy(times):
+        # Same accounting as psutil.cpu_percent: guest time is already in user/nice
+        total = sum(times) - getattr(times, 'guest', 0) - getattr(times, 'guest_nice', 0)
+        idle = times.idle + getattr(times, 'iowait', 0)
+        return total, total - idle
+
+    def sample(self):
+        """Scheduled job: take one CPU and memory reading"""
+        times = psutil.cpu_times()
+        memory = psutil.virtual_memory().percent
+        with self._lock:
+            total, busy = self._busy(times)
+            last_total, last_busy = self._busy(self._last_times)
+            self._last_times = times
+            if total > last_total:
+                cpu = min(100.0, max(0.0, (busy - last_busy) / (total - last_total) * 100))
+                self.cpu.append(round(cpu, 1))
+            self.memory.append(memory)
+
+    def summarize(self):
+        """Summaries of the readings since the previous call, or None if there were none"""
+        with self._lock:
+            cpu, memory = self.cpu.drain(), self.memory.drain()
+        if not cpu or not memory:
+            return None
+        return {'cpu_percent': summarize(cpu), 'memory_percent': summarize(memory)}
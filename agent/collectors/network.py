@@ -3,19 +3,38 @@ Network connectivity checker module
 Checks host reachability and URL availability
 """
 import socket
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 import requests
+from requests.adapters import HTTPAdapter
 
 class NetworkCollector:
     """Network connectivity checker"""
     
+    # Shared session so URL checks reuse keep-alive connections per host
+    _session = None
+    _session_lock = threading.Lock()
+    
+    @classmethod
+    def get_session(cls, pool_size=16):
+        """Get the pooled HTTP session, creating it on first use"""
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                cls._session = session
+            return cls._session
+    
     @staticmethod
     def check_host(host, port=80, timeout=3):
         """Check if a host is reachable"""
         try:
-            start_time = time.time()
-            socket.create_connection((host, port), timeout=timeout)
-            latency = (time.time() - start_time) * 1000  # Convert to milliseconds
+            start_time = time.perf_counter()
+            with socket.create_connection((host, port), timeout=timeout):
+                latency = (time.perf_counter() - start_time) * 1000  # Convert to milliseconds
             return {
                 'host': host,
                 'port': port,
@@ -34,9 +53,9 @@ class NetworkCollector:
     def check_url(url, timeout=5):
         """Check if a URL is accessible"""
         try:
-            start_time = time.time()
-            response = requests.get(url, timeout=timeout)
-            latency = (time.time() - start_time) * 1000
+            start_time = time.perf_counter()
+            response = NetworkCollector.get_session().get(url, timeout=timeout)
+            latency = (time.perf_counter() - start_time) * 1000
             
             return {
                 'url': url,
@@ -52,8 +71,30 @@ class NetworkCollector:
             }
     
     @staticmethod
-    def collect_all(targets=None):
-        """Collect all network check results"""
+    def run_check(target):
+        """Run the check described by a target dict"""
+        if target['type'] == 'host':
+            return NetworkCollector.check_host(
+                target['target'],
+                target.get('port', 80),
+                timeout=target.get('timeout', 3)
+            )
+        elif target['type'] == 'url':
+            return NetworkCollector.check_url(
+                target['target'],
+                timeout=target.get('timeout', 5)
+            )
+        raise ValueError(f"Unknown check type: {target['type']}")
+    
+    @staticmethod
+    def collect_all(targets=None, max_workers=16, deadline=30):
+        """
+        Collect all network check results concurrently.
+        
+        At most `max_workers` checks run at once and the whole cycle is
+        bounded by `deadline` seconds; checks still running at the
+        deadline are reported as down. Results keep the order of `targets`.
+        """
         if targets is None:
             # Default check targets
             targets = [
@@ -61,18 +102,39 @@ class NetworkCollector:
                 {'type': 'url', 'target': 'https://www.google.com'}
             ]
         
-        results = []
-        for target in targets:
-            if target['type'] == 'host':
-                result = NetworkCollector.check_host(
-                    target['target'], 
-                    target.get('port', 80)
-                )
-            elif target['type'] == 'url':
-                result = NetworkCollector.check_url(target['target'])
-            results.append(result)
+        if not targets:
+            return []
         
-        return results
+        NetworkCollector.get_session(pool_size=max_workers)
+        executor = ThreadPoolExecutor(
+            max_workers=min(max_workers, len(targets)),
+            thread_name_prefix='probe'
+        )
+        try:
+            futures = [executor.submit(NetworkCollector.run_check, t) for t in targets]
+            wait(futures, timeout=deadline)
+            
+            results = []
+            for target, future in zip(targets, futures):
+                key = 'host' if target['type'] == 'host' else 'url'
+                if not future.done():
+                    future.cancel()
+                    result = {key: target['target'], 'status': 'down',
+                              'error': f'Check did not finish within the {deadline}s cycle deadline'}
+                elif future.exception():
+                    result = {key: target['target'], 'status': 'down',
+                              'error': str(future.exception())}
+                else:
+                    result = future.result()
+                
+                if key == 'host':
+                    result.setdefault('port', target.get('port', 80))
+                results.append(result)
+            
+            return results
+        finally:
+            # Do not wait for checks that overran the deadline
+            executor.shutdown(wait=False, cancel_futures=True)
 
 # Test code
 if __name__ == '__main__':
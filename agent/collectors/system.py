@@ -8,10 +8,15 @@ from datetime import datetime, timezone
 class SystemCollector:
     """Collect system resource metrics"""
     
+    @staticmethod
+    def prime():
+        """Start the CPU measurement window so the first reading is meaningful"""
+        psutil.cpu_percent(interval=None)
+    
     @staticmethod
     def get_cpu_usage():
-        """Get CPU usage percentage"""
-        return psutil.cpu_percent(interval=1)
+        """Get CPU usage percentage since the previous call (non-blocking)"""
+        return psutil.cpu_percent(interval=None)
     
     @staticmethod
     def get_memory_usage():
@@ -47,7 +52,11 @@ class SystemCollector:
 
 # Test code
 if __name__ == '__main__':
+    import time
+    
     collector = SystemCollector()
+    collector.prime()
+    time.sleep(1)
     metrics = collector.collect_all()
     
     print("\n=== System Metrics ===")
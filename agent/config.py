@@ -15,9 +15,25 @@ class Config:
     # Server configuration
     SERVER_URL = os.getenv('SERVER_URL', 'http://localhost:5000')
     API_ENDPOINT = f"{SERVER_URL}/api/v1/metrics"
+    BATCH_ENDPOINT = f"{SERVER_URL}/api/v1/metrics/batch"
+    COMPACT_ENDPOINT = f"{SERVER_URL}/api/v1/metrics/compact"
+    REGISTER_ENDPOINT = f"{SERVER_URL}/api/v1/agents/register"
     
     # Data collection configuration
     COLLECTION_INTERVAL = int(os.getenv('COLLECTION_INTERVAL', 60))  # seconds
+    SYSTEM_INTERVAL = int(os.getenv('SYSTEM_INTERVAL', COLLECTION_INTERVAL))  # seconds
+    NETWORK_INTERVAL = int(os.getenv('NETWORK_INTERVAL', COLLECTION_INTERVAL))  # seconds
+    
+    # High-resolution sampling: CPU and memory are read every HIGHRES_INTERVAL
+    # seconds (0 disables it) and each sample carries min/max/avg/p95/count of
+    # the readings since the previous one
+    HIGHRES_INTERVAL = float(os.getenv('HIGHRES_INTERVAL', 0))  # seconds
+    HIGHRES_BUFFER_SIZE = int(os.getenv('HIGHRES_BUFFER_SIZE', 3600))  # readings kept per metric
+    
+    # Extended host metrics (per-core CPU, filesystems, I/O rates, load, top processes)
+    EXTENDED_METRICS = os.getenv('EXTENDED_METRICS', 'false').lower() == 'true'
+    TOP_PROCESSES = int(os.getenv('TOP_PROCESSES', 5))  # by CPU and by RSS
+    PROCESS_BUDGET_MS = float(os.getenv('PROCESS_BUDGET_MS', 3))  # process scan time per sample
     
     # Network check targets
     NETWORK_TARGETS = [
@@ -25,6 +41,23 @@ class Config:
         {'type': 'url', 'target': 'https://www.google.com'}
     ]
     
-    # Retry configuration
-    MAX_RETRIES = 3
-    RETRY_DELAY = 5  # seconds
+    # Network probe limits
+    NETWORK_MAX_CONCURRENCY = int(os.getenv('NETWORK_MAX_CONCURRENCY', 16))
+    NETWORK_DEADLINE = int(os.getenv('NETWORK_DEADLINE', 30))  # seconds per cycle
+    
+    # Local spool for samples waiting to be uploaded
+    SPOOL_PATH = os.getenv('SPOOL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool.db'))
+    SPOOL_MAX_SAMPLES = int(os.getenv('SPOOL_MAX_SAMPLES', 10000))
+    SPOOL_MAX_AGE = int(os.getenv('SPOOL_MAX_AGE', 7 * 86400))  # seconds
+    
+    # Upload configuration
+    UPLOAD_BATCH_SIZE = int(os.getenv('UPLOAD_BATCH_SIZE', 100))
+    RETRY_BACKOFF_BASE = 1  # seconds
+    RETRY_BACKOFF_MAX = 300  # seconds
+    # 'compact' registers once and sends delta-encoded batches (msgpack if installed);
+    # falls back to 'json' automatically against servers without the compact endpoint
+    UPLOAD_PROTOCOL = os.getenv('UPLOAD_PROTOCOL', 'compact').lower()
+    
+    # Self-metrics endpoint (http://METRICS_HOST:METRICS_PORT/metrics); 0 disables it
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
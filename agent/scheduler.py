@@ -0,0 +1,85 @@
+"""
+Fixed-cadence job scheduler
+Fires each collector on its own drift-free monotonic interval
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A periodic job and its scheduling state"""
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = 0.0
+        self.running = False
+        self.runs = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+
+
+class Scheduler:
+    """Runs jobs on fixed cadences using a small worker pool"""
+
+    def __init__(self, max_workers=4):
+        self.jobs = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='collector')
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def add_job(self, name, interval, func):
+        self.jobs.append(Job(name, interval, func))
+
+    def stop(self):
+        self._stopping.set()
+        self._executor.shutdown(wait=False)
+
+    def run(self):
+        """Block and run jobs until stop() is called"""
+        start = time.monotonic()
+        for job in self.jobs:
+            job.next_run = start
+
+        while not self._stopping.is_set():
+            now = time.monotonic()
+
+            for job in self.jobs:
+                if job.next_run > now:
+                    continue
+
+                with self._lock:
+                    busy = job.running
+                    job.running = True
+                if busy:
+                    # Never queue a second run behind a slow one
+                    job.skipped += 1
+                    logger.warning(f"Job '{job.name}' overran its {job.interval}s interval, skipping tick")
+                else:
+                    self._executor.submit(self._execute, job)
+
+                # Deadlines are multiples of the interval from start, so
+                # run time never accumulates as drift
+                missed = int((now - job.next_run) // job.interval)
+                job.next_run += job.interval * (missed + 1)
+
+            next_run = min(job.next_run for job in self.jobs)
+            self._stopping.wait(max(0.0, next_run - time.monotonic()))
+
+    def _execute(self, job):
+        started = time.monotonic()
+        try:
+            job.func()
+        except Exception as e:
+            logger.error(f"Job '{job.name}' failed: {e}")
+        finally:
+            job.last_duration = time.monotonic() - started
+            job.runs += 1
+            with self._lock:
+                job.running = False
@@ -0,0 +1,131 @@
+"""
+Durable on-disk spool for collected samples
+Samples are queued in a local SQLite file until the uploader confirms delivery
+"""
+import json
+import sqlite3
+import threading
+import time
+
+
+class Spool:
+    """Bounded SQLite-backed FIFO queue of samples"""
+
+    def __init__(self, path, max_samples=10000, max_age=86400):
+        self.path = path
+        self.max_samples = max_samples
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+        # Counters since agent start
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.quarantined = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS spool ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'created_at REAL NOT NULL, '
+            'payload TEXT NOT NULL)'
+        )
+        # Samples the server can never take as sent (e.g. too large), kept for inspection
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS quarantine ('
+            'id INTEGER PRIMARY KEY, '
+            'created_at REAL NOT NULL, '
+            'payload TEXT NOT NULL, '
+            'reason TEXT)'
+        )
+
+    def put(self, sample):
+        """Append a sample to the spool, evicting old entries if needed"""
+        payload = json.dumps(sample, separators=(',', ':'))
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO spool (created_at, payload) VALUES (?, ?)',
+                (time.time(), payload)
+            )
+            self.queued += 1
+            self._evict()
+
+    def peek(self, limit):
+        """Return up to `limit` of the oldest samples as (id, sample) pairs"""
+        with self._lock:
+            self._evict()
+            rows = self._conn.execute(
+                'SELECT id, payload FROM spool ORDER BY id LIMIT ?', (limit,)
+            ).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def ack(self, ids):
+        """Remove samples that the server accepted"""
+        self._delete(ids)
+        with self._lock:
+            self.sent += len(ids)
+
+    def reject(self, ids):
+        """Remove samples that the server permanently rejected"""
+        self._delete(ids)
+        with self._lock:
+            self.dropped += len(ids)
+
+    def quarantine(self, ids, reason):
+        """Move samples the server cannot accept out of the queue without deleting them"""
+        if not ids:
+            return
+        with self._lock:
+            self._conn.execute('BEGIN')
+            for row_id in ids:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO quarantine (id, created_at, payload, reason) '
+                    'SELECT id, created_at, payload, ? FROM spool WHERE id = ?',
+                    (reason, row_id)
+                )
+                self._conn.execute('DELETE FROM spool WHERE id = ?', (row_id,))
+            self._conn.execute('COMMIT')
+            self.quarantined += len(ids)
+
+    def depth(self):
+        """Number of samples waiting to be sent"""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    def stats(self):
+        """Counters for queued, sent, dropped and quarantined samples"""
+        return {
+            'queued': self.queued,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'quarantined': self.quarantined,
+            'depth': self.depth()
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _delete(self, ids):
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany('DELETE FROM spool WHERE id = ?', [(i,) for i in ids])
+
+    def _evict(self):
+        """Drop samples older than max_age and the oldest beyond max_samples"""
+        cursor = self._conn.execute(
+            'DELETE FROM spool WHERE created_at < ?', (time.time() - self.max_age,)
+        )
+        evicted = cursor.rowcount
+
+        cursor = self._conn.execute(
+            'DELETE FROM spool WHERE id <= ('
+            'SELECT id FROM spool ORDER BY id DESC LIMIT 1 OFFSET ?)',
+            (self.max_samples,)
+        )
+        evicted += cursor.rowcount
+
+        self.dropped += max(evicted, 0)
@@ -0,0 +1,212 @@
+"""
+Background uploader
+Drains the spool in batches and retries with exponential backoff and jitter
+"""
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+import requests
+from instrumentation import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+upload_seconds = REGISTRY.histogram(
+    'agent_upload_duration_seconds', 'Batch upload latency by result', ('result',))
+upload_samples = REGISTRY.counter(
+    'agent_upload_samples_total', 'Samples uploaded by server verdict', ('result',))
+
+
+class Uploader(threading.Thread):
+    """Sends spooled samples to the server's batch endpoint"""
+
+    def __init__(self, spool, url, batch_size=100, backoff_base=1.0, backoff_max=300.0,
+                 idle_interval=5.0, timeout=10, compact=None):
+        super().__init__(name='uploader', daemon=True)
+        self.spool = spool
+        self.url = url
+        self.batch_size = batch_size
+        self.max_batch_size = batch_size  # batch_size shrinks after a 413 and grows back to this
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idle_interval = idle_interval
+        self.timeout = timeout
+        self.compact = compact  # CompactEncoder, or None to send JSON batches
+
+        self.failures = 0
+        self.retry_after = None
+        self._session = requests.Session()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def wake(self):
+        """Ask the uploader to send immediately instead of waiting for its next poll"""
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            batch = self.spool.peek(self.batch_size)
+            if not batch:
+                self._sleep(self.idle_interval)
+                continue
+
+            if self.send_batch(batch):
+                self.failures = 0
+                continue
+
+            # Full jitter keeps many agents from retrying in lockstep after an outage
+            self.failures += 1
+            delay = min(self.backoff_max, self.backoff_base * (2 ** self.failures))
+            delay = random.uniform(0, delay)
+            if self.retry_after:
+                # The server said when it expects to have room again
+                delay, self.retry_after = max(delay, self.retry_after), None
+            logger.warning(f"Upload failed ({self.failures} in a row), "
+                           f"retrying in {delay:.1f}s, {self.spool.depth()} samples spooled")
+            self._sleep(delay)
+
+    def send_batch(self, batch):
+        """Send one batch; returns True if the server processed it"""
+        if self.compact is not None:
+            return self.send_compact(batch)
+        body = gzip.compress(json.dumps(
+            {'samples': [sample for _, sample in batch]},
+            separators=(',', ':')
+        ).encode())
+
+        response = self._post(self.url, body, 'application/json')
+        if response is None:
+            return False
+        return self._handle_response(batch, response, lambda: response.json().get('results', []))
+
+    def send_compact(self, batch):
+        """Send one batch in the compact format, registering first if needed"""
+        batch = self.compact.compatible(batch)
+        samples = [sample for _, sample in batch]
+        if self.compact.needs_registration(samples):
+            registered = self.register(samples)
+            if registered is None:
+                # Fell back to JSON batches; the caller retries right away
+                return True
+            if not registered:
+                return False
+
+        body, mimetype = self.compact.encode(samples)
+        response = self._post(self.compact.url, gzip.compress(body), mimetype)
+        if response is None:
+            return False
+        if response.status_code == 409:
+            # The server lost our registration (e.g. a fresh database)
+            logger.info(f"Server asked for re-registration: {response.text[:200]}")
+            self.compact.reset()
+            return True
+        return self._handle_response(batch, response, lambda: self.compact.results(
+            response.content, response.headers.get('Content-Type', '').split(';')[0], len(batch)))
+
+    def register(self, samples):
+        """Register static attributes; None if the server cannot take compact batches"""
+        body = json.dumps(self.compact.registration(samples), separators=(',', ':')).encode()
+        response = self._post(self.compact.register_url, body, 'application/json', gzip_body=False)
+        if response is None:
+            return False
+        if response.status_code in (400, 404):
+            # Older server, or attributes it will not register: JSON batches still work
+            logger.warning(f"Compact uploads unavailable (status {response.status_code}), "
+                           f"falling back to JSON batches")
+            self.compact = None
+            return None
+        if response.status_code != 200:
+            logger.warning(f"Registration failed with status {response.status_code}")
+            return False
+        self.compact.registered(samples, response.json())
+        logger.info(f"Registered with server ({len(self.compact.target_ids)} targets, "
+                    f"{self.compact.mimetype})")
+        return True
+
+    def _post(self, url, body, content_type, gzip_body=True):
+        """POST a body; returns the response or None if the server was unreachable"""
+        headers = {'Content-Type': content_type}
+        if gzip_body:
+            headers['Content-Encoding'] = 'gzip'
+        started = time.perf_counter()
+        try:
+            response = self._session.post(url, data=body, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            upload_seconds.observe(time.perf_counter() - started, result='error')
+            logger.warning(f"Connection failed: {e}")
+            return None
+        upload_seconds.observe(time.perf_counter() - started, result=str(response.status_code))
+        return response
+
+    def _handle_response(self, batch, response, results):
+        """Ack or reject spooled samples according to the server's verdict"""
+        ids = [row_id for row_id, _ in batch]
+        if response.status_code == 413:
+            if len(batch) > 1:
+                self.batch_size = max(1, min(self.batch_size, len(batch)) // 2)
+                logger.warning(f"Batch too large, reducing batch size to {self.batch_size}")
+                return True
+            # A single sample over the server's limit would be resent forever
+            logger.error(f"Sample {ids[0]} is too large for the server, moving it to quarantine")
+            self.spool.quarantine(ids, f'413: {response.text[:200]}')
+            upload_samples.inc(len(ids), result='quarantined')
+            return True
+        if response.status_code in (400, 422):
+            # The whole batch is unreadable or refused; retrying would fail forever
+            logger.error(f"Server rejected batch: {response.text[:200]}")
+            self.spool.reject(ids)
+            upload_samples.inc(len(ids), result='rejected')
+            return True
+        if response.status_code in (429, 503):
+            # Write queue full or database briefly unavailable; keep the batch and back off
+            try:
+                self.retry_after = float(response.headers.get('Retry-After', 0))
+            except ValueError:
+                pass
+            logger.warning(f"Server is busy, retrying after {self.retry_after}s")
+            return False
+        if response.status_code not in (200, 202):
+            logger.warning(f"Server returned status {response.status_code}")
+            return False
+
+        # 202: queued by a write-behind server; later write failures are only logged there
+        accepted, rejected, retry = [], [], 0
+        for result in results():
+            row_id = ids[result['index']]
+            if result['status'] in ('accepted', 'queued'):
+                accepted.append(row_id)
+            elif result['status'] == 'rejected':
+                # Only invalid samples are rejected; resending them cannot succeed
+                logger.warning(f"Sample rejected by server: {result.get('error')}")
+                rejected.append(row_id)
+            else:
+                # "retry" (database or shard unavailable) or anything unknown: stays spooled
+                retry += 1
+
+        self.spool.ack(accepted)
+        self.spool.reject(rejected)
+        if len(batch) >= self.batch_size:
+            self._grow_batch()
+        upload_samples.inc(len(accepted), result='accepted')
+        if rejected:
+            upload_samples.inc(len(rejected), result='rejected')
+        logger.info(f"Sent {len(accepted)} samples ({len(rejected)} rejected)")
+        # Back off before resending samples left for a retry
+        return not retry
+
+    def _grow_batch(self):
+        """After a full batch went through, win back a tenth of the size a 413 took away"""
+        if self.batch_size < self.max_batch_size:
+            self.batch_size = min(self.max_batch_size,
+                                  self.batch_size + max(1, self.max_batch_size // 10))
+            logger.info(f"Increasing batch size to {self.batch_size}")
+
+    def _sleep(self, seconds):
+        self._wake.wait(seconds)
+        self._wake.clear()
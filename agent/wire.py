@@ -0,0 +1,147 @@
+"""
+Compact upload protocol
+Registers static agent attributes once and delta-encodes sample batches
+"""
+import json
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:  # compact batches are then sent as JSON
+    msgpack = None
+
+PROTOCOL_VERSION = 1
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# Sample fields sent by index; must match the server's wire.FIELDS
+FIELDS = (('cpu_percent',), ('memory', 'used'), ('memory', 'percent'), ('disk', 'used'),
+          ('disk', 'percent'), ('memory', 'total'), ('disk', 'total'),
+          ('summary', 'cpu_percent', 'min'), ('summary', 'cpu_percent', 'max'),
+          ('summary', 'cpu_percent', 'avg'), ('summary', 'cpu_percent', 'p95'),
+          ('summary', 'memory_percent', 'min'), ('summary', 'memory_percent', 'max'),
+          ('summary', 'memory_percent', 'avg'), ('summary', 'memory_percent', 'p95'),
+          ('summary', 'cpu_percent', 'count'))
+CHECK_STATUS_CODES = {'up': 1, 'degraded': 2, 'down': 3}
+
+
+def _epoch_ms(timestamp):
+    return round(datetime.fromisoformat(timestamp).timestamp() * 1000)
+
+
+def _static(sample):
+    """Attributes sent at registration instead of with every sample"""
+    return sample['agent_id'], sample['agent_name'], sample.get('interval')
+
+
+def _target(check):
+    if 'host' in check:
+        return check['host'], 'host'
+    return check.get('url'), 'url'
+
+
+class CompactEncoder:
+    """Registration state and batch encoding for one agent"""
+
+    def __init__(self, register_url, url, targets=()):
+        self.register_url = register_url
+        self.url = url
+        self.static = None   # (agent_id, agent_name, interval) the server has
+        self.target_ids = {}
+        self.mimetype = 'application/json'
+        # Configured targets are registered up front so new checks rarely force a re-registration
+        self._types = {t['target']: t['type'] for t in targets}
+
+    def compatible(self, batch):
+        """Leading (row_id, sample) pairs that share static attributes"""
+        static = _static(batch[0][1])
+        end = 1
+        while end < len(batch) and _static(batch[end][1]) == static:
+            end += 1
+        return batch[:end]
+
+    def needs_registration(self, samples):
+        if self.static != _static(samples[0]):
+            return True
+        return any(_target(check)[0] not in self.target_ids
+                   for sample in samples for check in sample.get('network') or [])
+
+    def registration(self, samples):
+        """Registration body for the agent of samples"""
+        for sample in samples:
+            for check in sample.get('network') or []:
+                target, check_type = _target(check)
+                self._types.setdefault(target, check_type)
+        agent_id, agent_name, interval = _static(samples[0])
+        return {
+            'agent_id': agent_id,
+            'agent_name': agent_name,
+            'interval': interval,
+            'targets': [{'target': t, 'type': c} for t, c in self._types.items()]
+        }
+
+    def registered(self, samples, response):
+        """Remember what the server stored from a registration response"""
+        self.static = _static(samples[0])
+        self.target_ids = response.get('targets', {})
+        use_msgpack = msgpack is not None and 'msgpack' in response.get('formats', [])
+        self.mimetype = MSGPACK_MIMETYPE if use_msgpack else 'application/json'
+
+    def reset(self):
+        """Forget the registration, e.g. after the server answered 409"""
+        self.static = None
+
+    def encode(self, samples):
+        """(body, mimetype) of a compact batch"""
+        base = _epoch_ms(samples[0]['timestamp'])
+        previous = [None] * len(FIELDS)
+        rows = []
+        for sample in samples:
+            system = sample['system']
+            changes = []
+            for index, path in enumerate(FIELDS):
+                value = system
+                for key in path:
+                    value = value.get(key) if isinstance(value, dict) else None
+                if value != previous[index]:
+                    changes += [index, value]
+                    previous[index] = value
+            row = [_epoch_ms(sample['timestamp']) - base, changes]
+            checks = [self._check(check, base) for check in sample.get('network') or []]
+            if checks or 'host' in sample:
+                row.append(checks)
+            if 'host' in sample:
+                # Extended host metrics are passed through unchanged
+                row.append(sample['host'])
+            rows.append(row)
+
+        batch = {'v': PROTOCOL_VERSION, 'agent_id': samples[0]['agent_id'], 'base': base, 'samples': rows}
+        if self.mimetype == MSGPACK_MIMETYPE:
+            return msgpack.packb(batch), self.mimetype
+        return json.dumps(batch, separators=(',', ':')).encode(), self.mimetype
+
+    def _check(self, check, base):
+        entry = [
+            self.target_ids[_target(check)[0]],
+            CHECK_STATUS_CODES.get(check.get('status'), 0),
+            check.get('latency_ms'),
+            _epoch_ms(check['timestamp']) - base if 'timestamp' in check else None,
+            check.get('error')
+        ]
+        while entry[-1] is None:
+            entry.pop()
+        return entry
+
+    def results(self, body, mimetype, count):
+        """Per-sample results in the batch endpoint's shape"""
+        if mimetype == MSGPACK_MIMETYPE:
+            response = msgpack.unpackb(body, raw=False)
+        else:
+            response = json.loads(body)
+        errors = dict((index, error) for index, error in response.get('errors', []))
+        retry = set(response.get('retry', []))
+        return [
+            {'index': i, 'status': 'rejected', 'error': errors[i]} if i in errors
+            else {'index': i, 'status': 'retry'} if i in retry
+            else {'index': i, 'status': 'accepted'}
+            for i in range(count)
+        ]
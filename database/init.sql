@@ -7,45 +7,124 @@ CREATE TABLE IF NOT EXISTS agents (
     agent_name VARCHAR(200) NOT NULL,
     status VARCHAR(20) DEFAULT 'active',
     last_seen TIMESTAMP,
+    expected_interval INTEGER,
+    memory_total BIGINT,
+    disk_total BIGINT,
+    last_sample_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Table: targets (interned network check targets)
+CREATE TABLE IF NOT EXISTS targets (
+    id SERIAL PRIMARY KEY,
+    target VARCHAR(500) UNIQUE NOT NULL,
+    check_type SMALLINT  -- 1 = host, 2 = url
+);
+
 -- Table: system_metrics (store system metrics)
+-- Partitioned by day on timestamp so retention drops whole partitions;
+-- server/retention.py creates the upcoming daily partitions.
+-- memory_total/disk_total are NULL unless they changed since the agent's
+-- previous sample in timestamp order; samples older than the agent's newest
+-- one always keep them (the current values live on agents).
 CREATE TABLE IF NOT EXISTS system_metrics (
-    id SERIAL PRIMARY KEY,
-    agent_id VARCHAR(100) NOT NULL,
+    id SERIAL,
+    agent_ref INTEGER NOT NULL,
     timestamp TIMESTAMP NOT NULL,
-    cpu_percent FLOAT,
-    memory_total BIGINT,
+    cpu_percent REAL,
     memory_used BIGINT,
-    memory_percent FLOAT,
-    disk_total BIGINT,
+    memory_percent REAL,
     disk_used BIGINT,
-    disk_percent FLOAT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (agent_id) REFERENCES agents(agent_id)
-);
+    disk_percent REAL,
+    memory_total BIGINT,
+    disk_total BIGINT,
+    -- High-resolution summary of the interval (NULL unless HIGHRES_INTERVAL is set)
+    cpu_min REAL,
+    cpu_max REAL,
+    cpu_avg REAL,
+    cpu_p95 REAL,
+    memory_min REAL,
+    memory_max REAL,
+    memory_avg REAL,
+    memory_p95 REAL,
+    sample_count SMALLINT,
+    PRIMARY KEY (id, timestamp),
+    FOREIGN KEY (agent_ref) REFERENCES agents(id)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS system_metrics_default PARTITION OF system_metrics DEFAULT;
 
 -- Table: network_checks (store network check results)
+-- Partitioned by day on timestamp, like system_metrics
 CREATE TABLE IF NOT EXISTS network_checks (
-    id SERIAL PRIMARY KEY,
-    agent_id VARCHAR(100) NOT NULL,
+    id SERIAL,
+    agent_ref INTEGER NOT NULL,
+    target_id INTEGER NOT NULL,
     timestamp TIMESTAMP NOT NULL,
-    target VARCHAR(500) NOT NULL,
-    check_type VARCHAR(20),
-    status VARCHAR(20),
-    latency_ms FLOAT,
+    status SMALLINT,  -- 1 = up, 2 = degraded, 3 = down
+    latency_ms REAL,
     error_message TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (agent_id) REFERENCES agents(agent_id)
+    PRIMARY KEY (id, timestamp),
+    FOREIGN KEY (agent_ref) REFERENCES agents(id),
+    FOREIGN KEY (target_id) REFERENCES targets(id)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS network_checks_default PARTITION OF network_checks DEFAULT;
+
+-- Table: host_metrics (extended host metrics, sent with EXTENDED_METRICS=true)
+-- I/O columns are rates per second computed by the agent
+CREATE TABLE IF NOT EXISTS host_metrics (
+    id SERIAL PRIMARY KEY,
+    agent_ref INTEGER NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    cpu_cores TEXT,  -- JSON list of per-core percentages
+    load_1 REAL,
+    load_5 REAL,
+    load_15 REAL,
+    disk_read_bytes REAL,
+    disk_write_bytes REAL,
+    disk_read_ops REAL,
+    disk_write_ops REAL,
+    net_sent_bytes REAL,
+    net_recv_bytes REAL,
+    net_sent_packets REAL,
+    net_recv_packets REAL,
+    process_count INTEGER,
+    FOREIGN KEY (agent_ref) REFERENCES agents(id)
+);
+
+-- Table: filesystem_usage (every mounted filesystem per extended sample)
+CREATE TABLE IF NOT EXISTS filesystem_usage (
+    id SERIAL PRIMARY KEY,
+    agent_ref INTEGER NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    mountpoint VARCHAR(500) NOT NULL,
+    fstype VARCHAR(50),
+    total BIGINT,
+    used BIGINT,
+    percent REAL,
+    FOREIGN KEY (agent_ref) REFERENCES agents(id)
+);
+
+-- Table: process_samples (top processes by CPU and RSS per extended sample)
+CREATE TABLE IF NOT EXISTS process_samples (
+    id SERIAL PRIMARY KEY,
+    agent_ref INTEGER NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    pid INTEGER,
+    name VARCHAR(200),
+    cpu_percent REAL,
+    rss BIGINT,
+    FOREIGN KEY (agent_ref) REFERENCES agents(id)
 );
 
 -- Table: alerts (store alert records)
 CREATE TABLE IF NOT EXISTS alerts (
     id SERIAL PRIMARY KEY,
-    agent_id VARCHAR(100) NOT NULL,
+    agent_ref INTEGER NOT NULL,
     alert_type VARCHAR(50),
+    target_id INTEGER,  -- per-target rules only
     severity VARCHAR(20),
     message TEXT,
     threshold_value FLOAT,
@@ -55,18 +134,135 @@ CREATE TABLE IF NOT EXISTS alerts (
     resolved_at TIMESTAMP,
     notified BOOLEAN DEFAULT FALSE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (agent_id) REFERENCES agents(agent_id)
+    FOREIGN KEY (agent_ref) REFERENCES agents(id),
+    FOREIGN KEY (target_id) REFERENCES targets(id)
+);
+
+-- Table: metric_rollups (downsampled system metrics)
+CREATE TABLE IF NOT EXISTS metric_rollups (
+    id SERIAL PRIMARY KEY,
+    agent_ref INTEGER NOT NULL,
+    resolution INTEGER NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    sample_count INTEGER NOT NULL,
+    cpu_min FLOAT,
+    cpu_max FLOAT,
+    cpu_avg FLOAT,
+    cpu_p95 FLOAT,
+    memory_min FLOAT,
+    memory_max FLOAT,
+    memory_avg FLOAT,
+    memory_p95 FLOAT,
+    disk_min FLOAT,
+    disk_max FLOAT,
+    disk_avg FLOAT,
+    disk_p95 FLOAT,
+    FOREIGN KEY (agent_ref) REFERENCES agents(id),
+    CONSTRAINT uq_metric_rollups_agent_res_bucket UNIQUE (agent_ref, resolution, bucket_start)
+);
+
+-- Table: network_stats (per-target check counts and latency histogram, 5-minute buckets)
+CREATE TABLE IF NOT EXISTS network_stats (
+    id SERIAL PRIMARY KEY,
+    agent_ref INTEGER NOT NULL,
+    target_id INTEGER NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    up_count INTEGER NOT NULL DEFAULT 0,
+    degraded_count INTEGER NOT NULL DEFAULT 0,
+    down_count INTEGER NOT NULL DEFAULT 0,
+    latency_count INTEGER NOT NULL DEFAULT 0,
+    latency_sum FLOAT NOT NULL DEFAULT 0,
+    latency_max FLOAT,
+    lat_00 INTEGER NOT NULL DEFAULT 0,
+    lat_01 INTEGER NOT NULL DEFAULT 0,
+    lat_02 INTEGER NOT NULL DEFAULT 0,
+    lat_03 INTEGER NOT NULL DEFAULT 0,
+    lat_04 INTEGER NOT NULL DEFAULT 0,
+    lat_05 INTEGER NOT NULL DEFAULT 0,
+    lat_06 INTEGER NOT NULL DEFAULT 0,
+    lat_07 INTEGER NOT NULL DEFAULT 0,
+    lat_08 INTEGER NOT NULL DEFAULT 0,
+    lat_09 INTEGER NOT NULL DEFAULT 0,
+    lat_10 INTEGER NOT NULL DEFAULT 0,
+    lat_11 INTEGER NOT NULL DEFAULT 0,
+    lat_12 INTEGER NOT NULL DEFAULT 0,
+    lat_13 INTEGER NOT NULL DEFAULT 0,
+    lat_14 INTEGER NOT NULL DEFAULT 0,
+    lat_15 INTEGER NOT NULL DEFAULT 0,
+    lat_16 INTEGER NOT NULL DEFAULT 0,
+    lat_17 INTEGER NOT NULL DEFAULT 0,
+    lat_18 INTEGER NOT NULL DEFAULT 0,
+    lat_19 INTEGER NOT NULL DEFAULT 0,
+    lat_20 INTEGER NOT NULL DEFAULT 0,
+    lat_21 INTEGER NOT NULL DEFAULT 0,
+    lat_22 INTEGER NOT NULL DEFAULT 0,
+    lat_23 INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (agent_ref) REFERENCES agents(id),
+    FOREIGN KEY (target_id) REFERENCES targets(id),
+    CONSTRAINT uq_network_stats_agent_target_bucket UNIQUE (agent_ref, target_id, bucket_start)
+);
+
+-- Table: network_outages (runs of consecutive failed checks)
+CREATE TABLE IF NOT EXISTS network_outages (
+    id SERIAL PRIMARY KEY,
+    agent_ref INTEGER NOT NULL,
+    target_id INTEGER NOT NULL,
+    started_at TIMESTAMP NOT NULL,
+    ended_at TIMESTAMP,
+    last_failure_at TIMESTAMP NOT NULL,
+    failed_checks INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (agent_ref) REFERENCES agents(id),
+    FOREIGN KEY (target_id) REFERENCES targets(id)
+);
+
+-- Table: alert_states (alert rule streaks, shared by all server workers)
+CREATE TABLE IF NOT EXISTS alert_states (
+    id SERIAL PRIMARY KEY,
+    agent_ref INTEGER NOT NULL,
+    rule VARCHAR(50) NOT NULL,
+    target_id INTEGER NOT NULL DEFAULT 0,  -- targets.id, 0 for agent-wide rules
+    breaches INTEGER NOT NULL DEFAULT 0,
+    clears INTEGER NOT NULL DEFAULT 0,
+    alert_id INTEGER,
+    last_timestamp TIMESTAMP NOT NULL,
+    FOREIGN KEY (agent_ref) REFERENCES agents(id),
+    CONSTRAINT uq_alert_states_key UNIQUE (agent_ref, rule, target_id)
+);
+
+-- Table: job_state (progress markers for background jobs)
+CREATE TABLE IF NOT EXISTS job_state (
+    name VARCHAR(100) PRIMARY KEY,
+    value BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Create indexes for better query performance
+CREATE INDEX IF NOT EXISTS ix_agents_status
+    ON agents(status);
+
+CREATE INDEX IF NOT EXISTS ix_agents_last_seen
+    ON agents(last_seen);
+
 CREATE INDEX IF NOT EXISTS idx_system_metrics_agent_time 
-    ON system_metrics(agent_id, timestamp);
+    ON system_metrics(agent_ref, timestamp);
     
 CREATE INDEX IF NOT EXISTS idx_network_checks_agent_time 
-    ON network_checks(agent_id, timestamp);
+    ON network_checks(agent_ref, timestamp);
     
+CREATE INDEX IF NOT EXISTS idx_host_metrics_agent_time
+    ON host_metrics(agent_ref, timestamp);
+
+CREATE INDEX IF NOT EXISTS idx_filesystem_usage_agent_time
+    ON filesystem_usage(agent_ref, timestamp);
+
+CREATE INDEX IF NOT EXISTS idx_process_samples_agent_time
+    ON process_samples(agent_ref, timestamp);
+
+CREATE INDEX IF NOT EXISTS idx_network_outages_agent_target
+    ON network_outages(agent_ref, target_id, started_at);
+
 CREATE INDEX IF NOT EXISTS idx_alerts_agent_status 
-    ON alerts(agent_id, status);
+    ON alerts(agent_ref, status);
 
 -- Insert sample data for testing (optional)
 INSERT INTO agents (agent_id, agent_name, status, last_seen)
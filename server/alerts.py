@@ -0,0 +1,192 @@
+"""
+Threshold alert engine
+Evaluates alert rules incrementally as samples arrive and records alerts
+"""
+import time
+from datetime import datetime, timezone
+from bootstrap import writing
+from models import db, Alert, AlertState
+
+# Default rules; override with the ALERT_RULES environment variable (JSON list).
+# A rule fires after `for` consecutive breaching samples and resolves after
+# `clear_for` consecutive samples below `clear` (hysteresis).
+DEFAULT_RULES = [
+    {'name': 'cpu_high', 'metric': 'cpu_percent', 'threshold': 90, 'clear': 80,
+     'for': 3, 'severity': 'critical'},
+    {'name': 'memory_high', 'metric': 'memory_percent', 'threshold': 90, 'clear': 85,
+     'for': 3, 'severity': 'warning'},
+    {'name': 'disk_high', 'metric': 'disk_percent', 'threshold': 90, 'clear': 85,
+     'for': 1, 'severity': 'warning'},
+    {'name': 'network_down', 'metric': 'network', 'for': 3, 'severity': 'critical'},
+]
+
+
+def _naive_utc(timestamp):
+    """Timestamps are stored without a time zone, in UTC"""
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class AlertEngine:
+    """
+    Incremental rule evaluator.
+
+    Streak counters are kept per (agent, rule, target) in the alert_states
+    table, so every server worker sees the same streaks and any worker can
+    resolve an alert another one opened. Evaluating a request's samples
+    reads the states of its agents once and commits once; healthy series
+    have no row. Alert rows are written only when an alert opens or resolves.
+    """
+
+    def __init__(self, rules):
+        self.rules = [dict(rule, clear_for=rule.get('clear_for', rule.get('for', 1)))
+                      for rule in rules]
+
+        # Evaluation latency, for instrumentation
+        self.evaluations = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.opened = 0
+        self.resolved = 0
+
+    @writing()
+    def evaluate(self, samples):
+        """
+        Evaluate every rule against written samples, in the order given.
+
+        Samples carry the agent_ref and target ids noted when they were
+        written. Returns a list of (agent_id, event, alert dict) for alerts
+        opened or resolved. A sample older than the newest one already evaluated for
+        its agent (for example replayed from an agent spool) is skipped.
+        Agents send their spool oldest first; a batch sent newest first
+        would only have its first sample evaluated.
+        """
+        started = time.perf_counter()
+        agent_ids = {sample['agent_ref']: sample['agent_id'] for sample in samples}
+        targets = {check['target_id']: check['target']
+                   for sample in samples for check in sample['checks']}
+        rows = AlertState.query.filter(AlertState.agent_ref.in_(agent_ids))
+        if db.engine.dialect.name == 'postgresql':
+            # Concurrent requests for the same agent wait instead of both stepping a streak
+            rows = rows.with_for_update()
+        states = {(row.agent_ref, row.rule, row.target_id): row for row in rows}
+        last_timestamp = {}
+        for state in states.values():
+            last_timestamp[state.agent_ref] = max(state.last_timestamp,
+                                                  last_timestamp.get(state.agent_ref, state.last_timestamp))
+
+        events = []
+        for sample in samples:
+            agent, timestamp = sample['agent_ref'], _naive_utc(sample['timestamp'])
+            last = last_timestamp.get(agent)
+            if last is not None and timestamp < last:
+                continue
+            last_timestamp[agent] = timestamp
+
+            for rule in self.rules:
+                if rule['metric'] == 'network':
+                    for check in sample['checks']:
+                        events += self._step(states, rule, agent, check['target_id'], timestamp,
+                                             check['status'] == 'down',
+                                             check['status'] != 'down',
+                                             check['latency_ms'], check['target'])
+                else:
+                    value = sample['metric'].get(rule['metric'])
+                    if value is None:
+                        continue
+                    events += self._step(states, rule, agent, 0, timestamp,
+                                         value >= rule['threshold'],
+                                         value < rule['clear'],
+                                         value)
+
+        db.session.commit()
+
+        elapsed = time.perf_counter() - started
+        self.evaluations += len(samples)
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+        return [(agent_ids[alert.agent_ref], event,
+                 alert.to_dict(agent_ids[alert.agent_ref], targets.get(alert.target_id)))
+                for event, alert in events]
+
+    def _step(self, states, rule, agent, target_id, timestamp, breached, cleared, value, target=None):
+        """
+        Advance one rule's streak for an agent (agents.id) and target id (0
+        for agent-wide rules); returns the alert event if it opens or resolves
+        """
+        key = (agent, rule['name'], target_id)
+        state = states.get(key)
+        if state is None:
+            if not breached:
+                return []  # nothing to track for healthy series
+            state = states[key] = AlertState(agent_ref=agent, rule=rule['name'], target_id=target_id,
+                                             breaches=0, clears=0)
+            db.session.add(state)
+        state.last_timestamp = timestamp
+
+        if breached:
+            state.breaches += 1
+            state.clears = 0
+            if state.alert_id is None and state.breaches >= rule['for']:
+                return self._open(state, rule, timestamp, value, target)
+            return []
+
+        # Between the clear and trigger levels both streaks are broken
+        state.breaches = 0
+        state.clears = state.clears + 1 if cleared else 0
+        if state.alert_id is None:
+            self._forget(states, key)
+        elif state.clears >= rule['clear_for']:
+            self._forget(states, key)
+            return self._resolve(state)
+        return []
+
+    def _open(self, state, rule, timestamp, value, target):
+        target_id = state.target_id or None
+        alert = Alert.query.filter_by(
+            agent_ref=state.agent_ref, alert_type=state.rule, target_id=target_id, status='active'
+        ).first()
+        events = []
+        if alert is None:
+            alert = Alert(
+                agent_ref=state.agent_ref,
+                alert_type=state.rule,
+                target_id=target_id,
+                severity=rule['severity'],
+                message=self._message(rule, target, value),
+                threshold_value=rule.get('threshold'),
+                actual_value=value,
+                status='active',
+                triggered_at=timestamp
+            )
+            db.session.add(alert)
+            db.session.flush()
+            self.opened += 1
+            events.append(('alert_opened', alert))
+        state.alert_id = alert.id
+        return events
+
+    def _resolve(self, state):
+        alert = db.session.get(Alert, state.alert_id)
+        if alert is None or alert.status != 'active':
+            return []
+        alert.status = 'resolved'
+        alert.resolved_at = datetime.now(timezone.utc)
+        self.resolved += 1
+        return [('alert_resolved', alert)]
+
+    @staticmethod
+    def _forget(states, key):
+        state = states.pop(key)
+        if state.id is None:
+            db.session.expunge(state)
+        else:
+            db.session.delete(state)
+
+    @staticmethod
+    def _message(rule, target, value):
+        if rule['metric'] == 'network':
+            return f"Network check to {target} failed {rule['for']} times in a row"
+        name = rule['metric'].replace('_percent', '')
+        return f"{name.capitalize()} usage {value:.1f}% is above {rule['threshold']}%"
@@ -2,12 +2,36 @@
 Flask API Server
 Receives metrics from agents and provides API endpoints
 """
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
 from datetime import datetime, timezone, timedelta
+from sqlalchemy import select
 from config import Config
-from models import db, Agent, SystemMetric, NetworkCheck
+from models import db, Agent, Alert, Target, HostMetric, FilesystemUsage, ProcessSample, agent_ref
+from alerts import DEFAULT_RULES, AlertEngine
+from bootstrap import configure_engine, init_db
+from cache import LatestStateCache
+from columnar import BINARY_MIMETYPE, pack_columns, to_columns
+from events import EventBroker, format_sse
+from export import FORMATS as EXPORT_FORMATS, ExportError, parse_export, stream_export
+from handoff import HandoffError, drop_agent, import_rows
+from ingest import RetryLater, SampleError, decode_body, parse_sample
+from instrumentation import LogSummary, Registry, WorkerMetrics
+from jobs import BackgroundJobs
+from liveness import STATUSES, LivenessTracker
+from network_stats import outages, target_stats
+from query import QueryCache, QueryError, parse_query
+from retention import run_retention
+from rollup import choose_resolution, run_rollup, to_epoch
+from storage import create_storage
+from writer import WriteBehindQueue
+from wire import (PROTOCOL_VERSION, ResyncRequired, decode_payload, encode_response,
+                  expand_batch, formats, register)
+import atexit
+import json
 import os
+import time
+import zlib
 
 app = Flask(__name__, 
             template_folder='../webapp/templates',
@@ -18,9 +42,163 @@ app.config.from_object(Config)
 CORS(app)
 db.init_app(app)
 
-# Create tables if they don't exist
 with app.app_context():
-    db.create_all()
+    configure_engine(db.engine)
+    # Local runs create missing tables here; production runs manage.py init-db once
+    if Config.AUTO_CREATE_SCHEMA:
+        init_db()
+
+# Where system metric samples are written and read back (STORAGE_BACKEND)
+storage = create_storage(Config)
+
+# In-memory view of each agent's latest state; changes are pushed to stream subscribers
+event_broker = EventBroker(Config.STREAM_QUEUE_SIZE)
+latest_cache = LatestStateCache(
+    Config.CACHE_REFRESH_SECONDS,
+    listener=lambda agent_id, delta: event_broker.publish(agent_id, 'update', dict(delta, agent_id=agent_id)),
+    storage=storage
+)
+
+# Incremental threshold alerts
+alert_engine = AlertEngine(Config.ALERT_RULES or DEFAULT_RULES)
+
+# Results of /api/v1/query, reused while their time window is unchanged
+query_cache = QueryCache(Config.QUERY_CACHE_SIZE, Config.QUERY_MAX_RESULTS)
+
+# Periodic maintenance
+background_jobs = BackgroundJobs(app, Config.JOB_LEASE_SECONDS)
+background_jobs.add('rollup', Config.ROLLUP_INTERVAL, run_rollup)
+background_jobs.add('retention', Config.RETENTION_INTERVAL, run_retention)
+if storage.name == 'chunks' and Config.RETENTION_SYSTEM_METRICS_DAYS:
+    background_jobs.add('chunk_retention', Config.RETENTION_INTERVAL, lambda: storage.expire(
+        datetime.now(timezone.utc) - timedelta(days=Config.RETENTION_SYSTEM_METRICS_DAYS)))
+
+# Heartbeat deadlines flip silent agents to stale/offline
+liveness = LivenessTracker(
+    app,
+    default_interval=Config.LIVENESS_DEFAULT_INTERVAL,
+    stale_factor=Config.LIVENESS_STALE_FACTOR,
+    offline_factor=Config.LIVENESS_OFFLINE_FACTOR,
+    on_change=latest_cache.set_status
+)
+
+if Config.BACKGROUND_JOBS:
+    background_jobs.start()
+    liveness.start()
+
+# Self-monitoring, exposed at /internal/metrics
+metrics = Registry()
+request_seconds = metrics.histogram(
+    'monitor_http_request_duration_seconds', 'HTTP request duration by route',
+    ('route', 'method', 'status'))
+ingest_phase_seconds = metrics.histogram(
+    'monitor_ingest_phase_seconds', 'Time spent in each ingest phase (parse, db, post_write, serialize)',
+    ('endpoint', 'phase'))
+ingest_samples = metrics.counter(
+    'monitor_ingest_samples_total', 'Samples received by result', ('result',))
+ingest_rows = metrics.counter(
+    'monitor_ingest_rows_total', 'Rows inserted by table', ('table',))
+metrics.counter('monitor_cache_hits_total', 'Latest-state cache reads served without a reload')\
+    .set_function(lambda: latest_cache.hits)
+metrics.counter('monitor_cache_misses_total', 'Latest-state cache reads that reloaded from the database')\
+    .set_function(lambda: latest_cache.misses)
+metrics.counter('monitor_query_cache_hits_total', 'Aggregate queries answered from the result cache')\
+    .set_function(lambda: query_cache.hits)
+metrics.counter('monitor_query_cache_misses_total', 'Aggregate queries executed against the database')\
+    .set_function(lambda: query_cache.misses)
+metrics.gauge('monitor_stream_subscribers', 'Open Server-Sent Events streams in this process')\
+    .set_function(lambda: event_broker.subscriber_count())
+metrics.counter('monitor_stream_events_total', 'Events published to stream subscribers')\
+    .set_function(lambda: event_broker.published)
+metrics.gauge('monitor_liveness_pending', 'Heartbeat deadlines queued in the liveness heap')\
+    .set_function(lambda: liveness.pending())
+metrics.counter('monitor_liveness_transitions_total', 'Agents moved to stale or offline')\
+    .set_function(lambda: liveness.transitions)
+metrics.counter('monitor_alert_evaluations_total', 'Samples evaluated against alert rules')\
+    .set_function(lambda: alert_engine.evaluations)
+metrics.counter('monitor_alert_evaluation_seconds_total', 'Total time spent evaluating alert rules')\
+    .set_function(lambda: alert_engine.total_seconds)
+metrics.gauge('monitor_alert_evaluation_max_seconds', 'Slowest single alert evaluation')\
+    .set_function(lambda: alert_engine.max_seconds)
+
+# Under gunicorn every worker has its own registry; share them so scrapes
+# add up whichever worker answers. Registered for exit before the write
+# queue, so the final flush runs after the queue is written out.
+worker_metrics = None
+if Config.METRICS_DIR:
+    worker_metrics = WorkerMetrics(metrics, Config.METRICS_DIR, Config.METRICS_FLUSH_INTERVAL)
+    worker_metrics.start()
+    atexit.register(worker_metrics.flush)
+
+# One aggregated info line per interval instead of one per request
+ingest_log = LogSummary(app.logger, Config.LOG_SUMMARY_INTERVAL)
+
+# Optional write-behind ingest: requests are acknowledged once queued
+write_queue = None
+if Config.WRITE_BEHIND:
+    def write_queued(samples):
+        with ingest_phase_seconds.time(endpoint='write_behind', phase='db'):
+            errors = storage.write(samples)
+        with ingest_phase_seconds.time(endpoint='write_behind', phase='post_write'):
+            after_write(samples, errors)
+        # Already acknowledged, so transient failures go back on the queue
+        return [s for s, e in zip(samples, errors) if isinstance(e, RetryLater)]
+
+    write_queue = WriteBehindQueue(
+        app, write_queued,
+        max_samples=Config.WRITE_QUEUE_MAX_SAMPLES,
+        batch_samples=Config.WRITE_BATCH_SAMPLES,
+        max_delay=Config.WRITE_MAX_DELAY
+    )
+    write_queue.start()
+    # Flush on graceful shutdown (gunicorn worker exit, Ctrl-C)
+    atexit.register(write_queue.stop)
+    metrics.gauge('monitor_write_queue_depth', 'Samples waiting for the write-behind writer')\
+        .set_function(lambda: write_queue.depth())
+    metrics.counter('monitor_write_queue_refused_total', 'Samples refused with 429 because the queue was full')\
+        .set_function(lambda: write_queue.refused)
+    metrics.counter('monitor_write_queue_commits_total', 'Group commits made by the writer')\
+        .set_function(lambda: write_queue.commits)
+    metrics.counter('monitor_write_queue_failed_commits_total', 'Group commits that raised and were retried')\
+        .set_function(lambda: write_queue.failed_commits)
+    metrics.counter('monitor_write_queue_retried_total', 'Samples put back on the queue to be written again')\
+        .set_function(lambda: write_queue.retried)
+
+def queue_full():
+    """429 response asking the agent to retry later"""
+    response = jsonify({'status': 'error', 'message': 'Write queue is full'})
+    response.headers['Retry-After'] = str(Config.WRITE_RETRY_AFTER)
+    return response, 429
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """413 for bodies over MAX_CONTENT_LENGTH, as JSON like the other ingest errors"""
+    return jsonify({
+        'status': 'error',
+        'message': f'Request body exceeds {Config.MAX_CONTENT_LENGTH} bytes'
+    }), 413
+
+def retry_later(message):
+    """503 response for a write that failed for a transient reason"""
+    response = jsonify({'status': 'error', 'message': message})
+    response.headers['Retry-After'] = str(Config.WRITE_RETRY_AFTER)
+    return response, 503
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Streams stay open for minutes and would swamp the latency histogram
+    if request.url_rule is not None and request.endpoint != 'stream_updates':
+        request_seconds.observe(
+            time.perf_counter() - g.request_started,
+            route=request.url_rule.rule,
+            method=request.method,
+            status=str(response.status_code)
+        )
+    return response
 
 @app.route('/')
 def index():
@@ -37,84 +215,467 @@ def agent_detail(agent_id):
     """Agent detail page"""
     return render_template('agent-detail.html')
 
+def after_write(samples, errors):
+    """Propagate successfully written samples to in-memory state"""
+    for sample, error in zip(samples, errors):
+        if isinstance(error, RetryLater):
+            ingest_samples.inc(result='retry')
+            ingest_log.record(retry=1)
+        elif error:
+            ingest_samples.inc(result='rejected')
+            ingest_log.record(rejected=1)
+        else:
+            ingest_samples.inc(result='accepted')
+            ingest_rows.inc(table='system_metrics')
+            if sample['checks']:
+                ingest_rows.inc(len(sample['checks']), table='network_checks')
+            ingest_log.record(sample['agent_id'], samples=1)
+            latest_cache.record(sample)
+            liveness.heartbeat(sample['agent_id'], to_epoch(sample['seen_at']), sample['interval'])
+    if Config.ALERTS_ENABLED:
+        evaluate_alerts([sample for sample, error in zip(samples, errors) if not error])
+
+def evaluate_alerts(samples):
+    """Run alert rules for written samples; failures never fail ingest"""
+    if not samples:
+        return
+    try:
+        for agent_id, event, alert in alert_engine.evaluate(samples):
+            event_broker.publish(agent_id, event, alert)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error evaluating alerts for {len(samples)} samples: {str(e)}")
+
 @app.route('/api/v1/metrics', methods=['POST'])
 def receive_metrics():
     """Receive metrics from agents"""
     try:
-        data = request.json
-        
-        if not data:
-            return jsonify({'status': 'error', 'message': 'No data provided'}), 400
-        
-        # Update or create agent
-        agent = Agent.query.filter_by(agent_id=data['agent_id']).first()
-        if not agent:
-            agent = Agent(
-                agent_id=data['agent_id'],
-                agent_name=data['agent_name']
-            )
-            db.session.add(agent)
-        
-        agent.last_seen = datetime.now(timezone.utc)
-        agent.status = 'active'
-        agent.updated_at = datetime.now(timezone.utc)
-        
-        # Parse timestamp
-        timestamp = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
-        
-        # Save system metrics
-        system_data = data['system']
-        metric = SystemMetric(
-            agent_id=data['agent_id'],
-            timestamp=timestamp,
-            cpu_percent=system_data['cpu_percent'],
-            memory_total=system_data['memory']['total'],
-            memory_used=system_data['memory']['used'],
-            memory_percent=system_data['memory']['percent'],
-            disk_total=system_data['disk']['total'],
-            disk_used=system_data['disk']['used'],
-            disk_percent=system_data['disk']['percent']
-        )
-        db.session.add(metric)
-        
-        # Save network checks
-        for check in data['network']:
-            net_check = NetworkCheck(
-                agent_id=data['agent_id'],
-                timestamp=timestamp,
-                target=check.get('host') or check.get('url'),
-                check_type='host' if 'host' in check else 'url',
-                status=check['status'],
-                latency_ms=check.get('latency_ms'),
-                error_message=check.get('error')
-            )
-            db.session.add(net_check)
-        
-        db.session.commit()
+        with ingest_phase_seconds.time(endpoint='single', phase='parse'):
+            data = request.json
+            
+            if not data:
+                return jsonify({'status': 'error', 'message': 'No data provided'}), 400
+            
+            sample = parse_sample(data)
+        if write_queue is not None:
+            if not write_queue.submit([sample]):
+                return queue_full()
+            return jsonify({
+                'status': 'queued',
+                'message': 'Metrics queued',
+                'timestamp': datetime.now(timezone.utc).isoformat()
+            }), 202
+        with ingest_phase_seconds.time(endpoint='single', phase='db'):
+            errors = storage.write([sample])
+        with ingest_phase_seconds.time(endpoint='single', phase='post_write'):
+            after_write([sample], errors)
+        if isinstance(errors[0], RetryLater):
+            return retry_later(errors[0])
+        if errors[0]:
+            # The database refused this sample; sending it again will not help
+            ingest_samples.inc(result='rejected')
+            ingest_log.record(rejected=1)
+            return jsonify({'status': 'error', 'message': str(errors[0])}), 422
         
-        app.logger.info(f"Metrics received from {data['agent_name']}")
+        with ingest_phase_seconds.time(endpoint='single', phase='serialize'):
+            return jsonify({
+                'status': 'success',
+                'message': 'Metrics received',
+                'timestamp': datetime.now(timezone.utc).isoformat()
+            }), 200
         
+    except SampleError as e:
+        ingest_samples.inc(result='rejected')
+        ingest_log.record(rejected=1)
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error receiving metrics: {str(e)}")
         return jsonify({
-            'status': 'success',
-            'message': 'Metrics received',
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/v1/metrics/batch', methods=['POST'])
+def receive_metrics_batch():
+    """Receive a batch of samples, optionally gzip/zstd compressed"""
+    try:
+        with ingest_phase_seconds.time(endpoint='batch', phase='decode'):
+            raw = decode_body(request.get_data(),
+                              request.headers.get('Content-Encoding'),
+                              Config.MAX_BATCH_BYTES)
+            payload = json.loads(raw)
+    except SampleError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except (ValueError, OSError, zlib.error) as e:
+        return jsonify({'status': 'error', 'message': f'Invalid request body: {e}'}), 400
+    
+    samples = payload.get('samples') if isinstance(payload, dict) else payload
+    if not isinstance(samples, list):
+        return jsonify({'status': 'error', 'message': 'Expected a list of samples'}), 400
+    if len(samples) > Config.MAX_BATCH_SAMPLES:
+        return jsonify({
+            'status': 'error',
+            'message': f'Batch exceeds {Config.MAX_BATCH_SAMPLES} samples'
+        }), 413
+    
+    # Validate every sample first; only valid ones go to the database
+    results = [None] * len(samples)
+    valid, positions = [], []
+    with ingest_phase_seconds.time(endpoint='batch', phase='parse'):
+        for index, data in enumerate(samples):
+            try:
+                valid.append(parse_sample(data))
+                positions.append(index)
+            except SampleError as e:
+                results[index] = {'index': index, 'status': 'rejected', 'error': str(e)}
+    if len(valid) < len(samples):
+        ingest_samples.inc(len(samples) - len(valid), result='rejected')
+        ingest_log.record(rejected=len(samples) - len(valid))
+    
+    if write_queue is not None:
+        if not write_queue.submit(valid):
+            return queue_full()
+        for index in positions:
+            results[index] = {'index': index, 'status': 'queued'}
+        ingest_log.record(batches=1)
+        return jsonify({
+            'status': 'queued',
+            'queued': len(valid),
+            'rejected': len(samples) - len(valid),
+            'results': results,
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        }), 202
+    
+    try:
+        with ingest_phase_seconds.time(endpoint='batch', phase='db'):
+            errors = storage.write(valid)
+        with ingest_phase_seconds.time(endpoint='batch', phase='post_write'):
+            after_write(valid, errors)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error writing metrics batch: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    
+    for index, error in zip(positions, errors):
+        if isinstance(error, RetryLater):
+            results[index] = {'index': index, 'status': 'retry', 'error': error}
+        elif error:
+            results[index] = {'index': index, 'status': 'rejected', 'error': error}
+        else:
+            results[index] = {'index': index, 'status': 'accepted'}
+    if errors and all(isinstance(error, RetryLater) for error in errors):
+        return retry_later(errors[0])
+    
+    accepted = sum(1 for r in results if r['status'] == 'accepted')
+    retry = sum(1 for r in results if r['status'] == 'retry')
+    ingest_log.record(batches=1)
+    
+    with ingest_phase_seconds.time(endpoint='batch', phase='serialize'):
+        return jsonify({
+            'status': 'success' if accepted == len(samples) else 'partial',
+            'accepted': accepted,
+            'rejected': len(samples) - accepted - retry,
+            'retry': retry,
+            'results': results,
             'timestamp': datetime.now(timezone.utc).isoformat()
         }), 200
+
+@app.route('/api/v1/agents/register', methods=['POST'])
+def register_agent():
+    """Register an agent's static attributes for compact batches"""
+    try:
+        data = decode_payload(request.get_data(), request.mimetype)
+        target_ids = register(data)
+        return jsonify({
+            'status': 'success',
+            'protocol': PROTOCOL_VERSION,
+            'formats': formats(),
+            'targets': target_ids
+        }), 200
+    except SampleError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error registering agent: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/v1/metrics/compact', methods=['POST'])
+def receive_metrics_compact():
+    """Receive a delta-encoded batch from a registered agent"""
+    mimetype = request.mimetype
+    try:
+        with ingest_phase_seconds.time(endpoint='compact', phase='decode'):
+            raw = decode_body(request.get_data(),
+                              request.headers.get('Content-Encoding'),
+                              Config.MAX_BATCH_BYTES)
+            payload = decode_payload(raw, mimetype)
+        if isinstance(payload, dict) and isinstance(payload.get('samples'), list) \
+                and len(payload['samples']) > Config.MAX_BATCH_SAMPLES:
+            return jsonify({
+                'status': 'error',
+                'message': f'Batch exceeds {Config.MAX_BATCH_SAMPLES} samples'
+            }), 413
+        with ingest_phase_seconds.time(endpoint='compact', phase='parse'):
+            parsed = expand_batch(payload)
+    except ResyncRequired as e:
+        # The agent registers again and resends the batch
+        return jsonify({'status': 'error', 'message': str(e)}), 409
+    except SampleError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except (ValueError, OSError, zlib.error) as e:
+        return jsonify({'status': 'error', 'message': f'Invalid request body: {e}'}), 400
+
+    errors = {index: str(p) for index, p in enumerate(parsed) if isinstance(p, SampleError)}
+    valid = [p for p in parsed if not isinstance(p, SampleError)]
+    positions = [index for index in range(len(parsed)) if index not in errors]
+    if errors:
+        ingest_samples.inc(len(errors), result='rejected')
+        ingest_log.record(rejected=len(errors))
+
+    if write_queue is not None:
+        if not write_queue.submit(valid):
+            return queue_full()
+        ingest_log.record(batches=1)
+        body, content_type = encode_response({
+            'status': 'queued',
+            'queued': len(valid),
+            'rejected': len(errors),
+            'errors': sorted([index, error] for index, error in errors.items())
+        }, mimetype)
+        return Response(body, status=202, mimetype=content_type)
+
+    try:
+        with ingest_phase_seconds.time(endpoint='compact', phase='db'):
+            write_errors = storage.write(valid)
+        with ingest_phase_seconds.time(endpoint='compact', phase='post_write'):
+            after_write(valid, write_errors)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error writing compact batch: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    retry = []
+    for index, error in zip(positions, write_errors):
+        if isinstance(error, RetryLater):
+            retry.append(index)
+        elif error:
+            errors[index] = error
+    if write_errors and len(retry) == len(write_errors):
+        return retry_later(write_errors[0])
+    ingest_log.record(batches=1)
+
+    with ingest_phase_seconds.time(endpoint='compact', phase='serialize'):
+        # Only rejected and retry samples are listed; the rest were accepted
+        body, content_type = encode_response({
+            'status': 'success' if not errors and not retry else 'partial',
+            'accepted': len(parsed) - len(errors) - len(retry),
+            'rejected': len(errors),
+            'errors': sorted([index, error] for index, error in errors.items()),
+            'retry': retry
+        }, mimetype)
+        return Response(body, status=200, mimetype=content_type)
+
+@app.route('/api/v1/agents', methods=['GET'])
+def get_agents():
+    """Get list of all agents, optionally filtered by ?status="""
+    try:
+        status = request.args.get('status')
+        if status:
+            if status not in STATUSES:
+                return jsonify({
+                    'status': 'error',
+                    'message': f"status must be one of {', '.join(STATUSES)}"
+                }), 400
+            # Served by the index on agents.status
+            agents = Agent.query.filter_by(status=status).all()
+            return jsonify({'agents': [agent.to_dict() for agent in agents]})
         
+        latest_cache.ensure_fresh()
+        return jsonify({
+            'agents': latest_cache.agents()
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/v1/overview', methods=['GET'])
+def get_overview():
+    """Get all agents with their latest metrics in one response"""
+    try:
+        latest_cache.ensure_fresh()
+        body, etag = latest_cache.overview()
+        
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        # Browsers must revalidate, which costs only a 304 when unchanged
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/v1/stream', methods=['GET'])
+def stream_updates():
+    """Server-Sent Events stream of agent changes (optionally ?agent_id=a,b)"""
+    agent_ids = [a for a in request.args.get('agent_id', '').split(',') if a]
+    if event_broker.subscriber_count() >= Config.STREAM_MAX_CLIENTS:
+        # Keep request threads free for ingest; the web pages poll and retry later
+        response = jsonify({'status': 'error', 'message': 'Too many open streams, poll instead'})
+        response.headers['Retry-After'] = str(Config.STREAM_MAX_SECONDS)
+        return response, 503
+    subscription = event_broker.subscribe(agent_ids)
+    
+    def generate():
+        deadline = time.monotonic() + Config.STREAM_MAX_SECONDS
+        try:
+            yield 'retry: 5000\n\n'
+            while time.monotonic() < deadline:
+                event = subscription.get(timeout=Config.STREAM_KEEPALIVE_SECONDS)
+                if event is None:
+                    # Idle: pick up writes from other workers, then keep the connection alive
+                    latest_cache.ensure_fresh()
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_sse(*event)
+        finally:
+            event_broker.unsubscribe(subscription)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/v1/alerts', methods=['GET'])
+def get_alerts():
+    """Get alerts, optionally filtered by ?status= and ?agent_id="""
+    try:
+        query = select(Alert, Agent.agent_id, Target.target)\
+            .join(Agent, Agent.id == Alert.agent_ref)\
+            .outerjoin(Target, Target.id == Alert.target_id)
+        if request.args.get('agent_id'):
+            query = query.where(Agent.agent_id == request.args['agent_id'])
+        if request.args.get('status'):
+            query = query.where(Alert.status == request.args['status'])
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        
+        alerts = db.session.execute(query.order_by(Alert.triggered_at.desc()).limit(limit)).all()
+        return jsonify({'alerts': [alert.to_dict(agent_id, target)
+                                   for alert, agent_id, target in alerts]})
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/v1/query', methods=['GET'])
+def aggregate_query():
+    """Fleet-wide aggregates, e.g. ?metric=cpu&agg=p95&group_by=agent&hours=6&top=20"""
+    try:
+        query = parse_query(request.args)
+        result, cached = query_cache.get_or_compute(query)
+        return jsonify(dict(result, query=query, cached=cached))
+    except QueryError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         db.session.rollback()
-        app.logger.error(f"Error receiving metrics: {str(e)}")
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
 
-@app.route('/api/v1/agents', methods=['GET'])
-def get_agents():
-    """Get list of all agents"""
+@app.route('/api/v1/export', methods=['GET'])
+def export_history():
+    """Stream raw rows, e.g. ?source=system&agent_id=a,b&start=...&end=...&format=csv"""
+    try:
+        export = parse_export(request.args)
+        if export['source'] == 'system' and storage.name != 'sql':
+            raise ExportError('System metric export reads the SQL backend only')
+    except ExportError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    filename = f"{export['source']}-{export['start']:%Y%m%dT%H%M}.{export['format']}"
+    return Response(
+        stream_with_context(stream_export(export, Config.EXPORT_CHUNK_ROWS)),
+        mimetype=EXPORT_FORMATS[export['format']],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/api/v1/network/<agent_id>', methods=['GET'])
+def get_network_stats(agent_id):
+    """Uptime and latency percentiles per network target over ?hours="""
     try:
-        agents = Agent.query.all()
+        hours = float(request.args.get('hours', 24))
+        start_time = datetime.now(timezone.utc) - timedelta(hours=hours)
+        
         return jsonify({
-            'agents': [agent.to_dict() for agent in agents]
+            'agent_id': agent_id,
+            'time_range_hours': hours,
+            'targets': target_stats(agent_id, start_time)
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/v1/network/<agent_id>/outages', methods=['GET'])
+def get_network_outages(agent_id):
+    """Outage timeline of an agent's network targets (?hours=, ?target=)"""
+    try:
+        hours = float(request.args.get('hours', 24))
+        start_time = datetime.now(timezone.utc) - timedelta(hours=hours)
+        rows = outages(agent_id, start_time, target=request.args.get('target'))
+        
+        return jsonify({
+            'agent_id': agent_id,
+            'time_range_hours': hours,
+            'outages': rows
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/v1/host/<agent_id>', methods=['GET'])
+def get_host_metrics(agent_id):
+    """Extended host metrics over ?hours= plus the latest filesystems and top processes"""
+    try:
+        hours = float(request.args.get('hours', 1))
+        start_time = datetime.now(timezone.utc) - timedelta(hours=hours)
+        ref = agent_ref(agent_id)
+        
+        rows = HostMetric.query.filter(
+            HostMetric.agent_ref == ref,
+            HostMetric.timestamp >= start_time
+        ).order_by(HostMetric.timestamp.asc()).all()
+        
+        # Filesystems and processes of the newest extended sample
+        latest = rows[-1].timestamp if rows else None
+        filesystems = FilesystemUsage.query.filter(
+            FilesystemUsage.agent_ref == ref,
+            FilesystemUsage.timestamp == latest
+        ).order_by(FilesystemUsage.mountpoint).all() if latest else []
+        processes = ProcessSample.query.filter(
+            ProcessSample.agent_ref == ref,
+            ProcessSample.timestamp == latest
+        ).order_by(ProcessSample.cpu_percent.desc()).all() if latest else []
+        
+        return jsonify({
+            'agent_id': agent_id,
+            'time_range_hours': hours,
+            'metrics': [row.to_dict() for row in rows],
+            'filesystems': [fs.to_dict() for fs in filesystems],
+            'processes': [process.to_dict() for process in processes]
         })
     except Exception as e:
         return jsonify({
@@ -126,8 +687,8 @@ def get_agents():
 def get_latest_metrics(agent_id):
     """Get latest metrics for an agent"""
     try:
-        metric = SystemMetric.query.filter_by(agent_id=agent_id)\
-            .order_by(SystemMetric.timestamp.desc()).first()
+        latest_cache.ensure_fresh()
+        metric = latest_cache.latest(agent_id)
         
         if not metric:
             return jsonify({
@@ -135,7 +696,7 @@ def get_latest_metrics(agent_id):
                 'message': 'No metrics found'
             }), 404
         
-        return jsonify(metric.to_dict())
+        return jsonify(metric)
         
     except Exception as e:
         return jsonify({
@@ -145,22 +706,48 @@ def get_latest_metrics(agent_id):
 
 @app.route('/api/v1/metrics/<agent_id>', methods=['GET'])
 def get_metrics_history(agent_id):
-    """Get historical metrics for an agent"""
+    """Get historical metrics for an agent (?format=rows|columnar|binary)"""
     try:
-        # Get time range from query parameters
+        # Get time range and resolution from query parameters
         hours = int(request.args.get('hours', 24))
+        max_points = int(request.args.get('max_points', Config.HISTORY_MAX_POINTS))
+        step = request.args.get('step', type=int)
+        output = request.args.get('format', 'rows')
+        if output not in ('rows', 'columnar', 'binary'):
+            return jsonify({
+                'status': 'error',
+                'message': 'format must be one of rows, columnar, binary'
+            }), 400
         start_time = datetime.now(timezone.utc) - timedelta(hours=hours)
         
-        # Query metrics
-        metrics = SystemMetric.query.filter(
-            SystemMetric.agent_id == agent_id,
-            SystemMetric.timestamp >= start_time
-        ).order_by(SystemMetric.timestamp.asc()).all()
+        # Use the coarsest rollup that still gives enough points
+        resolution = choose_resolution(hours * 3600, max_points, step)
+        
+        if output != 'rows':
+            # Parallel arrays without building ORM objects
+            rows, resolution = storage.history(agent_id, resolution, start_time,
+                                               peaks=output == 'columnar')
+            
+            if output == 'binary':
+                response = Response(pack_columns(rows, resolution), mimetype=BINARY_MIMETYPE)
+                response.headers['X-Resolution'] = str(resolution or 'raw')
+                return response
+            
+            return jsonify(dict(
+                to_columns(rows),
+                agent_id=agent_id,
+                time_range_hours=hours,
+                resolution=resolution or 'raw',
+                count=len(rows)
+            ))
+        
+        metrics, resolution = storage.history_records(agent_id, resolution, start_time)
         
         return jsonify({
             'agent_id': agent_id,
             'time_range_hours': hours,
-            'metrics': [m.to_dict() for m in metrics]
+            'resolution': resolution or 'raw',
+            'metrics': metrics
         })
         
     except Exception as e:
@@ -169,6 +756,51 @@ def get_metrics_history(agent_id):
             'message': str(e)
         }), 500
 
+@app.route('/internal/metrics', methods=['GET'])
+def internal_metrics():
+    """Server self-monitoring in the Prometheus text format"""
+    if Config.METRICS_TOKEN and \
+            request.headers.get('Authorization') != f'Bearer {Config.METRICS_TOKEN}':
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    return Response((worker_metrics or metrics).render(), mimetype='text/plain; version=0.0.4')
+
+def _shard_authorized():
+    return not Config.SHARD_TOKEN or \
+        request.headers.get('Authorization') == f'Bearer {Config.SHARD_TOKEN}'
+
+@app.route('/internal/agents/<agent_id>/import', methods=['POST'])
+def import_agent_rows(agent_id):
+    """Rows of an agent handed over by another shard: {agent_name, source, rows}"""
+    if not _shard_authorized():
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('rows'), list):
+        return jsonify({'status': 'error', 'message': 'Expected {agent_name, source, rows}'}), 400
+    try:
+        imported = import_rows(agent_id, data.get('agent_name'), data.get('source'), data['rows'])
+        latest_cache.invalidate()
+        return jsonify({'status': 'success', 'imported': imported,
+                        'skipped': len(data['rows']) - imported})
+    except HandoffError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Import for {agent_id} failed: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/internal/agents/<agent_id>', methods=['DELETE'])
+def delete_agent(agent_id):
+    """Drop an agent that was handed over to another shard"""
+    if not _shard_authorized():
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    try:
+        deleted = drop_agent(agent_id)
+        latest_cache.forget(agent_id)
+        return jsonify({'status': 'success', 'deleted': deleted})
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Dropping {agent_id} failed: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 if __name__ == '__main__':
     app.run(
         host=Config.HOST,
@@ -0,0 +1,104 @@
+"""
+Database bootstrap
+Per-connection SQLite settings and one-shot schema setup outside the web workers
+"""
+import contextvars
+import logging
+from contextlib import contextmanager
+from flask import Flask
+from sqlalchemy import event, text
+from config import Config
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key serializing concurrent init-db runs on PostgreSQL
+SCHEMA_LOCK_ID = 7301
+
+# True while a write path runs (see writing())
+_writing = contextvars.ContextVar('writing', default=False)
+
+
+def configure_engine(engine, config=Config):
+    """Apply the SQLite pragmas and transaction mode from config to engine"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        if config.SQLITE_BEGIN_IMMEDIATE:
+            # Let SQLAlchemy's begin event below issue BEGIN instead of pysqlite
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.close()
+
+    if config.SQLITE_BEGIN_IMMEDIATE:
+        @event.listens_for(engine, 'begin')
+        def on_begin(connection):
+            if connection.get_execution_options().get('isolation_level') != 'AUTOCOMMIT':
+                # Reads begin deferred and never wait for the writer
+                connection.exec_driver_sql('BEGIN IMMEDIATE' if _writing.get() else 'BEGIN')
+
+
+@contextmanager
+def writing():
+    """
+    Run the transactions begun inside the block as write transactions.
+
+    On SQLite (with SQLITE_BEGIN_IMMEDIATE) they start with BEGIN IMMEDIATE,
+    taking the write lock up front, so a read-then-write transaction cannot
+    fail to upgrade its lock. Transactions elsewhere begin deferred. A
+    transaction the session already has open is committed first, as it was
+    begun deferred. Also usable as a decorator; nesting is a no-op.
+    """
+    if _writing.get():
+        yield
+        return
+    if db.session().in_transaction():
+        db.session.commit()
+    token = _writing.set(True)
+    try:
+        yield
+    finally:
+        _writing.reset(token)
+
+
+def create_app():
+    """Bare app with the database configured, for commands that do not serve requests"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine)
+    return app
+
+
+@writing()
+def init_db():
+    """
+    Create missing tables and add columns introduced since they were created.
+
+    Holds the database's schema lock while doing so, so several processes
+    starting at once do not race on CREATE TABLE. Returns the columns added.
+    """
+    from migrate import add_columns
+
+    with db.engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text('SELECT pg_advisory_lock(:id)'), {'id': SCHEMA_LOCK_ID})
+        elif connection.dialect.name == 'sqlite' and not Config.SQLITE_BEGIN_IMMEDIATE:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+        try:
+            db.metadata.create_all(bind=connection)
+            connection.commit()
+        finally:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': SCHEMA_LOCK_ID})
+                connection.commit()
+    added = add_columns()
+    if added:
+        logger.info(f"Added columns: {', '.join(added)}")
+    return added
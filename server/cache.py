@@ -0,0 +1,193 @@
+"""
+Latest-state cache
+Keeps every agent's status and most recent sample in memory
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import timezone
+from models import Agent
+from storage import SQLStorage
+
+
+def iso_utc(ts):
+    """Format a timestamp the way the database returns it (naive UTC)"""
+    if ts is None:
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts.isoformat()
+
+
+class LatestStateCache:
+    """
+    Write-through cache of agents and their latest metrics.
+
+    Ingest updates the cache after each commit. Every gunicorn worker has
+    its own copy, so the cache is also reloaded from the database every
+    `refresh_interval` seconds to pick up samples written by other workers.
+    A reload reads the agents table and fetches latest metrics only for
+    agents whose newest sample time (agents.last_sample_at) moved.
+    
+    If `listener` is set it is called as listener(agent_id, delta) for
+    every change, where delta holds only the fields that changed. Latest
+    metrics are read from `storage` (the SQL backend by default).
+    """
+
+    def __init__(self, refresh_interval=15, listener=None, storage=None):
+        self.refresh_interval = refresh_interval
+        self.listener = listener
+        self.storage = storage or SQLStorage()
+        self._lock = threading.Lock()
+        self._agents = {}
+        self._latest = {}
+        self._sample_at = {}  # agents.last_sample_at as of the last reload
+        self._loaded_at = None
+        self._overview = None  # (body, etag), rebuilt lazily after changes
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Replace the cache contents with the current database state"""
+        rows = Agent.query.all()
+        agents = {a.agent_id: a.to_dict() for a in rows}
+        sample_at = {a.agent_id: a.last_sample_at for a in rows if a.last_sample_at}
+
+        with self._lock:
+            moved = [agent_id for agent_id, timestamp in sample_at.items()
+                     if timestamp != self._sample_at.get(agent_id) or agent_id not in self._latest]
+            latest = {agent_id: metric for agent_id, metric in self._latest.items() if agent_id in agents}
+        latest.update(self.storage.latest_many(moved))
+
+        with self._lock:
+            deltas = []
+            if agents != self._agents or latest != self._latest:
+                for agent_id in agents.keys() | latest.keys():
+                    delta = self._delta(agent_id, agents.get(agent_id), latest.get(agent_id))
+                    if delta:
+                        deltas.append((agent_id, delta))
+                self._agents = agents
+                self._latest = latest
+                self._overview = None
+            self._sample_at = sample_at
+            self._loaded_at = time.monotonic()
+        
+        self._notify(deltas)
+
+    def ensure_fresh(self):
+        """Reload from the database if the cache is empty or too old"""
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.refresh_interval:
+            self.misses += 1
+            self.load()
+        else:
+            self.hits += 1
+
+    def record(self, sample):
+        """Write-through update for one ingested sample"""
+        agent_id = sample['agent_id']
+        metric = sample['metric']
+
+        with self._lock:
+            agent = dict(self._agents.get(agent_id) or {'agent_id': agent_id})
+            agent['agent_name'] = agent.get('agent_name') or sample['agent_name']
+            agent['status'] = 'active'
+            agent['last_seen'] = iso_utc(sample['seen_at'])
+
+            latest = self._latest.get(agent_id)
+            timestamp = iso_utc(metric['timestamp'])
+            if latest is None or latest['timestamp'] <= timestamp:
+                latest = {
+                    'timestamp': timestamp,
+                    'cpu_percent': metric['cpu_percent'],
+                    'memory_percent': metric['memory_percent'],
+                    'disk_percent': metric['disk_percent']
+                }
+
+            delta = self._delta(agent_id, agent, latest)
+            self._agents[agent_id] = agent
+            self._latest[agent_id] = latest
+            self._overview = None
+
+        self._notify([(agent_id, delta)])
+
+    def set_status(self, agent_id, status):
+        """Update the cached status of an agent"""
+        with self._lock:
+            agent = self._agents.get(agent_id)
+            if not agent or agent.get('status') == status:
+                return
+            agent = dict(agent, status=status)
+            delta = self._delta(agent_id, agent, self._latest.get(agent_id))
+            self._agents[agent_id] = agent
+            self._overview = None
+
+        self._notify([(agent_id, delta)])
+
+    def invalidate(self):
+        """Reload on the next read, e.g. after agents were imported"""
+        self._loaded_at = None
+
+    def forget(self, agent_id):
+        """Drop an agent that no longer lives in this database"""
+        with self._lock:
+            self._agents.pop(agent_id, None)
+            self._latest.pop(agent_id, None)
+            self._sample_at.pop(agent_id, None)
+            self._overview = None
+
+    def _delta(self, agent_id, agent, latest):
+        """Fields of agent/latest that differ from the cached values"""
+        delta = {}
+        old_agent = self._agents.get(agent_id) or {}
+        changed = {k: v for k, v in (agent or {}).items() if old_agent.get(k) != v}
+        if changed:
+            delta['agent'] = changed
+        old_latest = self._latest.get(agent_id) or {}
+        changed = {k: v for k, v in (latest or {}).items() if old_latest.get(k) != v}
+        if changed:
+            delta['latest'] = changed
+        return delta
+
+    def _notify(self, deltas):
+        if self.listener is None:
+            return
+        for agent_id, delta in deltas:
+            if delta:
+                self.listener(agent_id, delta)
+
+    def agents(self):
+        with self._lock:
+            return list(self._agents.values())
+
+    def latest(self, agent_id):
+        """Latest metrics for an agent, read from the database on a cache miss"""
+        with self._lock:
+            metric = self._latest.get(agent_id)
+        if metric is not None:
+            return metric
+
+        # The sample may have been written by another worker since the last reload
+        metric = self.storage.latest(agent_id)
+        if metric is None:
+            return None
+        with self._lock:
+            current = self._latest.get(agent_id)
+            if current is None or current['timestamp'] < metric['timestamp']:
+                self._latest[agent_id] = metric
+                self._overview = None
+            return self._latest[agent_id]
+
+    def overview(self):
+        """Serialized overview of all agents and an ETag for it"""
+        with self._lock:
+            if self._overview is None:
+                agents = [
+                    dict(agent, latest=self._latest.get(agent_id))
+                    for agent_id, agent in sorted(self._agents.items())
+                ]
+                body = json.dumps({'agents': agents}, separators=(',', ':'))
+                etag = hashlib.sha1(body.encode()).hexdigest()[:20]
+                self._overview = (body, etag)
+            return self._overview
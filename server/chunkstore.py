@@ -0,0 +1,350 @@
+"""
+Embedded time-series store
+Per-agent append-only chunk files of Gorilla-compressed samples, read through mmap
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+from gorilla import encode, decode
+
+# Values stored per sample, after the timestamp (epoch milliseconds)
+COLUMNS = ('cpu_percent', 'memory_percent', 'disk_percent',
+           'memory_used', 'disk_used', 'memory_total', 'disk_total')
+
+# Sealed chunk: magic, sample count, min/max timestamp, payload length, CRC32 of payload
+FRAME = struct.Struct('<4sIqqII')
+MAGIC = b'GCK1'
+
+# Head log record: the raw samples of the chunk being filled
+HEAD_RECORD = struct.Struct('<q' + 'd' * len(COLUMNS))
+NAN = float('nan')
+
+CHUNKS_FILE = 'chunks.dat'
+HEAD_FILE = 'head.log'
+
+
+class _OpenFiles:
+    """
+    The series whose files are open, least recently used first.
+
+    Series open their files on first use; beyond `max_open` series the
+    least recently used ones close theirs again (skipping any busy in
+    another thread), so descriptors stay bounded however many agents report.
+    """
+
+    def __init__(self, max_open):
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._series = OrderedDict()
+
+    def touch(self, series):
+        with self._lock:
+            self._series[series] = None
+            self._series.move_to_end(series)
+            excess = len(self._series) - self.max_open
+            victims = list(self._series)[:max(excess, 0)]
+        for victim in victims:
+            if victim.lock.acquire(blocking=False):
+                try:
+                    victim.close()
+                finally:
+                    victim.lock.release()
+
+    def discard(self, series):
+        with self._lock:
+            self._series.pop(series, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._series)
+
+
+class _Series:
+    """Files and in-memory state of one agent; callers hold `lock`"""
+
+    def __init__(self, path, open_files):
+        self.path = path
+        self.lock = threading.Lock()
+        self.index = []  # (min_ts, max_ts, payload offset, payload length, count)
+        self.head = []   # (timestamp, values) of the open chunk
+        self.latest = None
+        self.size = 0    # bytes of sealed chunks
+        self._open_files = open_files
+        self._chunks = None
+        self._head_log = None
+        self._map = None
+        self._mapped_size = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._recover_chunks()
+        self._recover_head()
+
+    def _files(self):
+        """The chunk file and head log, opened on first use"""
+        if self._chunks is None:
+            self._chunks = open(os.path.join(self.path, CHUNKS_FILE), 'ab')
+            self._head_log = open(os.path.join(self.path, HEAD_FILE), 'ab')
+        self._open_files.touch(self)
+        return self._chunks, self._head_log
+
+    def _recover_chunks(self):
+        """Index the sealed chunks, cutting off a torn last frame"""
+        filename = os.path.join(self.path, CHUNKS_FILE)
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + FRAME.size <= len(data):
+            magic, count, min_ts, max_ts, length, crc = FRAME.unpack_from(data, offset)
+            start = offset + FRAME.size
+            payload = data[start:start + length]
+            if magic != MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+                break
+            self.index.append((min_ts, max_ts, start, length, count))
+            offset = start + length
+        if offset < len(data):
+            with open(filename, 'r+b') as f:
+                f.truncate(offset)
+        self.size = offset
+        if self.index:
+            timestamps, columns = decode(payload_of(data, self.index[-1]), self.index[-1][4], len(COLUMNS))
+            self.latest = max(zip(timestamps, zip(*columns)), key=lambda row: row[0])
+
+    def _recover_head(self):
+        """Reload the open chunk from the head log"""
+        filename = os.path.join(self.path, HEAD_FILE)
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'rb') as f:
+            data = f.read()
+        whole = len(data) - len(data) % HEAD_RECORD.size
+        # A crash between sealing a chunk and truncating the log leaves
+        # samples that are already in the last chunk
+        sealed_until = self.index[-1][1] if self.index else None
+        for record in HEAD_RECORD.iter_unpack(data[:whole]):
+            if sealed_until is None or record[0] > sealed_until:
+                self._remember(record[0], tuple(None if v != v else v for v in record[1:]))
+        if whole < len(data):
+            with open(filename, 'r+b') as f:
+                f.truncate(whole)
+
+    def _remember(self, timestamp, values):
+        self.head.append((timestamp, values))
+        if self.latest is None or timestamp >= self.latest[0]:
+            self.latest = (timestamp, values)
+
+    def _stored(self, timestamps):
+        """Those of timestamps already stored (e.g. a retried write)"""
+        older = [t for t in timestamps if self.latest is not None and t <= self.latest[0]]
+        if not older:
+            return set()
+        stored = {timestamp for timestamp, _ in self.head}
+        for payload, count in self.payloads(min(older), max(older) + 1):
+            stored.update(decode(payload, count, 0)[0])
+        return stored.intersection(older)
+
+    def append(self, rows, chunk_samples, fsync):
+        stored = self._stored([timestamp for timestamp, _ in rows])
+        rows = [row for row in rows if row[0] not in stored]
+        while rows:
+            _, head_log = self._files()
+            # Fill the open chunk exactly, so every sealed chunk has chunk_samples samples
+            take = max(chunk_samples - len(self.head), 1)
+            part, rows = rows[:take], rows[take:]
+            head_log.write(b''.join(
+                HEAD_RECORD.pack(timestamp, *(NAN if v is None else v for v in values))
+                for timestamp, values in part
+            ))
+            head_log.flush()
+            if fsync:
+                os.fsync(head_log.fileno())
+            for timestamp, values in part:
+                self._remember(timestamp, values)
+            if len(self.head) >= chunk_samples:
+                self.seal(fsync)
+
+    def seal(self, fsync=False):
+        """Compress the open chunk, append it to the chunk file and reset the head log"""
+        if not self.head:
+            return
+        chunks, head_log = self._files()
+        timestamps = [timestamp for timestamp, _ in self.head]
+        payload = encode(timestamps, list(zip(*(values for _, values in self.head))))
+        offset = self.size
+        chunks.write(FRAME.pack(MAGIC, len(timestamps), min(timestamps), max(timestamps),
+                                len(payload), zlib.crc32(payload)))
+        chunks.write(payload)
+        chunks.flush()
+        if fsync:
+            os.fsync(chunks.fileno())
+        self.size = offset + FRAME.size + len(payload)
+        self.index.append((min(timestamps), max(timestamps), offset + FRAME.size,
+                           len(payload), len(timestamps)))
+        self.head = []
+        head_log.seek(0)
+        head_log.truncate()
+
+    def payloads(self, start, end):
+        """(bytes, count) of sealed chunks overlapping [start, end)"""
+        wanted = [entry for entry in self.index if entry[1] >= start and entry[0] < end]
+        if not wanted:
+            return []
+        if self._map is None or self._mapped_size != self.size:
+            if self._map is not None:
+                self._map.close()
+            with open(os.path.join(self.path, CHUNKS_FILE), 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = self.size
+            self._open_files.touch(self)
+        return [(payload_of(self._map, entry), entry[4]) for entry in wanted]
+
+    def rewrite(self, keep):
+        """Replace the chunk file with only the indexed chunks in keep"""
+        filename = os.path.join(self.path, CHUNKS_FILE)
+        with open(filename, 'rb') as f:
+            data = f.read()
+        index = []
+        with open(filename + '.tmp', 'wb') as out:
+            for entry in keep:
+                start = entry[2] - FRAME.size
+                out.write(data[start:entry[2] + entry[3]])
+                index.append(entry[:2] + (out.tell() - entry[3],) + entry[3:])
+            out.flush()
+            os.fsync(out.fileno())
+            size = out.tell()
+        self.close()
+        os.replace(filename + '.tmp', filename)
+        self.index = index
+        self.size = size
+
+    def close(self):
+        """Close the files; they are opened again when next needed"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._chunks is not None:
+            self._chunks.close()
+            self._head_log.close()
+            self._chunks = self._head_log = None
+        self._open_files.discard(self)
+
+
+def payload_of(buffer, entry):
+    return bytes(buffer[entry[2]:entry[2] + entry[3]])
+
+
+class ChunkStore:
+    """
+    Append-only sample storage, one directory per agent.
+
+    Writes go to a small head log of fixed-size records; every
+    `chunk_samples` samples the head is compressed into a chunk (delta-of-
+    delta timestamps, XOR floats) appended to chunks.dat. Reads map the
+    chunk file and decode only the chunks overlapping the requested window.
+
+    Each agent's index and open chunk stay in memory, but at most
+    `max_open` agents keep their files open (three descriptors each).
+    Appending a sample whose timestamp is already stored is a no-op, so a
+    retried write does not duplicate samples.
+
+    A store directory must be owned by a single process: run the server
+    with one worker (threads are fine) when using this backend.
+    """
+
+    def __init__(self, root, chunk_samples=240, fsync=False, max_open=256):
+        self.root = root
+        self.chunk_samples = chunk_samples
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._series = {}
+        self._open_files = _OpenFiles(max_open)
+        os.makedirs(root, exist_ok=True)
+
+    def _get(self, agent_id, create=True):
+        series = self._series.get(agent_id)
+        if series is None:
+            path = os.path.join(self.root, quote(agent_id, safe=''))
+            if not create and not os.path.isdir(path):
+                return None
+            with self._lock:
+                series = self._series.get(agent_id)
+                if series is None:
+                    series = self._series[agent_id] = _Series(path, self._open_files)
+        return series
+
+    def agent_ids(self):
+        return [unquote(name) for name in sorted(os.listdir(self.root))
+                if os.path.isdir(os.path.join(self.root, name))]
+
+    def append(self, agent_id, rows):
+        """Append (timestamp ms, values) rows, values ordered as COLUMNS"""
+        series = self._get(agent_id)
+        with series.lock:
+            series.append(rows, self.chunk_samples, self.fsync)
+
+    def read(self, agent_id, start, end=None, width=len(COLUMNS)):
+        """
+        (timestamp ms, values) rows of an agent in [start, end), oldest first.
+
+        Only the first `width` COLUMNS are decoded and returned.
+        """
+        series = self._get(agent_id, create=False)
+        if series is None:
+            return []
+        end = end if end is not None else 2 ** 63 - 1
+        with series.lock:
+            payloads = series.payloads(start, end)
+            head = list(series.head)
+
+        rows = []
+        for payload, count in payloads:
+            timestamps, columns = decode(payload, count, width)
+            rows.extend(zip(timestamps, zip(*columns)))
+        rows.extend((timestamp, values[:width]) for timestamp, values in head)
+        rows = [row for row in rows if start <= row[0] < end]
+        rows.sort(key=lambda row: row[0])
+        return rows
+
+    def latest(self, agent_id):
+        series = self._get(agent_id, create=False)
+        return series.latest if series is not None else None
+
+    def expire(self, cutoff):
+        """Drop sealed chunks whose newest sample is older than cutoff; returns samples removed"""
+        removed = 0
+        for agent_id in self.agent_ids():
+            series = self._get(agent_id)
+            with series.lock:
+                keep = [entry for entry in series.index if entry[1] >= cutoff]
+                if len(keep) < len(series.index):
+                    removed += sum(entry[4] for entry in series.index) - sum(entry[4] for entry in keep)
+                    series.rewrite(keep)
+        return removed
+
+    def stats(self):
+        """Samples and bytes on disk across all agents"""
+        samples = size = 0
+        for agent_id in self.agent_ids():
+            series = self._get(agent_id)
+            with series.lock:
+                samples += sum(entry[4] for entry in series.index) + len(series.head)
+                size += series.size + len(series.head) * HEAD_RECORD.size
+        return {'samples': samples, 'bytes': size}
+
+    def flush(self):
+        """Seal every open chunk (e.g. before a backup or shutdown)"""
+        for series in list(self._series.values()):
+            with series.lock:
+                series.seal(self.fsync)
+
+    def close(self):
+        with self._lock:
+            for series in self._series.values():
+                with series.lock:
+                    series.close()
+            self._series = {}
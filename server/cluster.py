@@ -0,0 +1,123 @@
+"""
+Local sharded cluster
+Starts several shard servers, each with its own SQLite file, and the router in front of them
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import requests
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Cluster:
+    """Shard servers and a router running as child processes"""
+
+    def __init__(self, shards=3, base_port=5101, router_port=5100, data_dir=None, env=None,
+                 log_dir=None):
+        self.data_dir = data_dir or os.path.join(SERVER_DIR, 'shards')
+        self.log_dir = log_dir
+        self.env = dict(os.environ, **(env or {}))
+        self.shard_urls = [f'http://127.0.0.1:{base_port + i}' for i in range(shards)]
+        self.url = f'http://127.0.0.1:{router_port}'
+        self.router_port = router_port
+        self.processes = []
+        self._router = None
+        self._logs = []
+
+    def _start(self, name, command, env):
+        log = open(os.path.join(self.log_dir, f'{name}.log'), 'w') if self.log_dir else subprocess.DEVNULL
+        if self.log_dir:
+            self._logs.append(log)
+        self.processes.append(subprocess.Popen(command, cwd=SERVER_DIR, env=env,
+                                               stdout=log, stderr=subprocess.STDOUT))
+
+    def _start_shard(self, index):
+        url = self.shard_urls[index]
+        database = os.path.join(self.data_dir, f'shard-{index}.db')
+        env = dict(self.env, DATABASE_URL=f'sqlite:///{database}',
+                   HOST='127.0.0.1', PORT=url.rsplit(':', 1)[1], FLASK_ENV='production')
+        self._start(f'shard-{index}', [sys.executable, 'app.py'], env)
+
+    def _start_router(self):
+        env = dict(self.env, SHARD_URLS=','.join(self.shard_urls),
+                   HOST='127.0.0.1', ROUTER_PORT=str(self.router_port))
+        self._start('router', [sys.executable, 'router.py'], env)
+        self._router = self.processes[-1]
+
+    def start(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        for index in range(len(self.shard_urls)):
+            self._start_shard(index)
+        self._start_router()
+
+    def add_shard(self):
+        """Start one more shard and restart the router with the longer shard list"""
+        port = int(self.shard_urls[-1].rsplit(':', 1)[1]) + 1
+        self.shard_urls.append(f'http://127.0.0.1:{port}')
+        self._start_shard(len(self.shard_urls) - 1)
+        self._router.terminate()
+        self._router.wait(timeout=10)
+        self.processes.remove(self._router)
+        self._start_router()
+
+    def drain(self):
+        """Run `router.py drain` for the current shard list; returns its output"""
+        env = dict(self.env, SHARD_URLS=','.join(self.shard_urls))
+        result = subprocess.run([sys.executable, 'router.py', 'drain'], cwd=SERVER_DIR, env=env,
+                                capture_output=True, text=True, timeout=300)
+        if result.returncode:
+            raise RuntimeError(f'drain failed: {result.stdout}{result.stderr}')
+        return result.stdout
+
+    def wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        for url in self.shard_urls + [self.url]:
+            while True:
+                if any(p.poll() is not None for p in self.processes):
+                    raise RuntimeError('A cluster process exited during startup')
+                try:
+                    requests.get(f'{url}/api/v1/agents', timeout=1)
+                    break
+                except requests.exceptions.RequestException:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f'{url} did not start in time')
+                    time.sleep(0.2)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for log in self._logs:
+            log.close()
+        self.processes, self._logs = [], []
+
+
+if __name__ == '__main__':
+    # python cluster.py --shards 3   router on :5100, shards on :5101..5103
+    parser = argparse.ArgumentParser(description='Run a local sharded cluster')
+    parser.add_argument('--shards', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=5101, help='port of the first shard')
+    parser.add_argument('--router-port', type=int, default=5100)
+    parser.add_argument('--data-dir', help='directory of the shard SQLite files (default: server/shards)')
+    parser.add_argument('--log-dir', help='write each process log to this directory')
+    args = parser.parse_args()
+
+    cluster = Cluster(args.shards, args.base_port, args.router_port, args.data_dir, log_dir=args.log_dir)
+    cluster.start()
+    try:
+        cluster.wait_ready()
+        print(f"Router at {cluster.url}, shards at {', '.join(cluster.shard_urls)}")
+        while all(p.poll() is None for p in cluster.processes):
+            time.sleep(1)
+        print('A cluster process exited; stopping')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()
@@ -0,0 +1,62 @@
+"""
+Columnar history encoding
+Turns (timestamp, cpu, memory, disk) rows into parallel arrays or packed binary
+"""
+import calendar
+import struct
+import sys
+from array import array
+
+# Binary layout (little-endian):
+#   uint32 count, uint32 resolution (0 = raw samples)
+#   float64[count] timestamps in epoch milliseconds
+#   float32[count] cpu, memory and disk percent (NaN where missing)
+# Every array starts on an 8-byte boundary, so a browser can wrap the
+# buffer in typed arrays without copying.
+BINARY_MIMETYPE = 'application/octet-stream'
+HEADER = struct.Struct('<II')
+NAN = float('nan')
+
+
+def epoch_ms(ts):
+    """Milliseconds since epoch for a stored timestamp (naive values are UTC)"""
+    return calendar.timegm(ts.utctimetuple()) * 1000 + ts.microsecond // 1000
+
+
+def _round(value, precision):
+    return round(value, precision) if value is not None else None
+
+
+def to_columns(rows, precision=2):
+    """
+    Split rows into timestamps/cpu/memory/disk lists, rounding the values.
+    Rows carrying cpu and memory peaks also give cpu_max/memory_max lists.
+    """
+    names = ('cpu', 'memory', 'disk', 'cpu_max', 'memory_max')
+    width = len(rows[0]) - 1 if rows else 3
+    columns = {name: [] for name in names[:width]}
+    series = list(columns.values())
+    timestamps = []
+    for row in rows:
+        timestamps.append(epoch_ms(row[0]))
+        for values, value in zip(series, row[1:]):
+            values.append(_round(value, precision))
+    return dict(columns, timestamps=timestamps)
+
+
+def pack_columns(rows, resolution=None):
+    """Encode rows in the binary layout described above"""
+    timestamps = array('d', (epoch_ms(row[0]) for row in rows))
+    series = [array('f', (NAN if row[i] is None else row[i] for row in rows)) for i in (1, 2, 3)]
+
+    parts = [timestamps] + series
+    if sys.byteorder != 'little':
+        for part in parts:
+            part.byteswap()
+
+    # float32 columns of odd length would misalign the next column
+    padding = b'\0' * (4 * (len(rows) % 2))
+    body = [HEADER.pack(len(rows), resolution or 0), timestamps.tobytes()]
+    for part in series:
+        body += [part.tobytes(), padding]
+    return b''.join(body)
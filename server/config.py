@@ -1,11 +1,32 @@
 """
 Server configuration
 """
+import json
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def engine_options(url, pool_size, max_overflow, pool_timeout, pool_recycle,
+                   statement_timeout_ms, sqlite_busy_timeout_ms):
+    """SQLAlchemy engine options for the database at url"""
+    if url.startswith('sqlite'):
+        # pysqlite's timeout is SQLite's busy timeout: wait for the write lock
+        # instead of failing at once with "database is locked"
+        return {'connect_args': {'timeout': sqlite_busy_timeout_ms / 1000.0}}
+    options = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': True
+    }
+    if url.startswith('postgresql') and statement_timeout_ms:
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout_ms}'}
+    return options
+
+
 class Config:
     # Flask configuration
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -24,7 +45,142 @@ class Config:
     SQLALCHEMY_DATABASE_URI = DATABASE_URL
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool per worker process (PostgreSQL/MySQL); pre-ping replaces
+    # connections the database closed, recycle retires them before idle timeouts
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10))  # seconds waiting for a connection
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # seconds
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))  # PostgreSQL, 0 = none
+    
+    # SQLite: WAL lets readers run alongside the single writer, synchronous=NORMAL
+    # syncs at checkpoints instead of every commit (safe in WAL mode), and
+    # writers queue on the busy timeout. Write paths begin immediate transactions
+    # that take the write lock up front, so a read-then-write transaction cannot
+    # fail on upgrade; reads begin deferred and do not wait for writers.
+    SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 30000))
+    SQLITE_BEGIN_IMMEDIATE = os.getenv('SQLITE_BEGIN_IMMEDIATE', 'true').lower() == 'true'
+    
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+        DB_STATEMENT_TIMEOUT_MS, SQLITE_BUSY_TIMEOUT_MS)
+    
+    # Create missing tables when app.py is imported. Convenient for local runs;
+    # start.sh runs `python manage.py init-db` once and turns this off so
+    # gunicorn workers start without touching the schema.
+    AUTO_CREATE_SCHEMA = os.getenv('AUTO_CREATE_SCHEMA', 'true').lower() == 'true'
+    
     # Server configuration
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', 5000))
     DEBUG = os.getenv('FLASK_ENV', 'production') == 'development'
+    
+    # Metric storage: 'sql' (tables above) or 'chunks' (embedded append-only
+    # files with Gorilla compression; single server process only)
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sql')
+    CHUNK_STORE_PATH = os.getenv('CHUNK_STORE_PATH',
+                                 os.path.join(os.path.abspath(os.path.dirname(__file__)), 'chunks'))
+    CHUNK_SAMPLES = int(os.getenv('CHUNK_SAMPLES', 240))  # samples per compressed chunk
+    CHUNK_FSYNC = os.getenv('CHUNK_FSYNC', 'false').lower() == 'true'
+    CHUNK_MAX_OPEN_SERIES = int(os.getenv('CHUNK_MAX_OPEN_SERIES', 256))  # agents with open files
+    
+    # Sharded ingest (router.py): shard servers in ring order, virtual nodes
+    # per shard, and the router's timeout and connections per shard
+    SHARD_URLS = [u.strip().rstrip('/') for u in os.getenv('SHARD_URLS', '').split(',') if u.strip()]
+    SHARD_VNODES = int(os.getenv('SHARD_VNODES', 160))
+    SHARD_TIMEOUT = float(os.getenv('SHARD_TIMEOUT', 10))  # seconds
+    SHARD_POOL_SIZE = int(os.getenv('SHARD_POOL_SIZE', 32))
+    # Optional bearer token for the shard handoff endpoints (/internal/agents/...)
+    SHARD_TOKEN = os.getenv('SHARD_TOKEN')
+    ROUTER_PORT = int(os.getenv('ROUTER_PORT', 5000))
+    
+    # Batch ingest limits
+    MAX_BATCH_SAMPLES = int(os.getenv('MAX_BATCH_SAMPLES', 1000))
+    MAX_BATCH_BYTES = int(os.getenv('MAX_BATCH_BYTES', 16 * 1024 * 1024))
+    # Flask refuses larger request bodies with 413 before they are read
+    MAX_CONTENT_LENGTH = MAX_BATCH_BYTES
+    
+    # Write-behind ingest: validate, queue and answer 202; one writer thread
+    # group-commits up to WRITE_BATCH_SAMPLES samples or every WRITE_MAX_DELAY
+    # seconds. A full queue answers 429 with Retry-After.
+    WRITE_BEHIND = os.getenv('WRITE_BEHIND', 'false').lower() == 'true'
+    WRITE_QUEUE_MAX_SAMPLES = int(os.getenv('WRITE_QUEUE_MAX_SAMPLES', 10000))
+    WRITE_BATCH_SAMPLES = int(os.getenv('WRITE_BATCH_SAMPLES', 500))
+    WRITE_MAX_DELAY = float(os.getenv('WRITE_MAX_DELAY', 0.5))  # seconds
+    WRITE_RETRY_AFTER = int(os.getenv('WRITE_RETRY_AFTER', 2))  # seconds
+    
+    # Background jobs (rollups and maintenance) run in the server process;
+    # with several workers each run is claimed in job_state, so one worker runs it
+    BACKGROUND_JOBS = os.getenv('BACKGROUND_JOBS', 'true').lower() == 'true'
+    JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 3600))  # claim of a worker that died mid-run
+    ROLLUP_INTERVAL = int(os.getenv('ROLLUP_INTERVAL', 60))  # seconds
+    # Rows are rolled up once their id is this old, so transactions that
+    # commit out of id order (PostgreSQL) are not skipped; SQLite needs none
+    ROLLUP_SETTLE_SECONDS = int(os.getenv('ROLLUP_SETTLE_SECONDS', 60))
+    RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 3600))  # seconds
+    
+    # Retention in days per series (0 keeps data forever)
+    RETENTION_SYSTEM_METRICS_DAYS = int(os.getenv('RETENTION_SYSTEM_METRICS_DAYS', 30))
+    RETENTION_NETWORK_CHECKS_DAYS = int(os.getenv('RETENTION_NETWORK_CHECKS_DAYS', 30))
+    RETENTION_ROLLUP_DAYS = {
+        60: int(os.getenv('RETENTION_ROLLUP_1M_DAYS', 7)),
+        300: int(os.getenv('RETENTION_ROLLUP_5M_DAYS', 90)),
+        3600: int(os.getenv('RETENTION_ROLLUP_1H_DAYS', 730)),
+    }
+    RETENTION_NETWORK_STATS_DAYS = int(os.getenv('RETENTION_NETWORK_STATS_DAYS', 400))
+    RETENTION_HOST_METRICS_DAYS = int(os.getenv('RETENTION_HOST_METRICS_DAYS', 14))
+    RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', 5000))
+    # Daily partitions created ahead of time (PostgreSQL), so a stalled job does not fill DEFAULT
+    RETENTION_PARTITION_DAYS_AHEAD = int(os.getenv('RETENTION_PARTITION_DAYS_AHEAD', 14))
+    
+    # Incremental per-target network analytics (uptime, latency histograms, outages)
+    NETWORK_STATS_ENABLED = os.getenv('NETWORK_STATS_ENABLED', 'true').lower() == 'true'
+    
+    # Seconds before the in-memory latest-state cache is reloaded from the database
+    CACHE_REFRESH_SECONDS = int(os.getenv('CACHE_REFRESH_SECONDS', 15))
+    
+    # Agent liveness: stale/offline after this many missed reporting intervals
+    LIVENESS_DEFAULT_INTERVAL = int(os.getenv('LIVENESS_DEFAULT_INTERVAL', 60))  # seconds
+    LIVENESS_STALE_FACTOR = float(os.getenv('LIVENESS_STALE_FACTOR', 2.5))
+    LIVENESS_OFFLINE_FACTOR = float(os.getenv('LIVENESS_OFFLINE_FACTOR', 5))
+    
+    # Threshold alerts (ALERT_RULES is a JSON list; see alerts.DEFAULT_RULES)
+    ALERTS_ENABLED = os.getenv('ALERTS_ENABLED', 'true').lower() == 'true'
+    ALERT_RULES = json.loads(os.getenv('ALERT_RULES')) if os.getenv('ALERT_RULES') else None
+    
+    # Live event stream (Server-Sent Events)
+    STREAM_KEEPALIVE_SECONDS = int(os.getenv('STREAM_KEEPALIVE_SECONDS', 15))
+    STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', 256))
+    # Served by a gunicorn worker, each open stream holds a request thread;
+    # beyond this many per process clients get 503 and retry later. Streams
+    # are closed (and reconnect) after STREAM_MAX_SECONDS so they spread over
+    # workers again.
+    STREAM_MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', 2))
+    STREAM_MAX_SECONDS = int(os.getenv('STREAM_MAX_SECONDS', 300))
+    # stream.py serves any number of streams from one event loop and polls the
+    # database for changes every STREAM_REFRESH_SECONDS. STREAM_URL is where
+    # the web pages open the stream (e.g. http://host:5002/api/v1/stream).
+    STREAM_REFRESH_SECONDS = float(os.getenv('STREAM_REFRESH_SECONDS', 2))
+    STREAM_URL = os.getenv('STREAM_URL', '/api/v1/stream')
+    
+    # Default number of points returned by history queries
+    HISTORY_MAX_POINTS = int(os.getenv('HISTORY_MAX_POINTS', 500))
+    
+    # Rows fetched per round trip and encoded per chunk by /api/v1/export
+    EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 1000))
+    
+    # Aggregate query API: cached results and the row limit per response
+    QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 256))
+    QUERY_MAX_RESULTS = int(os.getenv('QUERY_MAX_RESULTS', 10000))
+    
+    # Self-monitoring: optional bearer token for /internal/metrics and the
+    # interval of the aggregated ingest log line
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    # Directory where worker processes share their metrics, so a scrape of any
+    # worker reports the whole server (set by gunicorn.conf.py); values from
+    # other workers are up to METRICS_FLUSH_INTERVAL seconds old
+    METRICS_DIR = os.getenv('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+    LOG_SUMMARY_INTERVAL = int(os.getenv('LOG_SUMMARY_INTERVAL', 60))  # seconds
@@ -0,0 +1,89 @@
+"""
+Live event broker
+Fans out agent updates to Server-Sent Events subscribers in this process
+"""
+import json
+import queue
+import threading
+from collections import defaultdict
+
+
+class Subscription:
+    """A subscriber's bounded event queue and agent filter"""
+
+    def __init__(self, agent_ids=None, maxsize=256):
+        self.agent_ids = frozenset(agent_ids) if agent_ids else None
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # A slow client gets a resync marker instead of an unbounded backlog
+            self.dropped += 1
+            with self._queue.mutex:
+                self._queue.queue.clear()
+            self._queue.put_nowait(('resync', {}))
+
+    def get(self, timeout):
+        """Next (type, data) event, or None if nothing arrived within timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """
+    In-process publish/subscribe for agent updates.
+
+    Subscribers are indexed by agent id, so publishing costs only as much
+    as the number of interested subscribers. The broker starts no threads,
+    but each streaming response blocks its request thread waiting on its
+    queue, which is why app.py caps streams per worker; stream.py serves
+    streams from an event loop instead.
+    """
+
+    def __init__(self, queue_size=256):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._by_agent = defaultdict(set)
+        self._all = set()
+        self.published = 0
+
+    def subscribe(self, agent_ids=None):
+        subscription = Subscription(agent_ids, self.queue_size)
+        with self._lock:
+            if subscription.agent_ids is None:
+                self._all.add(subscription)
+            else:
+                for agent_id in subscription.agent_ids:
+                    self._by_agent[agent_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._all.discard(subscription)
+            for agent_id in subscription.agent_ids or ():
+                subscribers = self._by_agent.get(agent_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_agent[agent_id]
+
+    def publish(self, agent_id, event_type, data):
+        with self._lock:
+            targets = list(self._all) + list(self._by_agent.get(agent_id, ()))
+            self.published += 1
+        for subscription in targets:
+            subscription.put((event_type, data))
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._all) + len({s for subs in self._by_agent.values() for s in subs})
+
+
+def format_sse(event_type, data):
+    """Encode one Server-Sent Events message"""
+    return f"event: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
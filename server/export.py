@@ -0,0 +1,379 @@
+"""
+Bulk export
+Streams system metric and network check rows as NDJSON, CSV or Parquet
+with constant memory, resumable from a (timestamp, id) cursor
+"""
+import argparse
+import base64
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select, or_, and_
+from models import (db, Agent, Target, SystemMetric, NetworkCheck, CHECK_TYPE_NAMES,
+                    CHECK_STATUS_NAMES, SUMMARY_FIELDS)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is then unavailable
+    pyarrow = None
+
+SYSTEM_COLUMNS = ('id', 'timestamp', 'agent_id', 'cpu_percent', 'memory_used', 'memory_percent',
+                  'disk_used', 'disk_percent', 'memory_total', 'disk_total') + SUMMARY_FIELDS
+TOTAL_COLUMNS = ('memory_total', 'disk_total')
+NETWORK_COLUMNS = ('id', 'timestamp', 'agent_id', 'target', 'check_type', 'status',
+                   'latency_ms', 'error_message')
+
+# Parquet column types; everything else is a string
+PARQUET_INTEGERS = ('id', 'memory_used', 'disk_used', 'memory_total', 'disk_total', 'sample_count')
+PARQUET_STRINGS = ('agent_id', 'target', 'check_type', 'status', 'error_message')
+
+# Closing line of a CSV export, followed by the cursor token
+CSV_CURSOR_PREFIX = '# cursor='
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class ExportError(ValueError):
+    """Raised for an invalid export request"""
+
+
+def make_cursor(timestamp, row_id):
+    """Cursor token resuming after the row with this timestamp and id"""
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat()
+    return base64.urlsafe_b64encode(f'{timestamp},{row_id}'.encode()).decode().rstrip('=')
+
+
+def parse_cursor(token):
+    """(timestamp, id) of a cursor token"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        timestamp, row_id = raw.rsplit(',', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ExportError('Invalid cursor')
+
+
+def _time(value, name):
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ExportError(f'{name} must be an ISO-8601 timestamp')
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_export(args):
+    """Validate request arguments and return a normalised export dict"""
+    source = args.get('source', 'system')
+    if source not in ('system', 'network'):
+        raise ExportError('source must be system or network')
+    output = args.get('format', 'ndjson')
+    if output not in FORMATS:
+        raise ExportError(f"format must be one of {', '.join(FORMATS)}")
+    if output == 'parquet' and pyarrow is None:
+        raise ExportError('Parquet export needs pyarrow on the server')
+
+    end = _time(args['end'], 'end') if args.get('end') else datetime.now(timezone.utc)
+    if args.get('start'):
+        start = _time(args['start'], 'start')
+    else:
+        try:
+            start = end - timedelta(hours=float(args.get('hours', 24)))
+        except ValueError:
+            raise ExportError('hours must be a number')
+    if start >= end:
+        raise ExportError('start must be before end')
+
+    return {
+        'source': source,
+        'format': output,
+        'agent_id': sorted({a.strip() for a in args.get('agent_id', '').split(',') if a.strip()}),
+        'start': start,
+        'end': end,
+        'cursor': parse_cursor(args['cursor']) if args.get('cursor') else None,
+    }
+
+
+def _statement(export):
+    """Rows of the export in (timestamp, id) order, after the cursor"""
+    if export['source'] == 'system':
+        model = SystemMetric
+        columns = [SystemMetric.id, SystemMetric.timestamp, Agent.agent_id] + \
+            [getattr(SystemMetric, name) for name in SYSTEM_COLUMNS[3:]]
+        statement = select(*columns).join(Agent, Agent.id == SystemMetric.agent_ref)
+    else:
+        model = NetworkCheck
+        statement = select(NetworkCheck.id, NetworkCheck.timestamp, Agent.agent_id, Target.target,
+                           Target.check_type, NetworkCheck.status, NetworkCheck.latency_ms,
+                           NetworkCheck.error_message)\
+            .join(Agent, Agent.id == NetworkCheck.agent_ref)\
+            .join(Target, Target.id == NetworkCheck.target_id)
+
+    statement = statement.where(model.timestamp >= export['start'], model.timestamp < export['end'])
+    if export['agent_id']:
+        statement = statement.where(Agent.agent_id.in_(export['agent_id']))
+    if export['cursor']:
+        timestamp, row_id = export['cursor']
+        statement = statement.where(or_(model.timestamp > timestamp,
+                                        and_(model.timestamp == timestamp, model.id > row_id)))
+    return statement.order_by(model.timestamp.asc(), model.id.asc())
+
+
+def _totals_before(agent_id, position):
+    """
+    memory_total and disk_total of an agent as of a (timestamp, id) position:
+    the newest stored value up to it, else the agent's current totals
+    """
+    timestamp, row_id = position
+    totals = {}
+    for name in TOTAL_COLUMNS:
+        column = getattr(SystemMetric, name)
+        value = db.session.execute(
+            select(column)
+            .join(Agent, Agent.id == SystemMetric.agent_ref)
+            .where(Agent.agent_id == agent_id, column.isnot(None),
+                   or_(SystemMetric.timestamp < timestamp,
+                       and_(SystemMetric.timestamp == timestamp, SystemMetric.id <= row_id)))
+            .order_by(SystemMetric.timestamp.desc(), SystemMetric.id.desc())
+            .limit(1)
+        ).scalar()
+        if value is None:
+            value = db.session.execute(
+                select(getattr(Agent, name)).where(Agent.agent_id == agent_id)
+            ).scalar()
+        totals[name] = value
+    return totals
+
+
+def iter_rows(export, chunk_rows=1000):
+    """
+    Export rows as dicts, in lists of up to chunk_rows.
+
+    The query runs on a server-side cursor where the database supports it
+    (stream_results), so only one chunk is held in memory at a time.
+    System rows store memory_total/disk_total only when they change; each
+    agent's totals are carried forward, starting from the values in effect
+    at the window start or cursor.
+    """
+    columns = SYSTEM_COLUMNS if export['source'] == 'system' else NETWORK_COLUMNS
+    position = export['cursor'] or (export['start'], 0)
+    totals = {}
+    result = db.session.execute(_statement(export).execution_options(yield_per=chunk_rows))
+    for partition in result.partitions():
+        rows = []
+        for row in partition:
+            row = dict(zip(columns, row))
+            if export['source'] == 'network':
+                row['check_type'] = CHECK_TYPE_NAMES.get(row['check_type'])
+                row['status'] = CHECK_STATUS_NAMES.get(row['status'])
+            else:
+                carried = totals.get(row['agent_id'])
+                if carried is None:
+                    carried = totals[row['agent_id']] = _totals_before(row['agent_id'], position)
+                for name in TOTAL_COLUMNS:
+                    if row[name] is None:
+                        row[name] = carried[name]
+                    else:
+                        carried[name] = row[name]
+            rows.append(row)
+        yield rows
+
+
+class _Progress:
+    """Rows handed to an encoder so far and the cursor resuming after them"""
+
+    def __init__(self, export):
+        start = export['start'].astimezone(timezone.utc).replace(tzinfo=None)
+        self.position = export['cursor'] or (start, 0)
+        self.rows = 0
+
+    def track(self, chunks):
+        for rows in chunks:
+            if rows:
+                self.position = (rows[-1]['timestamp'], rows[-1]['id'])
+                self.rows += len(rows)
+            yield rows
+
+    def cursor(self):
+        return make_cursor(*self.position)
+
+
+def control_line(line):
+    """The cursor of an NDJSON export's closing control line, or None for a row"""
+    try:
+        row = json.loads(line)
+    except ValueError:
+        return None
+    return row['cursor'] if isinstance(row, dict) and 'cursor' in row and 'id' not in row else None
+
+
+def _ndjson(chunks, progress):
+    for rows in chunks:
+        yield ''.join(json.dumps(row, separators=(',', ':'), default=datetime.isoformat) + '\n'
+                      for row in rows).encode()
+    # Only written once every row is out, so its absence means a cut-off export
+    yield (json.dumps({'cursor': progress.cursor(), 'rows': progress.rows}) + '\n').encode()
+
+
+def _csv(chunks, columns, progress):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, lineterminator='\n')
+    writer.writeheader()
+    for rows in chunks:
+        for row in rows:
+            row['timestamp'] = row['timestamp'].isoformat()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    buffer.write(f'{CSV_CURSOR_PREFIX}{progress.cursor()}\n')
+    yield buffer.getvalue().encode()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def _parquet_type(name):
+    if name == 'timestamp':
+        return pyarrow.timestamp('us')
+    if name in PARQUET_INTEGERS:
+        return pyarrow.int64()
+    if name in PARQUET_STRINGS:
+        return pyarrow.string()
+    return pyarrow.float64()
+
+
+def _parquet(chunks, columns, progress):
+    # One row group per chunk; the footer follows the last one
+    schema = pyarrow.schema([(name, _parquet_type(name)) for name in columns])
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for rows in chunks:
+        writer.write_table(pyarrow.Table.from_pylist(rows, schema=schema))
+        yield sink.drain()
+    writer.add_key_value_metadata({'cursor': progress.cursor()})
+    writer.close()
+    yield sink.drain()
+
+
+def stream_export(export, chunk_rows=1000):
+    """
+    Encoded export body as an iterator of byte strings.
+
+    The body ends with the cursor that resumes after its last row (the
+    request's cursor or window start if it has none): a final
+    {"cursor": ..., "rows": n} line in NDJSON, a "# cursor=..." line in CSV
+    and "cursor" footer metadata in Parquet.
+    """
+    columns = SYSTEM_COLUMNS if export['source'] == 'system' else NETWORK_COLUMNS
+    progress = _Progress(export)
+    chunks = progress.track(iter_rows(export, chunk_rows))
+    if export['format'] == 'csv':
+        return _csv(chunks, columns, progress)
+    if export['format'] == 'parquet':
+        return _parquet(chunks, columns, progress)
+    return _ndjson(chunks, progress)
+
+
+def _last_row(path, output):
+    """
+    ((timestamp, id), byte offset after it) of the last complete row of an
+    NDJSON or CSV file, or None
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    end = data.rfind(b'\n') + 1  # anything after the last newline was cut short
+    while end > 0:
+        start = data.rfind(b'\n', 0, end - 1) + 1
+        line = data[start:end - 1]
+        try:
+            if output == 'ndjson':
+                row = json.loads(line)
+                return (row['timestamp'], row['id']), end
+            row_id, timestamp = line.decode().split(',', 2)[:2]
+            return (timestamp, int(row_id)), end
+        except (ValueError, KeyError):
+            if start == 0:
+                return None  # only a header
+            end = start
+    return None
+
+
+if __name__ == '__main__':
+    # python export.py --agent-id a,b --hours 2160 --format csv --output dump.csv [--resume]
+    os.environ['BACKGROUND_JOBS'] = 'false'
+    os.environ.setdefault('AUTO_CREATE_SCHEMA', 'false')
+    from bootstrap import create_app
+
+    parser = argparse.ArgumentParser(description='Export metric history')
+    parser.add_argument('--source', default='system', choices=('system', 'network'))
+    parser.add_argument('--format', default='ndjson', choices=tuple(FORMATS))
+    parser.add_argument('--agent-id', default='', help='comma-separated agents (default: all)')
+    parser.add_argument('--start', help='ISO-8601 start (default: --hours before end)')
+    parser.add_argument('--end', help='ISO-8601 end (default: now)')
+    parser.add_argument('--hours', default='24')
+    parser.add_argument('--cursor', help='resume after the row this token points to')
+    parser.add_argument('--output', help='file to write (default: stdout)')
+    parser.add_argument('--resume', action='store_true',
+                        help='append to --output after its last complete row (ndjson/csv)')
+    parser.add_argument('--chunk-rows', type=int, default=1000)
+    args = parser.parse_args()
+
+    request_args = {k: v for k, v in vars(args).items() if v and k in ('source', 'format', 'agent_id',
+                                                                       'start', 'end', 'hours', 'cursor')}
+    appending = False
+    if args.resume:
+        if not args.output or args.format == 'parquet':
+            parser.error('--resume needs --output and the ndjson or csv format')
+        last = _last_row(args.output, args.format) if os.path.exists(args.output) else None
+        if last:
+            (timestamp, row_id), size = last
+            with open(args.output, 'r+b') as f:
+                f.truncate(size)
+            request_args['cursor'] = make_cursor(timestamp, row_id)
+            appending = True
+
+    with create_app().app_context():
+        try:
+            export = parse_export(request_args)
+        except ExportError as e:
+            parser.error(str(e))
+        out = open(args.output, 'ab' if appending else 'wb') if args.output else sys.stdout.buffer
+        try:
+            for index, part in enumerate(stream_export(export, args.chunk_rows)):
+                if appending and index == 0 and args.format == 'csv':
+                    # Keep the existing header
+                    part = part.split(b'\n', 1)[1]
+                out.write(part)
+                out.flush()
+        finally:
+            if args.output:
+                out.close()
@@ -0,0 +1,179 @@
+"""
+Gorilla time-series compression
+Delta-of-delta timestamps and XOR-compressed float64 values
+(Pelkonen et al., "Gorilla: A Fast, Scalable, In-Memory Time Series Database")
+"""
+import struct
+from array import array
+
+NAN = float('nan')
+
+# (prefix, prefix length, value bits) for delta-of-delta ranges; the last
+# entry stores the full 64-bit value
+_DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12), (0b1111, 4, 64))
+
+
+class BitWriter:
+    """Appends bit fields MSB first to a bytearray"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self._acc = 0
+        self._count = 0  # bits held in _acc
+
+    def write(self, value, bits):
+        self._acc = (self._acc << bits) | (value & ((1 << bits) - 1))
+        self._count += bits
+        if self._count >= 32:
+            # Flush whole bytes; at most 7 bits stay behind
+            spare = self._count & 7
+            self.buffer += (self._acc >> spare).to_bytes(self._count >> 3, 'big')
+            self._acc &= (1 << spare) - 1
+            self._count = spare
+
+    def getvalue(self):
+        """Buffer contents with the last partial byte zero-padded"""
+        data = bytes(self.buffer)
+        if self._count:
+            padded = (self._count + 7) & ~7
+            data += (self._acc << (padded - self._count)).to_bytes(padded >> 3, 'big')
+        return data
+
+
+class BitReader:
+    """Reads bit fields written by BitWriter"""
+
+    def __init__(self, data):
+        self._data = bytes(data)
+        self._pos = 0  # bit position
+
+    def read(self, bits):
+        pos = self._pos
+        end = (pos + bits + 7) >> 3
+        window = int.from_bytes(self._data[pos >> 3:end], 'big')
+        self._pos = pos + bits
+        return (window >> ((end << 3) - pos - bits)) & ((1 << bits) - 1)
+
+    def read_bit(self):
+        pos = self._pos
+        self._pos = pos + 1
+        return (self._data[pos >> 3] >> (7 - (pos & 7))) & 1
+
+
+def _signed(value, bits):
+    return value - (1 << bits) if value >= 1 << (bits - 1) else value
+
+
+def _encode_timestamps(writer, timestamps):
+    write = writer.write
+    previous = timestamps[0]
+    write(previous, 64)
+    delta = 0
+    for timestamp in timestamps[1:]:
+        new_delta = timestamp - previous
+        dod = new_delta - delta
+        delta, previous = new_delta, timestamp
+        if dod == 0:
+            write(0, 1)
+            continue
+        for prefix, prefix_bits, bits in _DOD_BUCKETS:
+            if bits == 64 or -(1 << (bits - 1)) <= dod < (1 << (bits - 1)):
+                write(prefix, prefix_bits)
+                write(dod, bits)
+                break
+
+
+def _decode_timestamps(reader, count):
+    read, read_bit = reader.read, reader.read_bit
+    previous = _signed(read(64), 64)
+    timestamps = [previous]
+    delta = 0
+    for _ in range(count - 1):
+        if read_bit():
+            # Each further 1 bit selects the next wider bucket
+            for bits in (7, 9, 12):
+                if not read_bit():
+                    break
+            else:
+                bits = 64
+            delta += _signed(read(bits), bits)
+        previous += delta
+        timestamps.append(previous)
+    return timestamps
+
+
+def _float_bits(values):
+    """IEEE 754 bit patterns of a column, None as NaN, in one conversion"""
+    doubles = array('d', (NAN if v is None else v for v in values))
+    return struct.unpack(f'<{len(doubles)}Q', doubles.tobytes())
+
+
+def _encode_values(writer, bit_patterns):
+    write = writer.write
+    previous = bit_patterns[0]
+    write(previous, 64)
+    window_leading, window_trailing = -1, 0
+    for bits in bit_patterns[1:]:
+        xor = bits ^ previous
+        previous = bits
+        if xor == 0:
+            write(0, 1)
+            continue
+        leading = min(64 - xor.bit_length(), 31)  # 5-bit field
+        trailing = (xor & -xor).bit_length() - 1
+        if window_leading >= 0 and leading >= window_leading and trailing >= window_trailing:
+            # Fits in the previous window: reuse its position
+            write(0b10, 2)
+            write(xor >> window_trailing, 64 - window_leading - window_trailing)
+        else:
+            meaningful = 64 - leading - trailing
+            write(0b11, 2)
+            write(leading, 5)
+            write(meaningful - 1, 6)  # 1..64 stored as 0..63
+            write(xor >> trailing, meaningful)
+            window_leading, window_trailing = leading, trailing
+
+
+def _decode_values(reader, count):
+    read, read_bit = reader.read, reader.read_bit
+    previous = read(64)
+    patterns = [previous]
+    leading = trailing = 0
+    for _ in range(count - 1):
+        if read_bit():
+            if read_bit():
+                leading = read(5)
+                trailing = 64 - leading - read(6) - 1
+            previous ^= read(64 - leading - trailing) << trailing
+        patterns.append(previous)
+    values = array('d', struct.pack(f'<{count}Q', *patterns))
+    return [None if v != v else v for v in values]
+
+
+def encode(timestamps, columns):
+    """
+    Compress integer timestamps and parallel float columns into one block.
+
+    The timestamp stream comes first, then one XOR stream per column.
+    None is stored as NaN.
+    """
+    writer = BitWriter()
+    if timestamps:
+        _encode_timestamps(writer, timestamps)
+        for column in columns:
+            _encode_values(writer, _float_bits(column))
+    return writer.getvalue()
+
+
+def decode(data, count, width):
+    """
+    Inverse of encode: (timestamps, [column, ...]) with NaN restored to None.
+
+    Columns are stored one after another, so width may be smaller than the
+    number encoded to read only the leading columns.
+    """
+    if not count:
+        return [], [[] for _ in range(width)]
+    reader = BitReader(data)
+    timestamps = _decode_timestamps(reader, count)
+    return timestamps, [_decode_values(reader, count) for _ in range(width)]
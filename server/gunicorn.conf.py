@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for the monitoring server
+Used by start.sh: gunicorn -c gunicorn.conf.py app:app
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# The schema is set up once by `python manage.py init-db` before the workers start
+os.environ.setdefault('AUTO_CREATE_SCHEMA', 'false')
+# Workers share their self-monitoring metrics through this directory
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(),
+                                                  f"monitor-metrics-{os.getenv('PORT', '5000')}"))
+
+from config import Config  # noqa: E402  (after the environment above)
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+
+# Ingest requests mostly wait on the database and event streams stay open for
+# minutes, so each worker serves requests from a thread pool. Each worker holds
+# at most STREAM_MAX_CLIENTS streams, on top of GUNICORN_THREADS for requests.
+# The chunk store supports a single process only.
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8)) + Config.STREAM_MAX_CLIENTS
+if os.getenv('STORAGE_BACKEND', 'sql') == 'chunks':
+    workers = 1
+else:
+    workers = int(os.getenv('WEB_CONCURRENCY', min(2 * multiprocessing.cpu_count() + 1, 8)))
+
+# Agents keep their connection open between uploads
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+# Time for the write-behind queue to flush on shutdown
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+accesslog = os.getenv('GUNICORN_ACCESS_LOG')
+
+
+def on_starting(server):
+    """Start counting from zero: drop the metric files of the previous run"""
+    shutil.rmtree(Config.METRICS_DIR, ignore_errors=True)
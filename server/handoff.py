@@ -0,0 +1,144 @@
+"""
+Agent handoff between shards
+Imports an agent's exported rows on its new shard and drops the agent from
+the shard it left, so a rebalance moves history along with ownership
+"""
+from datetime import datetime
+from sqlalchemy import select, insert
+from bootstrap import writing
+from config import Config
+from export import SYSTEM_COLUMNS, TOTAL_COLUMNS
+from ingest import intern_targets
+from models import (db, Agent, SystemMetric, NetworkCheck, HostMetric, FilesystemUsage, ProcessSample,
+                    MetricRollup, NetworkStat, NetworkOutage, Alert, AlertState, CHECK_STATUS_CODES)
+from network_stats import record_checks
+from retention import delete_in_chunks
+
+# Exported system columns stored as they are
+SYSTEM_VALUES = tuple(c for c in SYSTEM_COLUMNS if c not in ('id', 'timestamp', 'agent_id'))
+
+
+class HandoffError(ValueError):
+    """Raised for rows that cannot be imported"""
+
+
+def _timestamp(row):
+    try:
+        return datetime.fromisoformat(row['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        raise HandoffError('Every row needs an ISO-8601 timestamp')
+
+
+def _agent(agent_id, agent_name):
+    """The agent on this shard, created as offline until it reports here"""
+    agent = Agent.query.filter_by(agent_id=agent_id).first()
+    if agent is None:
+        agent = Agent(agent_id=agent_id, agent_name=agent_name or agent_id, status='offline')
+        db.session.add(agent)
+        db.session.flush()
+    return agent
+
+
+def _import_system(agent, rows):
+    rows = sorted(rows, key=lambda row: row['timestamp'])
+    present = set(db.session.execute(
+        select(SystemMetric.timestamp).where(SystemMetric.agent_ref == agent.id,
+                                             SystemMetric.timestamp >= rows[0]['timestamp'],
+                                             SystemMetric.timestamp <= rows[-1]['timestamp'])
+    ).scalars())
+    new, previous = [], {}
+    for row in rows:
+        if row['timestamp'] in present:
+            continue
+        values = {'agent_ref': agent.id, 'timestamp': row['timestamp']}
+        values.update((name, row.get(name)) for name in SYSTEM_VALUES)
+        # Exports fill totals in on every row; store them only where they change again
+        for name in TOTAL_COLUMNS:
+            if values[name] is not None and values[name] == previous.get(name):
+                values[name] = None
+            elif values[name] is not None:
+                previous[name] = values[name]
+        new.append(values)
+
+    newest = rows[-1]
+    if agent.last_sample_at is None or newest['timestamp'] > agent.last_sample_at:
+        agent.last_sample_at = newest['timestamp']
+        for name in TOTAL_COLUMNS:
+            setattr(agent, name, newest.get(name))
+    if new:
+        db.session.execute(insert(SystemMetric), new)
+    return len(new)
+
+
+def _import_network(agent, rows):
+    try:
+        target_ids = intern_targets({row['target']: row['check_type'] for row in rows})
+        for row in rows:
+            row['status_code'] = CHECK_STATUS_CODES[row['status']]
+    except (KeyError, TypeError) as e:
+        raise HandoffError(f'Invalid network check row: {e}')
+
+    present = set(db.session.execute(
+        select(NetworkCheck.target_id, NetworkCheck.timestamp)
+        .where(NetworkCheck.agent_ref == agent.id,
+               NetworkCheck.timestamp >= min(row['timestamp'] for row in rows),
+               NetworkCheck.timestamp <= max(row['timestamp'] for row in rows))
+    ).all())
+    new = [row for row in rows if (target_ids[row['target']], row['timestamp']) not in present]
+    if not new:
+        return 0
+    check_rows = [{
+        'agent_ref': agent.id,
+        'target_id': target_ids[row['target']],
+        'timestamp': row['timestamp'],
+        'status': row['status_code'],
+        'latency_ms': row.get('latency_ms'),
+        'error_message': row.get('error_message')
+    } for row in new]
+    db.session.execute(insert(NetworkCheck), check_rows)
+    if Config.NETWORK_STATS_ENABLED:
+        record_checks(check_rows)
+    return len(new)
+
+
+@writing()
+def import_rows(agent_id, agent_name, source, rows):
+    """
+    Insert rows exported from another shard (the /api/v1/export NDJSON
+    objects) for one agent. Rows already present, by timestamp (and target
+    for network checks), are skipped, so an interrupted handoff can simply
+    be repeated. Returns the number of rows inserted.
+    """
+    if source not in ('system', 'network'):
+        raise HandoffError('source must be system or network')
+    if not rows:
+        return 0
+    for row in rows:
+        if row.get('agent_id', agent_id) != agent_id:
+            raise HandoffError('All rows must belong to the agent')
+        row['timestamp'] = _timestamp(row)
+    try:
+        agent = _agent(agent_id, agent_name)
+        imported = (_import_system if source == 'system' else _import_network)(agent, rows)
+        if agent.last_seen is None:
+            agent.last_seen = max(row['timestamp'] for row in rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return imported
+
+
+@writing()
+def drop_agent(agent_id, chunk_size=5000):
+    """Delete an agent that moved to another shard, with all its rows; returns rows deleted"""
+    agent = Agent.query.filter_by(agent_id=agent_id).first()
+    if agent is None:
+        return 0
+    deleted, agent_ref = 0, agent.id
+    for model in (SystemMetric, NetworkCheck, HostMetric, FilesystemUsage, ProcessSample,
+                  MetricRollup, NetworkStat, NetworkOutage, Alert, AlertState):
+        deleted += delete_in_chunks(model, (model.agent_ref == agent_ref,), chunk_size)
+    Agent.query.filter_by(id=agent_ref).delete()
+    db.session.commit()
+    return deleted
@@ -0,0 +1,427 @@
+"""
+Metrics ingest helpers
+Validates agent samples and writes them to the database in bulk
+"""
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from bootstrap import writing
+from config import Config
+from models import (db, Agent, Target, SystemMetric, NetworkCheck, HostMetric, FilesystemUsage,
+                    ProcessSample, SUMMARY_FIELDS, CHECK_TYPE_CODES, CHECK_TYPE_NAMES,
+                    CHECK_STATUS_CODES)
+from network_stats import record_checks
+
+try:
+    import zstandard
+except ImportError:  # zstd request bodies are optional
+    zstandard = None
+
+
+class SampleError(ValueError):
+    """Raised when a sample or request body cannot be ingested"""
+
+
+class RetryLater(str):
+    """
+    Error message of a sample that was not written for a transient reason
+    (database locked or unreachable, serialization failure). Clients keep
+    such samples and resend them; only other errors are rejections.
+    """
+
+
+def is_transient(error):
+    """True for database errors that a later retry may not hit"""
+    if isinstance(error, (OperationalError, InterfaceError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+def decode_body(raw, encoding, max_bytes):
+    """Decompress a request body according to its Content-Encoding"""
+    encoding = (encoding or 'identity').strip().lower()
+
+    if encoding in ('', 'identity'):
+        data = raw
+    elif encoding in ('gzip', 'x-gzip'):
+        # Bounded inflate so a small compressed body cannot expand without limit
+        decompressor = zlib.decompressobj(wbits=31)
+        data = decompressor.decompress(raw, max_bytes + 1)
+    elif encoding == 'zstd':
+        if zstandard is None:
+            raise SampleError('zstd encoding is not supported by this server')
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(raw))
+        data = reader.read(max_bytes + 1)
+    else:
+        raise SampleError(f'Unsupported Content-Encoding: {encoding}')
+
+    if len(data) > max_bytes:
+        raise SampleError(f'Decoded body exceeds {max_bytes} bytes')
+    return data
+
+
+def parse_timestamp(value):
+    """Parse an ISO-8601 timestamp sent by an agent"""
+    if not isinstance(value, str):
+        raise SampleError('timestamp must be an ISO-8601 string')
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise SampleError(f'Invalid timestamp: {value}')
+
+
+def parse_summary(summary):
+    """Summary columns from an agent's high-resolution readings (all None if absent)"""
+    if summary is None:
+        return dict.fromkeys(SUMMARY_FIELDS)
+    if not isinstance(summary, dict):
+        raise SampleError('system.summary must be an object')
+    fields = {}
+    for prefix, key in (('cpu', 'cpu_percent'), ('memory', 'memory_percent')):
+        stats = summary.get(key) or {}
+        for stat in ('min', 'max', 'avg', 'p95'):
+            fields[f'{prefix}_{stat}'] = stats.get(stat)
+    fields['sample_count'] = (summary.get('cpu_percent') or {}).get('count')
+    return fields
+
+
+def parse_host(host):
+    """Validate optional extended host metrics; None if the agent sent none"""
+    if host is None:
+        return None
+    if not isinstance(host, dict):
+        raise SampleError('host must be an object')
+    try:
+        load = host.get('load') or [None, None, None]
+        disk_io = host.get('disk_io') or {}
+        net_io = host.get('net_io') or {}
+        cores = host.get('cpu_per_core')
+        metric = {
+            'cpu_cores': json.dumps(cores, separators=(',', ':')) if cores is not None else None,
+            'load_1': load[0],
+            'load_5': load[1],
+            'load_15': load[2],
+            'disk_read_bytes': disk_io.get('read_bytes'),
+            'disk_write_bytes': disk_io.get('write_bytes'),
+            'disk_read_ops': disk_io.get('read_ops'),
+            'disk_write_ops': disk_io.get('write_ops'),
+            'net_sent_bytes': net_io.get('sent_bytes'),
+            'net_recv_bytes': net_io.get('recv_bytes'),
+            'net_sent_packets': net_io.get('sent_packets'),
+            'net_recv_packets': net_io.get('recv_packets'),
+            'process_count': host.get('process_count')
+        }
+        filesystems = [{
+            'mountpoint': fs['mount'],
+            'fstype': fs.get('fstype'),
+            'total': fs['total'],
+            'used': fs['used'],
+            'percent': fs['percent']
+        } for fs in host.get('filesystems') or []]
+        processes = [{
+            'pid': process['pid'],
+            'name': (process.get('name') or '')[:200],
+            'cpu_percent': process.get('cpu_percent'),
+            'rss': process.get('rss')
+        } for process in host.get('processes') or []]
+    except KeyError as e:
+        raise SampleError(f'Missing field: host.{e.args[0]}')
+    except (TypeError, AttributeError, IndexError):
+        raise SampleError('Malformed host metrics')
+    return {'metric': metric, 'filesystems': filesystems, 'processes': processes}
+
+
+def parse_sample(data):
+    """Validate one agent sample and convert it to table rows"""
+    if not isinstance(data, dict):
+        raise SampleError('Sample must be a JSON object')
+
+    try:
+        agent_id = data['agent_id']
+        agent_name = data['agent_name']
+        timestamp = parse_timestamp(data['timestamp'])
+        system_data = data['system']
+        memory = system_data['memory']
+        disk = system_data['disk']
+
+        metric = {
+            'agent_id': agent_id,
+            'timestamp': timestamp,
+            'cpu_percent': system_data['cpu_percent'],
+            'memory_total': memory['total'],
+            'memory_used': memory['used'],
+            'memory_percent': memory['percent'],
+            'disk_total': disk['total'],
+            'disk_used': disk['used'],
+            'disk_percent': disk['percent']
+        }
+        metric.update(parse_summary(system_data.get('summary')))
+
+        checks = []
+        for check in data.get('network') or []:
+            checks.append({
+                'agent_id': agent_id,
+                'timestamp': parse_timestamp(check['timestamp']) if 'timestamp' in check else timestamp,
+                'target': check.get('host') or check.get('url'),
+                'check_type': 'host' if 'host' in check else 'url',
+                'status': check['status'],
+                'latency_ms': check.get('latency_ms'),
+                'error_message': check.get('error')
+            })
+    except KeyError as e:
+        raise SampleError(f'Missing field: {e.args[0]}')
+    except (TypeError, AttributeError):
+        raise SampleError('Malformed sample structure')
+
+    if not agent_id or not isinstance(agent_id, str):
+        raise SampleError('agent_id must be a non-empty string')
+    interval = data.get('interval')
+    if interval is not None and (not isinstance(interval, (int, float)) or interval <= 0):
+        raise SampleError('interval must be a positive number of seconds')
+    if any(c['target'] is None for c in checks):
+        raise SampleError('Network check without host or url')
+    for check in checks:
+        if check['status'] not in CHECK_STATUS_CODES:
+            raise SampleError(f"Unknown check status: {check['status']}")
+
+    return {
+        'agent_id': agent_id,
+        'agent_name': agent_name,
+        'timestamp': timestamp,
+        'interval': int(interval) if interval else None,
+        'metric': metric,
+        'checks': checks,
+        'host': parse_host(data.get('host'))
+    }
+
+
+def _touch_agents(samples):
+    """
+    Create missing agents, refresh last_seen and note each sample's
+    agent_ref (agents.id); returns agents by agent_id
+    """
+    now = datetime.now(timezone.utc)
+    names, intervals = {}, {}
+    for sample in samples:
+        names[sample['agent_id']] = sample['agent_name']
+        if sample['interval']:
+            intervals[sample['agent_id']] = sample['interval']
+        sample['seen_at'] = now
+    agents = {a.agent_id: a for a in Agent.query.filter(Agent.agent_id.in_(names)).all()}
+
+    for agent_id, agent_name in names.items():
+        agent = agents.get(agent_id)
+        if not agent:
+            agent = agents[agent_id] = Agent(agent_id=agent_id, agent_name=agent_name)
+            db.session.add(agent)
+        agent.last_seen = now
+        agent.status = 'active'
+        agent.updated_at = now
+        if agent_id in intervals:
+            agent.expected_interval = intervals[agent_id]
+
+    # Agents must exist (and have ids) before the metric rows that reference them
+    db.session.flush()
+    for sample in samples:
+        sample['agent_ref'] = agents[sample['agent_id']].id
+    return agents
+
+
+# Targets are never renamed, so committed ids can be cached for the process
+_target_ids = {}
+_targets_by_id = {}  # id -> (target, check_type name)
+
+
+def _target_ids_for(checks):
+    """Integer ids of the checked targets, interning new ones"""
+    return intern_targets({check['target']: check['check_type'] for check in checks})
+
+
+def intern_targets(targets):
+    """Integer ids of {target: check_type} targets, interning new ones"""
+    ids = {}
+    missing = {}
+    for target, check_type in targets.items():
+        target_id = _target_ids.get(target)
+        if target_id is None:
+            missing[target] = CHECK_TYPE_CODES.get(check_type)
+        else:
+            ids[target] = target_id
+    if not missing:
+        return ids
+
+    known = dict(db.session.execute(
+        select(Target.target, Target.id).where(Target.target.in_(missing))
+    ).all())
+    _target_ids.update(known)
+    ids.update(known)
+
+    new = [{'target': t, 'check_type': c} for t, c in missing.items() if t not in known]
+    if new:
+        dialect = db.engine.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            # Another worker may intern the same target concurrently
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            db.session.execute(dialect_insert(Target).on_conflict_do_nothing(), new)
+        else:
+            db.session.execute(insert(Target), new)
+        # Not cached yet: these ids only become durable when the batch commits
+        ids.update(db.session.execute(
+            select(Target.target, Target.id).where(Target.target.in_([n['target'] for n in new]))
+        ).all())
+    return ids
+
+
+def lookup_targets(ids):
+    """(target, check_type) by id for those of ids that exist"""
+    found = {i: _targets_by_id[i] for i in ids if i in _targets_by_id}
+    missing = [i for i in ids if i not in found]
+    if missing:
+        for target_id, target, check_type in db.session.execute(
+            select(Target.id, Target.target, Target.check_type).where(Target.id.in_(missing))
+        ).all():
+            found[target_id] = _targets_by_id[target_id] = (target, CHECK_TYPE_NAMES.get(check_type))
+    return found
+
+
+def _utc_naive(timestamp):
+    """Timestamps are stored without a time zone, in UTC"""
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _metric_row(metric, agent):
+    """
+    Storage row for a parsed metric; totals are kept only when they change.
+
+    Changes are judged against the agent's newest sample. A sample older
+    than that one (e.g. replayed from a spool) always keeps its totals,
+    so readers can carry totals forward in timestamp order.
+    """
+    row = {
+        'agent_ref': agent.id,
+        'timestamp': metric['timestamp'],
+        'cpu_percent': metric['cpu_percent'],
+        'memory_used': metric['memory_used'],
+        'memory_percent': metric['memory_percent'],
+        'disk_used': metric['disk_used'],
+        'disk_percent': metric['disk_percent'],
+        'memory_total': None,
+        'disk_total': None
+    }
+    for name in SUMMARY_FIELDS:
+        row[name] = metric.get(name)
+    timestamp = _utc_naive(metric['timestamp'])
+    if agent.last_sample_at is not None and timestamp < agent.last_sample_at:
+        row['memory_total'] = metric['memory_total']
+        row['disk_total'] = metric['disk_total']
+        return row
+    agent.last_sample_at = timestamp
+    if metric['memory_total'] != agent.memory_total:
+        row['memory_total'] = agent.memory_total = metric['memory_total']
+    if metric['disk_total'] != agent.disk_total:
+        row['disk_total'] = agent.disk_total = metric['disk_total']
+    return row
+
+
+def _insert_rows(samples, agents, metrics=True):
+    """Insert metric and network check rows with one executemany per table"""
+    metric_rows = [_metric_row(s['metric'], agents[s['agent_id']]) for s in samples] if metrics else []
+    if not metrics:
+        # The series is stored elsewhere; still keep each agent's newest sample time
+        for sample in samples:
+            agent, timestamp = agents[sample['agent_id']], _utc_naive(sample['metric']['timestamp'])
+            if agent.last_sample_at is None or timestamp > agent.last_sample_at:
+                agent.last_sample_at = timestamp
+    checks = [c for s in samples for c in s['checks']]
+
+    if metric_rows:
+        db.session.execute(insert(SystemMetric), metric_rows)
+    if checks:
+        target_ids = _target_ids_for(checks)
+        for check in checks:
+            # Kept on the check for the alert rules evaluated after the commit
+            check['target_id'] = target_ids[check['target']]
+        check_rows = [{
+            'agent_ref': agents[c['agent_id']].id,
+            'target_id': c['target_id'],
+            'timestamp': c['timestamp'],
+            'status': CHECK_STATUS_CODES[c['status']],
+            'latency_ms': c['latency_ms'],
+            'error_message': c['error_message']
+        } for c in checks]
+        db.session.execute(insert(NetworkCheck), check_rows)
+        if Config.NETWORK_STATS_ENABLED:
+            # Same transaction, so the aggregates never disagree with the raw rows
+            record_checks(check_rows)
+
+    hosts = [s for s in samples if s.get('host')]
+    if hosts:
+        _insert_host_rows(hosts, agents)
+
+
+def _insert_host_rows(samples, agents):
+    """Extended host metrics: one row per sample plus its filesystems and top processes"""
+    metric_rows, filesystem_rows, process_rows = [], [], []
+    for sample in samples:
+        key = {'agent_ref': agents[sample['agent_id']].id, 'timestamp': sample['timestamp']}
+        host = sample['host']
+        metric_rows.append(dict(host['metric'], **key))
+        filesystem_rows.extend(dict(fs, **key) for fs in host['filesystems'])
+        process_rows.extend(dict(process, **key) for process in host['processes'])
+    db.session.execute(insert(HostMetric), metric_rows)
+    if filesystem_rows:
+        db.session.execute(insert(FilesystemUsage), filesystem_rows)
+    if process_rows:
+        db.session.execute(insert(ProcessSample), process_rows)
+
+
+@writing()
+def write_samples(samples, metrics=True):
+    """
+    Write parsed samples in a single transaction.
+
+    With metrics=False only agents and network checks are written, for
+    storage backends that keep the system metric series themselves.
+
+    If the bulk transaction fails on bad data, each sample is retried in
+    its own transaction so that one bad row does not reject the whole
+    batch. Returns a list of None (written) or an error message per sample;
+    samples hit by a transient database error get a RetryLater message,
+    and so do all samples after it, as the database is likely still
+    unavailable.
+    """
+    if not samples:
+        return []
+
+    try:
+        agents = _touch_agents(samples)
+        _insert_rows(samples, agents, metrics)
+        db.session.commit()
+        return [None] * len(samples)
+    except Exception as e:
+        db.session.rollback()
+        if is_transient(e):
+            return [RetryLater(str(e))] * len(samples)
+
+    errors = []
+    for sample in samples:
+        if errors and isinstance(errors[-1], RetryLater):
+            errors.append(errors[-1])
+            continue
+        try:
+            agents = _touch_agents([sample])
+            _insert_rows([sample], agents, metrics)
+            db.session.commit()
+            errors.append(None)
+        except Exception as e:
+            db.session.rollback()
+            errors.append(RetryLater(str(e)) if is_transient(e) else str(e))
+    return errors
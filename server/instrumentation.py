@@ -0,0 +1,309 @@
+"""
+Self-monitoring instrumentation
+Counters, gauges and histograms rendered in the Prometheus text format
+
+The metric classes are deliberately duplicated in agent/instrumentation.py:
+the agent and the server are installed separately (the agent on every
+monitored host) and share no package. Keep Registry, Counter, Gauge and
+Histogram identical in both files when changing either.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+# Seconds; suits request handlers and database calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base class: a named metric with optional labels"""
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._function = None
+
+    def set_function(self, func):
+        """Read the (unlabelled) value from func() at scrape time"""
+        self._function = func
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f'{self.name} expects labels {self.label_names}')
+        return tuple(labels[name] for name in self.label_names)
+
+    def _samples(self):
+        if self._function is not None:
+            return [('', (), self._function())]
+        with self._lock:
+            return [('', key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, value, *extra in self._samples():
+            labels = _format_labels(self.label_names, key, extra[0] if extra else ())
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Cumulative bucket histogram; observe() is a bisect and two additions"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, **labels):
+        """Context manager that observes the elapsed time of its block"""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', key, cumulative, [('le', _format_value(float(bound)))]))
+            samples.append(('_sum', key, total))
+            samples.append(('_count', key, cumulative))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+class Registry:
+    """A set of metrics exposed together"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._add(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class WorkerMetrics:
+    """
+    A Registry shared by the server's worker processes through a directory.
+
+    Each process writes its values to <directory>/<pid>-<start>.json every
+    `interval` seconds and before it answers a scrape; render() merges all
+    files. Counters and histograms are summed, including those of workers
+    that have exited, so totals do not go backwards whichever worker a
+    scrape lands on. Gauges get a `pid` label and are shown for live
+    workers only. Other workers' values are up to `interval` seconds old.
+    """
+
+    def __init__(self, registry, directory, interval=5):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f'{self.pid}-{time.time_ns()}.json')
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Write this process' values from a daemon thread every interval"""
+        def loop():
+            while True:
+                time.sleep(self.interval)
+                self.flush()
+        threading.Thread(target=loop, name='worker-metrics', daemon=True).start()
+        self.flush()
+
+    def _snapshot(self):
+        snapshot = {}
+        for metric in self.registry._metrics:
+            if metric._function is not None:
+                snapshot[metric.name] = [[[], metric._function()]]
+                continue
+            with metric._lock:
+                items = list(metric._values.items())
+            if isinstance(metric, Histogram):
+                items = [(key, [list(counts), total]) for key, (counts, total) in items]
+            snapshot[metric.name] = [[list(key), value] for key, value in items]
+        return snapshot
+
+    def flush(self):
+        """Write this process' current values"""
+        try:
+            data = json.dumps(self._snapshot())
+            with self._lock:
+                tmp = f'{self.path}.tmp'
+                with open(tmp, 'w') as f:
+                    f.write(data)
+                os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"Could not write worker metrics to {self.path}: {e}")
+
+    def _read(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    yield int(name.split('-')[0]), json.load(f)
+            except (OSError, ValueError):
+                continue  # being replaced or from another program
+
+    def render(self):
+        """All workers' metrics in the Prometheus text exposition format"""
+        self.flush()
+        files = list(self._read())
+        live = {pid for pid, _ in files if _alive(pid)}
+        lines = []
+        for metric in self.registry._metrics:
+            if isinstance(metric, Gauge):
+                merged = Gauge(metric.name, metric.documentation, metric.label_names + ('pid',))
+            elif isinstance(metric, Histogram):
+                merged = Histogram(metric.name, metric.documentation, metric.label_names, metric.buckets)
+            else:
+                merged = Counter(metric.name, metric.documentation, metric.label_names)
+            for pid, snapshot in files:
+                for key, value in snapshot.get(metric.name, ()):
+                    key = tuple(key)
+                    if isinstance(metric, Gauge):
+                        if pid in live:
+                            merged._values[key + (str(pid),)] = value
+                    elif isinstance(metric, Histogram):
+                        state = merged._values.setdefault(key, [[0] * len(value[0]), 0.0])
+                        state[0] = [a + b for a, b in zip(state[0], value[0])]
+                        state[1] += value[1]
+                    else:
+                        merged._values[key] = merged._values.get(key, 0) + value
+            lines.extend(merged.render())
+        return '\n'.join(lines) + '\n'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class LogSummary:
+    """
+    Aggregates frequent events into one log line per interval.
+
+    Replaces an info line per request: record() only bumps counters, and
+    whichever call first finds the interval elapsed writes the summary.
+    """
+
+    def __init__(self, logger, interval=60, level=logging.INFO):
+        self.logger = logger
+        self.interval = interval
+        self.level = level
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._counts = {}
+        self._sources = set()
+
+    def record(self, source=None, **counts):
+        """Add counts (and the agent they came from) to the current interval"""
+        with self._lock:
+            if source is not None:
+                self._sources.add(source)
+            for name, amount in counts.items():
+                self._counts[name] = self._counts.get(name, 0) + amount
+
+            now = time.monotonic()
+            elapsed = now - self._started
+            if elapsed < self.interval:
+                return
+            counts, sources = self._counts, len(self._sources)
+            self._counts, self._sources, self._started = {}, set(), now
+
+        details = ', '.join(f'{name}={amount}' for name, amount in sorted(counts.items()))
+        self.logger.log(self.level, f"Last {elapsed:.0f}s: {details} from {sources} agents")
@@ -0,0 +1,104 @@
+"""
+Background job runner
+Runs periodic maintenance tasks (rollups, retention) inside the server process
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundJobs(threading.Thread):
+    """
+    Runs registered tasks on fixed intervals in one daemon thread.
+
+    Every server worker runs this thread, so each run is claimed in the
+    database first: the job_state row "next_run.<task>" holds the epoch
+    second before which nobody may start the task. A worker claims a run
+    by moving it `lease` seconds ahead (in case it dies mid-run) and, when
+    done, to one interval after the run. Other workers skip the task until
+    then, so each task runs once per interval across all workers.
+    """
+
+    def __init__(self, app, lease=3600):
+        super().__init__(name='background-jobs', daemon=True)
+        self.app = app
+        self.lease = lease
+        self.tasks = []
+        self._stopping = threading.Event()
+
+    def add(self, name, interval, func):
+        """Register func to run every `interval` seconds inside an app context"""
+        self.tasks.append({'name': name, 'interval': interval, 'func': func, 'next_run': 0.0})
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            for task in self.tasks:
+                if task['next_run'] <= now:
+                    self._run_task(task)
+                    task['next_run'] = time.monotonic() + task['interval']
+
+            next_run = min((t['next_run'] for t in self.tasks), default=now + 60)
+            self._stopping.wait(max(0.0, next_run - time.monotonic()))
+
+    def _claim(self, name, until):
+        """Move the task's next run to `until` if it is due; True if this worker got it"""
+        from models import db, JobState
+        key = f'next_run.{name}'
+        if db.session.get(JobState, key) is None:
+            try:
+                db.session.add(JobState(name=key, value=0))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()  # another worker created it
+        claimed = db.session.execute(
+            update(JobState).where(JobState.name == key, JobState.value <= int(time.time()))
+            .values(value=until, updated_at=datetime.now(timezone.utc))
+        ).rowcount == 1
+        db.session.commit()
+        return claimed
+
+    def _finish(self, name, next_run):
+        from models import db, JobState
+        db.session.execute(
+            update(JobState).where(JobState.name == f'next_run.{name}')
+            .values(value=next_run, updated_at=datetime.now(timezone.utc))
+        )
+        db.session.commit()
+
+    def _run_task(self, task):
+        from bootstrap import writing
+        from models import db
+        started = time.monotonic()
+        # Jobs write, so on SQLite their transactions take the write lock up front
+        with self.app.app_context(), writing():
+            try:
+                if not self._claim(task['name'], int(time.time()) + self.lease):
+                    return
+            except Exception as e:
+                db.session.rollback()
+                db.session.remove()
+                logger.error(f"Job '{task['name']}' could not be scheduled: {e}")
+                return
+            try:
+                result = task['func']()
+                logger.info(f"Job '{task['name']}' finished in "
+                            f"{time.monotonic() - started:.2f}s: {result}")
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Job '{task['name']}' failed: {e}")
+            finally:
+                try:
+                    self._finish(task['name'], int(time.time()) + task['interval'])
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Job '{task['name']}' could not be rescheduled: {e}")
+                db.session.remove()
@@ -0,0 +1,147 @@
+"""
+Agent liveness tracker
+Marks agents stale or offline when they miss their expected heartbeat
+"""
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import update
+from bootstrap import writing
+from models import db, Agent
+from rollup import to_epoch
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('active', 'stale', 'offline')
+
+
+class LivenessTracker(threading.Thread):
+    """
+    Deadline-driven status sweeper.
+
+    Each heartbeat schedules the agent's next deadline in a min-heap, so
+    the sweeper only ever touches agents whose deadline has passed.
+    Superseded heap entries are skipped by comparing generations rather
+    than being removed. Status updates are conditional on last_seen, so
+    a heartbeat handled by another worker is never overwritten.
+    """
+
+    def __init__(self, app, default_interval=60, stale_factor=2.5, offline_factor=5.0,
+                 on_change=None):
+        super().__init__(name='liveness', daemon=True)
+        self.app = app
+        self.default_interval = default_interval
+        self.stale_factor = stale_factor
+        self.offline_factor = offline_factor
+        self.on_change = on_change
+
+        self._cond = threading.Condition()
+        self._heap = []  # (deadline, agent_id, generation, status)
+        self._agents = {}  # agent_id -> (last_seen epoch, interval, generation)
+        self._stopping = False
+        self.transitions = 0
+
+    def load(self):
+        """Schedule every agent that is not already offline (uses the status index)"""
+        agents = Agent.query.filter(Agent.status != 'offline').all()
+        for agent in agents:
+            if agent.last_seen:
+                self.heartbeat(agent.agent_id, to_epoch(agent.last_seen), agent.expected_interval)
+
+    def heartbeat(self, agent_id, seen_at, interval=None):
+        """Record that an agent reported at epoch time seen_at"""
+        interval = interval or self.default_interval
+        with self._cond:
+            previous = self._agents.get(agent_id)
+            if previous and previous[0] > seen_at:
+                return
+            generation = previous[2] + 1 if previous else 0
+            self._agents[agent_id] = (seen_at, interval, generation)
+
+            deadline = seen_at + self.stale_factor * interval
+            wake = not self._heap or deadline < self._heap[0][0]
+            heapq.heappush(self._heap, (deadline, agent_id, generation, 'stale'))
+            if wake:
+                self._cond.notify()
+
+    def pending(self):
+        """Number of scheduled deadlines, including superseded ones"""
+        with self._cond:
+            return len(self._heap)
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+
+    def run(self):
+        with self.app.app_context():
+            self.load()
+            db.session.remove()
+
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopping:
+                    return
+                due = self._pop_due(time.time())
+
+            if due:
+                try:
+                    with self.app.app_context():
+                        self._apply(due)
+                        db.session.remove()
+                except Exception as e:
+                    logger.error(f"Liveness sweep failed: {e}")
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, agent_id, generation, status = heapq.heappop(self._heap)
+            current = self._agents.get(agent_id)
+            if current and current[2] == generation:
+                due.append((agent_id, status, current[0], current[1], generation))
+        return due
+
+    @writing()
+    def _apply(self, due):
+        for agent_id, status, seen_at, interval, generation in due:
+            # Epoch values drop sub-second precision, so allow up to one second
+            seen = datetime.fromtimestamp(seen_at + 1, timezone.utc)
+            # Only move forward: active -> stale -> offline
+            allowed = ('active',) if status == 'stale' else ('active', 'stale')
+            result = db.session.execute(
+                update(Agent)
+                .where(Agent.agent_id == agent_id,
+                       Agent.status.in_(allowed),
+                       Agent.last_seen < seen)
+                .values(status=status)
+            )
+            db.session.commit()
+
+            if result.rowcount:
+                self.transitions += 1
+                logger.info(f"Agent {agent_id} is now {status}")
+                if self.on_change:
+                    self.on_change(agent_id, status)
+            else:
+                # Another worker may have seen a newer heartbeat
+                agent = Agent.query.filter_by(agent_id=agent_id).first()
+                if agent and agent.last_seen and to_epoch(agent.last_seen) > seen_at + 1:
+                    self.heartbeat(agent_id, to_epoch(agent.last_seen), agent.expected_interval)
+                    continue
+
+            if status == 'stale':
+                with self._cond:
+                    current = self._agents.get(agent_id)
+                    if current and current[2] == generation:
+                        heapq.heappush(self._heap, (
+                            seen_at + self.offline_factor * interval, agent_id, generation, 'offline'
+                        ))
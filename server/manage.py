@@ -0,0 +1,36 @@
+"""
+Server management commands
+Schema setup and database checks, run once per deploy instead of in every worker
+"""
+import argparse
+from sqlalchemy import text
+from models import db
+from bootstrap import create_app, init_db
+
+
+def check_db():
+    """Settings the database reports for the connections this server opens"""
+    with db.engine.connect() as connection:
+        dialect = connection.dialect.name
+        settings = {'dialect': dialect, 'pool': type(db.engine.pool).__name__}
+        if dialect == 'sqlite':
+            for pragma in ('journal_mode', 'synchronous', 'busy_timeout'):
+                settings[pragma] = connection.exec_driver_sql(f'PRAGMA {pragma}').scalar()
+        elif dialect == 'postgresql':
+            settings['statement_timeout'] = connection.execute(text('SHOW statement_timeout')).scalar()
+    return settings
+
+
+if __name__ == '__main__':
+    # python manage.py init-db | check-db
+    parser = argparse.ArgumentParser(description='Server management commands')
+    parser.add_argument('command', choices=('init-db', 'check-db'))
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        if args.command == 'init-db':
+            added = init_db()
+            print(f"Schema ready{'; added ' + ', '.join(added) if added else ''}")
+        else:
+            for name, value in check_db().items():
+                print(f"{name}: {value}")
@@ -0,0 +1,416 @@
+"""
+Storage migrations
+Moves the raw, rollup, network analytics and alert tables from the original
+string-keyed schema to the normalized one, adds columns introduced since a
+table was created, and reports how much space each table uses
+"""
+import argparse
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from bootstrap import writing
+from models import (db, Target, SystemMetric, NetworkCheck, MetricRollup, NetworkStat, NetworkOutage,
+                    Alert, AlertState, CHECK_TYPE_CODES, CHECK_STATUS_CODES)
+from retention import ensure_partitions, _is_partitioned, _partitions
+
+REPORT_TABLES = ('agents', 'targets', 'system_metrics', 'network_checks',
+                 'host_metrics', 'filesystem_usage', 'process_samples',
+                 'metric_rollups', 'network_stats', 'network_outages', 'alerts', 'alert_states')
+
+# Tables that referenced agents (and targets) by string in the original schema
+KEYED_MODELS = (SystemMetric, NetworkCheck, MetricRollup, NetworkStat, NetworkOutage, Alert, AlertState)
+
+# Partitioned definitions matching database/init.sql
+PARTITIONED_DDL = {
+    'system_metrics': """
+        CREATE TABLE system_metrics (
+            id SERIAL,
+            agent_ref INTEGER NOT NULL REFERENCES agents(id),
+            timestamp TIMESTAMP NOT NULL,
+            cpu_percent REAL,
+            memory_used BIGINT,
+            memory_percent REAL,
+            disk_used BIGINT,
+            disk_percent REAL,
+            memory_total BIGINT,
+            disk_total BIGINT,
+            cpu_min REAL,
+            cpu_max REAL,
+            cpu_avg REAL,
+            cpu_p95 REAL,
+            memory_min REAL,
+            memory_max REAL,
+            memory_avg REAL,
+            memory_p95 REAL,
+            sample_count SMALLINT,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)""",
+    'network_checks': """
+        CREATE TABLE network_checks (
+            id SERIAL,
+            agent_ref INTEGER NOT NULL REFERENCES agents(id),
+            target_id INTEGER NOT NULL REFERENCES targets(id),
+            timestamp TIMESTAMP NOT NULL,
+            status SMALLINT,
+            latency_ms REAL,
+            error_message TEXT,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)""",
+}
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def _columns(table):
+    inspector = inspect(db.session.connection())
+    if not inspector.has_table(table):
+        return set()
+    return {c['name'] for c in inspector.get_columns(table)}
+
+
+def _table_sizes(table):
+    """(table bytes, index bytes) including partitions, or (None, None) if unmeasurable"""
+    if _dialect() == 'postgresql':
+        return tuple(db.session.execute(text(
+            "SELECT COALESCE(SUM(pg_table_size(c.oid)), 0), COALESCE(SUM(pg_indexes_size(c.oid)), 0) "
+            "FROM pg_class c WHERE c.relname = :t OR c.oid IN ("
+            "  SELECT i.inhrelid FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhparent "
+            "  WHERE p.relname = :t)"
+        ), {'t': table}).one())
+    if _dialect() == 'sqlite':
+        try:
+            sizes = dict(db.session.execute(text(
+                "SELECT m.type, SUM(d.pgsize) FROM dbstat d "
+                "JOIN sqlite_master m ON m.name = d.name "
+                "WHERE m.tbl_name = :t GROUP BY m.type"
+            ), {'t': table}).all())
+            return sizes.get('table', 0), sizes.get('index', 0)
+        except Exception:
+            # dbstat is an optional SQLite compile-time feature
+            db.session.rollback()
+    return None, None
+
+
+def storage_report(tables=REPORT_TABLES):
+    """Rows, table bytes, index bytes and bytes per row for each existing table"""
+    report = []
+    for table in tables:
+        if not _columns(table):
+            continue
+        rows = db.session.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+        table_bytes, index_bytes = _table_sizes(table)
+        per_row = None
+        if rows and table_bytes is not None:
+            per_row = round((table_bytes + index_bytes) / rows, 1)
+        report.append({'table': table, 'rows': rows, 'table_bytes': table_bytes,
+                       'index_bytes': index_bytes, 'bytes_per_row': per_row})
+    return report
+
+
+def print_report(report, title):
+    print(title)
+    print(f"  {'table':<24}{'rows':>12}{'table bytes':>16}{'index bytes':>16}{'bytes/row':>12}")
+    for entry in report:
+        values = [entry['rows'], entry['table_bytes'], entry['index_bytes'], entry['bytes_per_row']]
+        rows, table_bytes, index_bytes, per_row = ['-' if v is None else v for v in values]
+        print(f"  {entry['table']:<24}{rows:>12}{table_bytes:>16}{index_bytes:>16}{per_row:>12}")
+
+
+def legacy_models():
+    """Models whose table still has the original agent_id string column"""
+    return [model for model in KEYED_MODELS if 'agent_id' in _columns(model.__tablename__)]
+
+
+def is_legacy():
+    return bool(legacy_models())
+
+
+def _rename_legacy(table):
+    """Move a table (and on PostgreSQL its partitions) out of the way as <table>_legacy"""
+    partitioned = _is_partitioned(table)
+    if partitioned:
+        names = [name for name, _, _ in _partitions(table)] + [f'{table}_default']
+        for name in names:
+            if db.session.execute(text("SELECT to_regclass(:n)"), {'n': name}).scalar():
+                suffix = name[len(table):]
+                db.session.execute(text(f"ALTER TABLE {name} RENAME TO {table}_legacy{suffix}"))
+    db.session.execute(text(f"ALTER TABLE {table} RENAME TO {table}_legacy"))
+    return partitioned
+
+
+def _first_timestamp(table):
+    value = db.session.execute(text(f"SELECT MIN(timestamp) FROM {table}")).scalar()
+    if isinstance(value, str):  # SQLite returns raw SQL timestamps as text
+        value = datetime.fromisoformat(value)
+    return value
+
+
+def _create_table(model, partitioned, since):
+    """Create a new-schema table without its secondary indexes (added after the copy)"""
+    table = model.__tablename__
+    if partitioned:
+        db.session.execute(text(PARTITIONED_DDL[table]))
+        db.session.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+        db.session.commit()
+        if since is not None:
+            ensure_partitions(table, since=since)
+    else:
+        db.session.execute(CreateTable(model.__table__))
+
+
+def _create_indexes(model):
+    connection = db.session.connection()
+    for index in model.__table__.indexes:
+        index.create(connection)
+
+
+def _copy_chunks(table, statement, chunk_size):
+    """Run an INSERT ... SELECT over legacy id ranges, one transaction per chunk"""
+    low, high = db.session.execute(text(f"SELECT MIN(id), MAX(id) FROM {table}_legacy")).one()
+    copied = 0
+    if low is None:
+        return copied
+    for start in range(low, high + 1, chunk_size):
+        result = db.session.execute(text(statement), {'low': start, 'high': start + chunk_size})
+        db.session.commit()
+        copied += max(result.rowcount, 0)
+    return copied
+
+
+def _copy_system_metrics(chunk_size):
+    # Totals are kept only where they differ from the agent's previous row.
+    # The first row of each agent in a chunk always keeps them, which costs at
+    # most one redundant value per agent and chunk.
+    return _copy_chunks('system_metrics', """
+        INSERT INTO system_metrics (id, agent_ref, timestamp, cpu_percent, memory_used,
+                                    memory_percent, disk_used, disk_percent, memory_total, disk_total)
+        SELECT m.id, a.id, m.timestamp, m.cpu_percent, m.memory_used, m.memory_percent,
+               m.disk_used, m.disk_percent,
+               CASE WHEN m.memory_total = m.prev_memory_total THEN NULL ELSE m.memory_total END,
+               CASE WHEN m.disk_total = m.prev_disk_total THEN NULL ELSE m.disk_total END
+        FROM (
+            SELECT l.*,
+                   LAG(l.memory_total) OVER (PARTITION BY l.agent_id ORDER BY l.timestamp, l.id)
+                       AS prev_memory_total,
+                   LAG(l.disk_total) OVER (PARTITION BY l.agent_id ORDER BY l.timestamp, l.id)
+                       AS prev_disk_total
+            FROM system_metrics_legacy l
+            WHERE l.id >= :low AND l.id < :high
+        ) m
+        JOIN agents a ON a.agent_id = m.agent_id
+    """, chunk_size)
+
+
+def _copy_network_checks(chunk_size):
+    types = ' '.join(f"WHEN '{name}' THEN {code}" for name, code in CHECK_TYPE_CODES.items())
+    db.session.execute(text(f"""
+        INSERT INTO targets (target, check_type)
+        SELECT c.target, MAX(CASE c.check_type {types} END)
+        FROM network_checks_legacy c
+        WHERE NOT EXISTS (SELECT 1 FROM targets t WHERE t.target = c.target)
+        GROUP BY c.target
+    """))
+    db.session.commit()
+
+    statuses = ' '.join(f"WHEN '{name}' THEN {code}" for name, code in CHECK_STATUS_CODES.items())
+    return _copy_chunks('network_checks', f"""
+        INSERT INTO network_checks (id, agent_ref, target_id, timestamp, status,
+                                    latency_ms, error_message)
+        SELECT c.id, a.id, t.id, c.timestamp, CASE c.status {statuses} END,
+               c.latency_ms, c.error_message
+        FROM network_checks_legacy c
+        JOIN agents a ON a.agent_id = c.agent_id
+        JOIN targets t ON t.target = c.target
+        WHERE c.id >= :low AND c.id < :high
+    """, chunk_size)
+
+
+def _intern_legacy_targets(models):
+    """Intern the targets named by legacy analytics and alert rows"""
+    for model in models:
+        table = f'{model.__tablename__}_legacy'
+        if 'target' not in _columns(table):
+            continue  # alerts predating per-target rules
+        db.session.execute(text(f"""
+            INSERT INTO targets (target)
+            SELECT DISTINCT l.target FROM {table} l
+            WHERE l.target IS NOT NULL AND l.target <> ''
+              AND NOT EXISTS (SELECT 1 FROM targets t WHERE t.target = l.target)
+        """))
+    db.session.commit()
+
+
+def _copy_keyed(model, chunk_size):
+    """Copy a rollup, network analytics or alert table, resolving agent_id and target to ids"""
+    table = model.__tablename__
+    legacy = _columns(f'{table}_legacy')
+    names = [c.name for c in model.__table__.columns
+             if c.name in legacy and c.name not in ('agent_ref', 'target_id')]
+    columns = names + ['agent_ref']
+    values = [f'l.{name}' for name in names] + ['a.id']
+    joins = 'JOIN agents a ON a.agent_id = l.agent_id'
+    if 'target_id' in model.__table__.columns and 'target' in legacy:
+        columns.append('target_id')
+        # Agent-wide alert states used '' and now use 0
+        values.append('COALESCE(t.id, 0)' if model is AlertState else 't.id')
+        joins += ' LEFT JOIN targets t ON t.target = l.target'
+    return _copy_chunks(table, f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        SELECT {', '.join(values)}
+        FROM {table}_legacy l
+        {joins}
+        WHERE l.id >= :low AND l.id < :high
+    """, chunk_size)
+
+
+@writing()
+def normalize(chunk_size=50000, keep_legacy=False):
+    """
+    Convert the original schema in place.
+
+    Every table still keyed by the agent_id string is renamed to *_legacy,
+    its new table is created and filled in id-ranged chunks (ids are
+    preserved, so job watermarks and alert_states.alert_id stay valid),
+    then the legacy tables are dropped unless keep_legacy is set. Returns
+    rows copied by table. Ingest should be stopped while this runs.
+    """
+    models = legacy_models()
+    raw = [model for model in models if model in (SystemMetric, NetworkCheck)]
+    dates = [d for d in map(_first_timestamp, [model.__tablename__ for model in raw]) if d]
+    since = min(dates) if dates else None
+
+    # The original indexes have the names the new tables' indexes reuse
+    for model in models:
+        for index in model.__table__.indexes:
+            db.session.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+    agent_columns = _columns('agents')
+    for column, column_type in (('expected_interval', 'INTEGER'), ('memory_total', 'BIGINT'),
+                                ('disk_total', 'BIGINT'), ('last_sample_at', 'TIMESTAMP')):
+        if column not in agent_columns:
+            db.session.execute(text(f"ALTER TABLE agents ADD COLUMN {column} {column_type}"))
+
+    partitioned = {model: _rename_legacy(model.__tablename__) for model in models}
+    if _dialect() == 'postgresql':
+        # Unique constraints are indexes there, and the new tables reuse their names
+        for model in models:
+            for constraint in model.__table__.constraints:
+                if isinstance(constraint, db.UniqueConstraint) and constraint.name:
+                    db.session.execute(text(
+                        f"ALTER TABLE {model.__tablename__}_legacy DROP CONSTRAINT IF EXISTS {constraint.name}"
+                    ))
+    Target.__table__.create(db.session.connection(), checkfirst=True)
+    for model, is_partitioned in partitioned.items():
+        _create_table(model, is_partitioned, since)
+    db.session.commit()
+
+    copied = {}
+    if SystemMetric in models:
+        copied['system_metrics'] = _copy_system_metrics(chunk_size)
+    if NetworkCheck in models:
+        copied['network_checks'] = _copy_network_checks(chunk_size)
+    keyed = [model for model in models if model not in raw]
+    _intern_legacy_targets([model for model in keyed if model is not MetricRollup])
+    for model in keyed:
+        copied[model.__tablename__] = _copy_keyed(model, chunk_size)
+
+    if SystemMetric in models:
+        # Seed the newest sample's totals that ingest compares new samples against
+        for agent_column, column in (('memory_total', 'memory_total'), ('disk_total', 'disk_total'),
+                                     ('last_sample_at', 'timestamp')):
+            db.session.execute(text(
+                f"UPDATE agents SET {agent_column} = (SELECT l.{column} FROM system_metrics_legacy l "
+                f"WHERE l.agent_id = agents.agent_id ORDER BY l.timestamp DESC, l.id DESC LIMIT 1)"
+            ))
+
+    for model in models:
+        _create_indexes(model)
+        if _dialect() == 'postgresql':
+            table = model.__tablename__
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+            ))
+    db.session.commit()
+
+    if not keep_legacy:
+        for model in models:
+            db.session.execute(text(f"DROP TABLE {model.__tablename__}_legacy"))
+        db.session.commit()
+    return copied
+
+
+@writing()
+def add_columns():
+    """
+    Add nullable model columns missing from existing tables, e.g. the
+    high-resolution summary columns of system_metrics. Returns the
+    "table.column" names added.
+    """
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing = _columns(table.name)
+        if not existing:
+            continue
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            added.append(f"{table.name}.{column.name}")
+    db.session.commit()
+    return added
+
+
+def vacuum():
+    """Return freed pages to the filesystem (SQLite) or refresh statistics (PostgreSQL)"""
+    db.session.commit()
+    statement = 'VACUUM ANALYZE' if _dialect() == 'postgresql' else 'VACUUM'
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.exec_driver_sql(statement)
+
+
+if __name__ == '__main__':
+    # python migrate.py report | upgrade | normalize [--keep-legacy] [--chunk-size N] [--vacuum]
+    # Config was already loaded through retention, so override it directly:
+    # no background jobs, and no create_all/add_columns on the legacy schema
+    from config import Config
+    Config.BACKGROUND_JOBS = False
+    Config.AUTO_CREATE_SCHEMA = False
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Storage schema migrations')
+    parser.add_argument('command', choices=('report', 'upgrade', 'normalize'))
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--keep-legacy', action='store_true',
+                        help='keep the *_legacy tables after copying')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='reclaim space once the legacy tables are dropped')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.command == 'report':
+            print_report(storage_report(REPORT_TABLES + tuple(f'{model.__tablename__}_legacy'
+                                                              for model in KEYED_MODELS)), 'Storage')
+        elif args.command == 'upgrade':
+            if is_legacy():
+                parser.error('run normalize before upgrading a legacy schema')
+            from bootstrap import init_db
+            db.session.commit()  # init_db takes the schema lock on its own connection
+            added = init_db()
+            print(f"Added columns: {', '.join(added)}" if added else 'Schema is up to date')
+        elif not is_legacy():
+            print('Schema is already normalized')
+            print_report(storage_report(), 'Storage')
+        else:
+            print_report(storage_report(), 'Before')
+            copied = normalize(args.chunk_size, args.keep_legacy)
+            print('Copied ' + ', '.join(f"{rows} {table}" for table, rows in copied.items()))
+            if args.vacuum and not args.keep_legacy:
+                vacuum()
+            tables = REPORT_TABLES
+            if args.keep_legacy:
+                tables += tuple(f'{table}_legacy' for table in copied)
+            print_report(storage_report(tables), 'After')
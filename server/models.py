@@ -3,9 +3,21 @@ Database models
 """
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
+import json
+from sqlalchemy import select
 
 db = SQLAlchemy()
 
+# Small-int codes stored instead of repeated strings
+CHECK_TYPE_CODES = {'host': 1, 'url': 2}
+CHECK_TYPE_NAMES = {code: name for name, code in CHECK_TYPE_CODES.items()}
+CHECK_STATUS_CODES = {'up': 1, 'degraded': 2, 'down': 3}
+CHECK_STATUS_NAMES = {code: name for name, code in CHECK_STATUS_CODES.items()}
+
+# High-resolution summary columns of system_metrics (named like the rollup columns)
+SUMMARY_FIELDS = ('cpu_min', 'cpu_max', 'cpu_avg', 'cpu_p95',
+                  'memory_min', 'memory_max', 'memory_avg', 'memory_p95', 'sample_count')
+
 class Agent(db.Model):
     """Agent information model"""
     __tablename__ = 'agents'
@@ -13,8 +25,12 @@ class Agent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     agent_id = db.Column(db.String(100), unique=True, nullable=False)
     agent_name = db.Column(db.String(200), nullable=False)
-    status = db.Column(db.String(20), default='active')
-    last_seen = db.Column(db.DateTime)
+    status = db.Column(db.String(20), default='active', index=True)
+    last_seen = db.Column(db.DateTime, index=True)
+    expected_interval = db.Column(db.Integer)  # seconds between samples, as reported
+    memory_total = db.Column(db.BigInteger)  # totals of the newest sample; metric rows
+    disk_total = db.Column(db.BigInteger)    # store them only when they change
+    last_sample_at = db.Column(db.DateTime)  # timestamp of the newest sample
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     
@@ -26,51 +42,178 @@ class Agent(db.Model):
             'last_seen': self.last_seen.isoformat() if self.last_seen else None
         }
 
+def agent_ref(agent_id):
+    """Scalar subquery resolving an agent_id string to the integer agents.id"""
+    return select(Agent.id).where(Agent.agent_id == agent_id).scalar_subquery()
+
+class Target(db.Model):
+    """Interned network check target"""
+    __tablename__ = 'targets'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    target = db.Column(db.String(500), unique=True, nullable=False)
+    check_type = db.Column(db.SmallInteger)  # CHECK_TYPE_CODES
+
 class SystemMetric(db.Model):
     """System metrics model"""
     __tablename__ = 'system_metrics'
+    __table_args__ = (
+        db.Index('idx_system_metrics_agent_time', 'agent_ref', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    agent_id = db.Column(db.String(100), db.ForeignKey('agents.agent_id'), nullable=False)
+    agent_ref = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False)
-    cpu_percent = db.Column(db.Float)
-    memory_total = db.Column(db.BigInteger)
+    cpu_percent = db.Column(db.REAL)
     memory_used = db.Column(db.BigInteger)
-    memory_percent = db.Column(db.Float)
-    disk_total = db.Column(db.BigInteger)
+    memory_percent = db.Column(db.REAL)
     disk_used = db.Column(db.BigInteger)
-    disk_percent = db.Column(db.Float)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    disk_percent = db.Column(db.REAL)
+    # NULL unless the total changed since the agent's previous sample (late
+    # samples, older than the agent's newest, always keep their totals)
+    memory_total = db.Column(db.BigInteger)
+    disk_total = db.Column(db.BigInteger)
+    # Summary of the agent's high-resolution readings since its previous
+    # sample; NULL for agents without HIGHRES_INTERVAL
+    cpu_min = db.Column(db.REAL)
+    cpu_max = db.Column(db.REAL)
+    cpu_avg = db.Column(db.REAL)
+    cpu_p95 = db.Column(db.REAL)
+    memory_min = db.Column(db.REAL)
+    memory_max = db.Column(db.REAL)
+    memory_avg = db.Column(db.REAL)
+    memory_p95 = db.Column(db.REAL)
+    sample_count = db.Column(db.SmallInteger)
     
     def to_dict(self):
-        return {
+        data = {
             'timestamp': self.timestamp.isoformat(),
             'cpu_percent': self.cpu_percent,
             'memory_percent': self.memory_percent,
             'disk_percent': self.disk_percent
         }
+        if self.sample_count:
+            data.update({name: getattr(self, name) for name in SUMMARY_FIELDS})
+        return data
 
 class NetworkCheck(db.Model):
     """Network check results model"""
     __tablename__ = 'network_checks'
+    __table_args__ = (
+        db.Index('idx_network_checks_agent_time', 'agent_ref', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    agent_id = db.Column(db.String(100), db.ForeignKey('agents.agent_id'), nullable=False)
+    agent_ref = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=False)
+    target_id = db.Column(db.Integer, db.ForeignKey('targets.id'), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False)
-    target = db.Column(db.String(500), nullable=False)
-    check_type = db.Column(db.String(20))
-    status = db.Column(db.String(20))
-    latency_ms = db.Column(db.Float)
+    status = db.Column(db.SmallInteger)  # CHECK_STATUS_CODES
+    latency_ms = db.Column(db.REAL)
     error_message = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+class HostMetric(db.Model):
+    """Extended host metrics (load, per-core CPU, I/O rates per second)"""
+    __tablename__ = 'host_metrics'
+    __table_args__ = (
+        db.Index('idx_host_metrics_agent_time', 'agent_ref', 'timestamp'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    agent_ref = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    cpu_cores = db.Column(db.Text)  # JSON list of per-core percentages
+    load_1 = db.Column(db.REAL)
+    load_5 = db.Column(db.REAL)
+    load_15 = db.Column(db.REAL)
+    disk_read_bytes = db.Column(db.REAL)
+    disk_write_bytes = db.Column(db.REAL)
+    disk_read_ops = db.Column(db.REAL)
+    disk_write_ops = db.Column(db.REAL)
+    net_sent_bytes = db.Column(db.REAL)
+    net_recv_bytes = db.Column(db.REAL)
+    net_sent_packets = db.Column(db.REAL)
+    net_recv_packets = db.Column(db.REAL)
+    process_count = db.Column(db.Integer)
+    
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp.isoformat(),
+            'cpu_per_core': json.loads(self.cpu_cores) if self.cpu_cores else None,
+            'load': [self.load_1, self.load_5, self.load_15],
+            'disk_io': {
+                'read_bytes': self.disk_read_bytes,
+                'write_bytes': self.disk_write_bytes,
+                'read_ops': self.disk_read_ops,
+                'write_ops': self.disk_write_ops
+            },
+            'net_io': {
+                'sent_bytes': self.net_sent_bytes,
+                'recv_bytes': self.net_recv_bytes,
+                'sent_packets': self.net_sent_packets,
+                'recv_packets': self.net_recv_packets
+            },
+            'process_count': self.process_count
+        }
+
+class FilesystemUsage(db.Model):
+    """Usage of one mounted filesystem at a sample time"""
+    __tablename__ = 'filesystem_usage'
+    __table_args__ = (
+        db.Index('idx_filesystem_usage_agent_time', 'agent_ref', 'timestamp'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    agent_ref = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    mountpoint = db.Column(db.String(500), nullable=False)
+    fstype = db.Column(db.String(50))
+    total = db.Column(db.BigInteger)
+    used = db.Column(db.BigInteger)
+    percent = db.Column(db.REAL)
+    
+    def to_dict(self):
+        return {
+            'mount': self.mountpoint,
+            'fstype': self.fstype,
+            'total': self.total,
+            'used': self.used,
+            'percent': self.percent
+        }
+
+class ProcessSample(db.Model):
+    """One of the top processes (by CPU or RSS) reported with a sample"""
+    __tablename__ = 'process_samples'
+    __table_args__ = (
+        db.Index('idx_process_samples_agent_time', 'agent_ref', 'timestamp'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    agent_ref = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    pid = db.Column(db.Integer)
+    name = db.Column(db.String(200))
+    cpu_percent = db.Column(db.REAL)
+    rss = db.Column(db.BigInteger)
+    
+    def to_dict(self):
+        return {
+            'pid': self.pid,
+            'name': self.name,
+            'cpu_percent': self.cpu_percent,
+            'rss': self.rss
+        }
 
 class Alert(db.Model):
     """Alert records model"""
     __tablename__ = 'alerts'
+    __table_args__ = (
+        db.Index('idx_alerts_agent_status', 'agent_ref', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    agent_id = db.Column(db.String(100), db.ForeignKey('agents.agent_id'), nullable=False)
+    agent_ref = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=False)
     alert_type = db.Column(db.String(50))
+    target_id = db.Column(db.Integer, db.ForeignKey('targets.id'))  # per-target rules only
     severity = db.Column(db.String(20))
     message = db.Column(db.Text)
     threshold_value = db.Column(db.Float)
@@ -80,3 +223,140 @@ class Alert(db.Model):
     resolved_at = db.Column(db.DateTime)
     notified = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    def to_dict(self, agent_id, target=None):
+        """The agent_id and target strings come from the agents and targets tables"""
+        return {
+            'id': self.id,
+            'agent_id': agent_id,
+            'alert_type': self.alert_type,
+            'target': target,
+            'severity': self.severity,
+            'message': self.message,
+            'threshold_value': self.threshold_value,
+            'actual_value': self.actual_value,
+            'status': self.status,
+            'triggered_at': self.triggered_at.isoformat(),
+            'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None
+        }
+
+class AlertState(db.Model):
+    """Streak counters of one alert rule for one agent (and network target)"""
+    __tablename__ = 'alert_states'
+    __table_args__ = (
+        db.UniqueConstraint('agent_ref', 'rule', 'target_id', name='uq_alert_states_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    agent_ref = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=False)
+    rule = db.Column(db.String(50), nullable=False)
+    target_id = db.Column(db.Integer, nullable=False, default=0)  # targets.id, 0 for agent-wide rules
+    breaches = db.Column(db.Integer, nullable=False, default=0)
+    clears = db.Column(db.Integer, nullable=False, default=0)
+    alert_id = db.Column(db.Integer)  # the open alert, if any
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+
+class MetricRollup(db.Model):
+    """Downsampled system metrics (one row per agent, resolution and bucket)"""
+    __tablename__ = 'metric_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('agent_ref', 'resolution', 'bucket_start',
+                            name='uq_metric_rollups_agent_res_bucket'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    agent_ref = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=False)
+    resolution = db.Column(db.Integer, nullable=False)  # bucket width in seconds
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    sample_count = db.Column(db.Integer, nullable=False)
+    cpu_min = db.Column(db.Float)
+    cpu_max = db.Column(db.Float)
+    cpu_avg = db.Column(db.Float)
+    cpu_p95 = db.Column(db.Float)
+    memory_min = db.Column(db.Float)
+    memory_max = db.Column(db.Float)
+    memory_avg = db.Column(db.Float)
+    memory_p95 = db.Column(db.Float)
+    disk_min = db.Column(db.Float)
+    disk_max = db.Column(db.Float)
+    disk_avg = db.Column(db.Float)
+    disk_p95 = db.Column(db.Float)
+    
+    def to_dict(self):
+        return {
+            'timestamp': self.bucket_start.isoformat(),
+            'cpu_percent': self.cpu_avg,
+            'memory_percent': self.memory_avg,
+            'disk_percent': self.disk_avg,
+            'sample_count': self.sample_count,
+            'cpu_min': self.cpu_min,
+            'cpu_max': self.cpu_max,
+            'cpu_p95': self.cpu_p95,
+            'memory_min': self.memory_min,
+            'memory_max': self.memory_max,
+            'memory_p95': self.memory_p95,
+            'disk_min': self.disk_min,
+            'disk_max': self.disk_max,
+            'disk_p95': self.disk_p95
+        }
+
+# Number of latency histogram bins in NetworkStat (see network_stats.LATENCY_BOUNDS)
+NETWORK_LATENCY_BINS = 24
+
+class NetworkStat(db.Model):
+    """Per agent/target network check counts and latency histogram for one time bucket"""
+    __tablename__ = 'network_stats'
+    __table_args__ = (
+        db.UniqueConstraint('agent_ref', 'target_id', 'bucket_start',
+                            name='uq_network_stats_agent_target_bucket'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    agent_ref = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=False)
+    target_id = db.Column(db.Integer, db.ForeignKey('targets.id'), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    up_count = db.Column(db.Integer, nullable=False, default=0)
+    degraded_count = db.Column(db.Integer, nullable=False, default=0)
+    down_count = db.Column(db.Integer, nullable=False, default=0)
+    latency_count = db.Column(db.Integer, nullable=False, default=0)
+    latency_sum = db.Column(db.Float, nullable=False, default=0)
+    latency_max = db.Column(db.Float)
+    
+    # Mergeable latency histogram: lat_00 .. lat_23 hold the counts per bin
+    for _bin in range(NETWORK_LATENCY_BINS):
+        vars()[f'lat_{_bin:02d}'] = db.Column(db.Integer, nullable=False, default=0)
+    del _bin
+
+class NetworkOutage(db.Model):
+    """A run of consecutive failed checks against one target"""
+    __tablename__ = 'network_outages'
+    __table_args__ = (
+        db.Index('idx_network_outages_agent_target', 'agent_ref', 'target_id', 'started_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    agent_ref = db.Column(db.Integer, db.ForeignKey('agents.id'), nullable=False)
+    target_id = db.Column(db.Integer, db.ForeignKey('targets.id'), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+    ended_at = db.Column(db.DateTime)  # NULL while the outage is ongoing
+    last_failure_at = db.Column(db.DateTime, nullable=False)
+    failed_checks = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self, target):
+        return {
+            'target': target,
+            'started_at': self.started_at.isoformat(),
+            'ended_at': self.ended_at.isoformat() if self.ended_at else None,
+            'last_failure_at': self.last_failure_at.isoformat(),
+            'failed_checks': self.failed_checks,
+            'duration_seconds': (self.ended_at - self.started_at).total_seconds()
+                                if self.ended_at else None
+        }
+
+class JobState(db.Model):
+    """Progress markers for background jobs"""
+    __tablename__ = 'job_state'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
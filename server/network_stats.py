@@ -0,0 +1,279 @@
+"""
+Network check analytics
+Maintains per agent/target counters, latency histograms and outage intervals
+as checks are ingested, and answers uptime and latency queries from them
+"""
+import bisect
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select, update, insert, delete, func, or_
+from bootstrap import writing
+from models import (db, Target, NetworkStat, NetworkOutage, NETWORK_LATENCY_BINS,
+                    CHECK_STATUS_CODES, agent_ref)
+
+# Width of a NetworkStat bucket in seconds
+BUCKET_SECONDS = 300
+
+# Upper bounds in ms of every latency bin but the last: 1ms, 1.4ms, 2ms ... 2048ms.
+# Bins grow by sqrt(2), so interpolated percentiles stay within about 20%.
+LATENCY_BOUNDS = tuple(2 ** (i / 2) for i in range(NETWORK_LATENCY_BINS - 1))
+BIN_COLUMNS = tuple(f'lat_{i:02d}' for i in range(NETWORK_LATENCY_BINS))
+COUNTER_COLUMNS = ('up_count', 'degraded_count', 'down_count',
+                   'latency_count', 'latency_sum') + BIN_COLUMNS
+DOWN = CHECK_STATUS_CODES['down']
+DEGRADED = CHECK_STATUS_CODES['degraded']
+
+
+def _naive_utc(ts):
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _bucket(ts):
+    return ts - timedelta(seconds=(ts.minute * 60 + ts.second) % BUCKET_SECONDS,
+                          microseconds=ts.microsecond)
+
+
+def latency_bin(latency_ms):
+    return bisect.bisect_left(LATENCY_BOUNDS, latency_ms)
+
+
+def _aggregate(checks):
+    """Fold check rows into one counter row per (agent, target, bucket)"""
+    rows = {}
+    for check in checks:
+        timestamp = _naive_utc(check['timestamp'])
+        key = (check['agent_ref'], check['target_id'], _bucket(timestamp))
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = dict.fromkeys(COUNTER_COLUMNS, 0)
+            row.update(agent_ref=key[0], target_id=key[1], bucket_start=key[2], latency_max=None)
+
+        status = check['status']
+        row['down_count' if status == DOWN else
+            'degraded_count' if status == DEGRADED else 'up_count'] += 1
+
+        latency = check.get('latency_ms')
+        if latency is not None and status != DOWN:
+            row['latency_count'] += 1
+            row['latency_sum'] += latency
+            row[BIN_COLUMNS[latency_bin(latency)]] += 1
+            row['latency_max'] = max(row['latency_max'] or 0.0, latency)
+    return list(rows.values())
+
+
+def _upsert(rows):
+    """Add counter rows to existing buckets, creating missing ones"""
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            greatest = func.greatest
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            greatest = func.max  # two-argument max() is scalar in SQLite
+
+        statement = dialect_insert(NetworkStat)
+        updates = {c: getattr(NetworkStat, c) + statement.excluded[c] for c in COUNTER_COLUMNS}
+        updates['latency_max'] = func.coalesce(
+            greatest(NetworkStat.latency_max, statement.excluded.latency_max),
+            NetworkStat.latency_max, statement.excluded.latency_max)
+        statement = statement.on_conflict_do_update(
+            index_elements=['agent_ref', 'target_id', 'bucket_start'], set_=updates)
+        db.session.execute(statement, rows)
+        return
+
+    # Generic path: increment in place, insert when the bucket does not exist yet
+    for row in rows:
+        values = {c: getattr(NetworkStat, c) + row[c] for c in COUNTER_COLUMNS}
+        if row['latency_max'] is not None:
+            values['latency_max'] = func.coalesce(
+                func.greatest(NetworkStat.latency_max, row['latency_max']), row['latency_max'])
+        result = db.session.execute(
+            update(NetworkStat)
+            .where(NetworkStat.agent_ref == row['agent_ref'],
+                   NetworkStat.target_id == row['target_id'],
+                   NetworkStat.bucket_start == row['bucket_start'])
+            .values(values)
+        )
+        if not result.rowcount:
+            db.session.execute(insert(NetworkStat), [row])
+
+
+def _update_outages(checks):
+    """Open an outage on the first failed check of a run and close it on the next success"""
+    agents = {c['agent_ref'] for c in checks}
+    open_outages = {
+        (o.agent_ref, o.target_id): o for o in NetworkOutage.query.filter(
+            NetworkOutage.agent_ref.in_(agents), NetworkOutage.ended_at.is_(None))
+    }
+
+    for check in sorted(checks, key=lambda c: _naive_utc(c['timestamp'])):
+        key = (check['agent_ref'], check['target_id'])
+        timestamp = _naive_utc(check['timestamp'])
+        outage = open_outages.get(key)
+
+        if check['status'] == DOWN:
+            if outage is None:
+                outage = open_outages[key] = NetworkOutage(
+                    agent_ref=key[0], target_id=key[1], started_at=timestamp,
+                    last_failure_at=timestamp, failed_checks=0)
+                db.session.add(outage)
+            if timestamp >= outage.started_at:
+                outage.failed_checks += 1
+                outage.last_failure_at = max(outage.last_failure_at, timestamp)
+        elif outage is not None and timestamp > outage.last_failure_at:
+            # Replayed samples older than the failure do not end the outage
+            outage.ended_at = timestamp
+            del open_outages[key]
+
+
+def record_checks(checks):
+    """
+    Fold ingested network_checks rows (agent_ref, target_id, timestamp,
+    status code, latency_ms) into the analytics tables; runs in the ingest
+    transaction
+    """
+    if not checks:
+        return
+    _upsert(_aggregate(checks))
+    _update_outages(checks)
+
+
+def histogram_percentile(counts, p, max_value=None):
+    """Percentile in ms from bin counts, interpolating linearly inside the bin"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = p / 100.0 * total
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if count and cumulative + count >= rank:
+            lower = LATENCY_BOUNDS[index - 1] if index else 0.0
+            upper = LATENCY_BOUNDS[index] if index < len(LATENCY_BOUNDS) else (max_value or lower)
+            if max_value is not None:
+                upper = min(upper, max_value)
+            return lower + (upper - lower) * (rank - cumulative) / count
+        cumulative += count
+    return max_value
+
+
+def target_stats(agent_id, start, end=None):
+    """
+    Uptime and latency per target of an agent between start and end.
+
+    Sums the stored buckets in one aggregate query, so the cost depends
+    on the number of buckets in the window, not on the number of checks.
+    The window is widened to whole buckets.
+    """
+    end = _naive_utc(end or datetime.now(timezone.utc))
+    start = _bucket(_naive_utc(start))
+
+    agent = agent_ref(agent_id)
+    sums = [func.sum(getattr(NetworkStat, c)).label(c) for c in COUNTER_COLUMNS]
+    rows = db.session.execute(
+        select(NetworkStat.target_id, Target.target,
+               func.max(NetworkStat.latency_max).label('latency_max'), *sums)
+        .join(Target, Target.id == NetworkStat.target_id)
+        .where(NetworkStat.agent_ref == agent,
+               NetworkStat.bucket_start >= start,
+               NetworkStat.bucket_start < end)
+        .group_by(NetworkStat.target_id, Target.target)
+        .order_by(Target.target)
+    ).all()
+
+    outage_counts = dict(db.session.execute(
+        select(NetworkOutage.target_id, func.count())
+        .where(NetworkOutage.agent_ref == agent,
+               NetworkOutage.started_at < end,
+               or_(NetworkOutage.ended_at.is_(None), NetworkOutage.ended_at >= start))
+        .group_by(NetworkOutage.target_id)
+    ).all())
+    down_now = set(db.session.execute(
+        select(NetworkOutage.target_id)
+        .where(NetworkOutage.agent_ref == agent, NetworkOutage.ended_at.is_(None))
+    ).scalars())
+
+    targets = []
+    for row in rows:
+        checks = row.up_count + row.degraded_count + row.down_count
+        counts = [getattr(row, c) or 0 for c in BIN_COLUMNS]
+        targets.append({
+            'target': row.target,
+            'status': 'down' if row.target_id in down_now else 'up',
+            'checks': checks,
+            'up': row.up_count,
+            'degraded': row.degraded_count,
+            'down': row.down_count,
+            'uptime_percent': round(100.0 * (checks - row.down_count) / checks, 3) if checks else None,
+            'latency_avg_ms': round(row.latency_sum / row.latency_count, 2) if row.latency_count else None,
+            'latency_p50_ms': _round(histogram_percentile(counts, 50, row.latency_max)),
+            'latency_p95_ms': _round(histogram_percentile(counts, 95, row.latency_max)),
+            'latency_p99_ms': _round(histogram_percentile(counts, 99, row.latency_max)),
+            'latency_max_ms': row.latency_max,
+            'outages': outage_counts.get(row.target_id, 0)
+        })
+    return targets
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def outages(agent_id, start, end=None, target=None, limit=500):
+    """Outages of an agent overlapping the window as dicts, newest first"""
+    end = _naive_utc(end or datetime.now(timezone.utc))
+    statement = select(NetworkOutage, Target.target)\
+        .join(Target, Target.id == NetworkOutage.target_id)\
+        .where(NetworkOutage.agent_ref == agent_ref(agent_id),
+               NetworkOutage.started_at < end,
+               or_(NetworkOutage.ended_at.is_(None), NetworkOutage.ended_at >= _naive_utc(start)))
+    if target:
+        statement = statement.where(Target.target == target)
+    rows = db.session.execute(statement.order_by(NetworkOutage.started_at.desc()).limit(limit)).all()
+    return [outage.to_dict(target) for outage, target in rows]
+
+
+@writing()
+def rebuild(chunk_size=10000):
+    """
+    Recompute all analytics from raw network_checks.
+
+    Meant for a maintenance window (or first deployment): ingest should be
+    stopped, since checks written meanwhile would be counted twice.
+    """
+    from models import NetworkCheck
+
+    db.session.execute(delete(NetworkStat))
+    db.session.execute(delete(NetworkOutage))
+    db.session.commit()
+
+    last_id, processed = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(NetworkCheck.id, NetworkCheck.agent_ref, NetworkCheck.target_id,
+                   NetworkCheck.timestamp, NetworkCheck.status, NetworkCheck.latency_ms)
+            .where(NetworkCheck.id > last_id)
+            .order_by(NetworkCheck.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        record_checks([row._asdict() for row in rows])
+        db.session.commit()
+        last_id = rows[-1][0]
+        processed += len(rows)
+    return processed
+
+
+if __name__ == '__main__':
+    # python network_stats.py rebuild
+    import os
+    import sys
+    os.environ['BACKGROUND_JOBS'] = 'false'
+    from app import app
+
+    if sys.argv[1:] != ['rebuild']:
+        sys.exit('usage: python network_stats.py rebuild')
+    with app.app_context():
+        print(f"Network checks processed: {rebuild()}")
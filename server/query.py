@@ -0,0 +1,380 @@
+"""
+Fleet-wide aggregate queries
+Group-by, aggregation and top-k over system metrics and network checks,
+computed in the database and cached per time bucket
+"""
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from itertools import groupby
+from sqlalchemy import select, func, case, cast, Integer
+from models import db, Agent, Target, SystemMetric, NetworkCheck, MetricRollup, CHECK_STATUS_CODES
+from config import Config
+from rollup import RESOLUTIONS, covered_until, percentile
+
+SOURCES = {
+    'system': {
+        'model': SystemMetric,
+        'metrics': {
+            'cpu': SystemMetric.cpu_percent,
+            'memory': SystemMetric.memory_percent,
+            'disk': SystemMetric.disk_percent,
+        },
+        'group_by': ('agent', 'time'),
+    },
+    'network': {
+        'model': NetworkCheck,
+        'metrics': {
+            'latency': NetworkCheck.latency_ms,
+            # Percentage of checks that were not down (degraded counts as up)
+            'availability': case((NetworkCheck.status == CHECK_STATUS_CODES['down'], 0.0),
+                                 else_=100.0),
+        },
+        'group_by': ('agent', 'target', 'time'),
+    },
+}
+
+AGGREGATIONS = ('avg', 'min', 'max', 'count', 'p50', 'p90', 'p95', 'p99')
+
+MAX_HOURS = 24 * 365
+
+
+class QueryError(ValueError):
+    """Raised for an invalid aggregate query"""
+
+
+def _split(value):
+    return sorted({v.strip() for v in value.split(',') if v.strip()}) if value else []
+
+
+def parse_query(args):
+    """Validate request arguments and return a normalised query dict"""
+    source = args.get('source', 'system')
+    if source not in SOURCES:
+        raise QueryError(f"source must be one of {', '.join(SOURCES)}")
+    spec = SOURCES[source]
+
+    metric = args.get('metric', next(iter(spec['metrics'])))
+    if metric not in spec['metrics']:
+        raise QueryError(f"metric for {source} must be one of {', '.join(spec['metrics'])}")
+
+    agg = args.get('agg', 'avg')
+    if agg not in AGGREGATIONS:
+        raise QueryError(f"agg must be one of {', '.join(AGGREGATIONS)}")
+
+    group_by = _split(args.get('group_by', 'agent'))
+    unknown = set(group_by) - set(spec['group_by'])
+    if unknown:
+        raise QueryError(f"group_by for {source} must be drawn from {', '.join(spec['group_by'])}")
+
+    try:
+        hours = float(args.get('hours', 1))
+        step = int(args.get('step', 0)) or None
+        top = int(args.get('top', 0)) or None
+    except ValueError:
+        raise QueryError('hours, step and top must be numbers')
+    if not 0 < hours <= MAX_HOURS:
+        raise QueryError(f'hours must be between 0 and {MAX_HOURS}')
+    if 'time' in group_by and not step:
+        raise QueryError('group_by=time requires step (bucket width in seconds)')
+    if step is not None and step < 1:
+        raise QueryError('step must be a positive number of seconds')
+
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise QueryError('order must be asc or desc')
+
+    return {
+        'source': source,
+        'metric': metric,
+        'agg': agg,
+        'group_by': group_by,
+        'hours': hours,
+        'step': step if 'time' in group_by else None,
+        'agent_id': _split(args.get('agent_id')),
+        'target': _split(args.get('target')) if source == 'network' else [],
+        'top': top,
+        'order': order,
+        'raw': args.get('resolution') == 'raw',
+    }
+
+
+def cache_key(query):
+    """Hashable form of a normalised query"""
+    return tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(query.items()))
+
+
+def _epoch(column):
+    """Seconds since epoch for a naive UTC timestamp column (SQLite)"""
+    dialect = db.engine.dialect.name
+    if dialect != 'sqlite':
+        raise QueryError(f'Time grouping is not supported on {dialect}')
+    return cast(func.strftime('%s', column), Integer)
+
+
+def _bucket(column, step):
+    """Start of the step-second bucket containing column, in epoch seconds"""
+    if db.engine.dialect.name == 'postgresql':
+        return func.floor(func.extract('epoch', column) / step) * step
+    return _epoch(column) // step * step
+
+
+def _rollup_resolution(query):
+    """
+    Coarsest rollup that divides the time buckets and is kept for the whole
+    window, if the rollups can answer the query
+    """
+    if query['raw'] or query['source'] != 'system' or query['agg'] not in ('avg', 'min', 'max', 'count'):
+        return None
+    if not query['step']:
+        return None
+    candidates = [r for r in RESOLUTIONS if query['step'] % r == 0 and
+                  (not Config.RETENTION_ROLLUP_DAYS.get(r) or
+                   Config.RETENTION_ROLLUP_DAYS[r] * 24 >= query['hours'])]
+    return max(candidates) if candidates else None
+
+
+def _dimensions(model):
+    """Columns holding the agent_id and target strings for a model"""
+    # Tables store integer keys into the agents and targets tables
+    return {'agent': Agent.agent_id, 'target': Target.target}
+
+
+def _join_dimensions(statement, query, model):
+    """Join the dimension tables that the query groups or filters on"""
+    statement = statement.select_from(model)
+    if 'agent' in query['group_by'] or query['agent_id']:
+        statement = statement.join(Agent, Agent.id == model.agent_ref)
+    if 'target' in query['group_by'] or query['target']:
+        statement = statement.join(Target, Target.id == model.target_id)
+    return statement
+
+
+def _group_columns(query, model, timestamp):
+    dimensions = _dimensions(model)
+    columns = []
+    for key in query['group_by']:
+        if key == 'agent':
+            columns.append(dimensions['agent'].label('agent_id'))
+        elif key == 'target':
+            columns.append(dimensions['target'].label('target'))
+        elif key == 'time':
+            columns.append(_bucket(timestamp, query['step']).label('bucket'))
+    return columns
+
+
+def _aggregate_expression(agg, value, quantile=None):
+    if agg == 'count':
+        return func.count(value)
+    if quantile is not None:
+        # Nearest-rank, matching rollup.percentile
+        return func.percentile_disc(quantile).within_group(value.asc())
+    return {'avg': func.avg, 'min': func.min, 'max': func.max}[agg](value)
+
+
+def _apply_order(statement, value, query, max_results):
+    if query['top']:
+        ordering = value.desc() if query['order'] == 'desc' else value.asc()
+        return statement.order_by(None).order_by(ordering).limit(query['top'])
+    # One extra row tells the caller the result was truncated
+    return statement.limit(max_results + 1)
+
+
+def _raw_statement(query, start, end, max_results, quantile=None):
+    spec = SOURCES[query['source']]
+    model = spec['model']
+    value_column = spec['metrics'][query['metric']]
+    groups = _group_columns(query, model, model.timestamp)
+
+    value = _aggregate_expression(query['agg'], value_column, quantile).label('value')
+    statement = select(*groups, value, func.count(value_column).label('samples'))\
+        .where(model.timestamp >= start, model.timestamp < end, value_column.isnot(None))
+    statement = _filters(statement, query, model)
+    if groups:
+        statement = statement.group_by(*groups).order_by(*groups)
+    return _apply_order(statement, value, query, max_results)
+
+
+def _rollup_statement(query, start, end, max_results, resolution):
+    metric = query['metric']
+    groups = _group_columns(query, MetricRollup, MetricRollup.bucket_start)
+    count = func.sum(MetricRollup.sample_count)
+
+    if query['agg'] == 'avg':
+        # Weight each bucket's average by its sample count
+        weighted = func.sum(getattr(MetricRollup, f'{metric}_avg') * MetricRollup.sample_count)
+        value = (weighted / count)
+    elif query['agg'] == 'count':
+        value = count
+    else:
+        value = getattr(func, query['agg'])(getattr(MetricRollup, f"{metric}_{query['agg']}"))
+    value = value.label('value')
+
+    statement = select(*groups, value, count.label('samples'))\
+        .where(MetricRollup.resolution == resolution,
+               MetricRollup.bucket_start >= start,
+               MetricRollup.bucket_start < end)
+    statement = _filters(statement, query, MetricRollup)
+    if groups:
+        statement = statement.group_by(*groups).order_by(*groups)
+    return _apply_order(statement, value, query, max_results)
+
+
+def _filters(statement, query, model):
+    statement = _join_dimensions(statement, query, model)
+    dimensions = _dimensions(model)
+    if query['agent_id']:
+        statement = statement.where(dimensions['agent'].in_(query['agent_id']))
+    if query['target']:
+        statement = statement.where(dimensions['target'].in_(query['target']))
+    return statement
+
+
+def _python_percentiles(query, start, end, max_results, quantile):
+    """
+    Percentiles for databases without percentile_cont (SQLite).
+
+    Still a single query: values arrive sorted by group and value, so
+    each group's percentile is read off as the group streams past.
+    """
+    spec = SOURCES[query['source']]
+    model = spec['model']
+    value_column = spec['metrics'][query['metric']]
+    groups = _group_columns(query, model, model.timestamp)
+
+    statement = select(*groups, value_column.label('value'))\
+        .where(model.timestamp >= start, model.timestamp < end, value_column.isnot(None))
+    statement = _filters(statement, query, model).order_by(*groups, value_column)
+
+    width = len(groups)
+    results = []
+    for key, rows in groupby(db.session.execute(statement), key=lambda row: tuple(row[:width])):
+        values = [row[width] for row in rows]
+        row = dict(zip([c.name for c in groups], key))
+        row['value'] = percentile(values, quantile * 100)
+        row['samples'] = len(values)
+        results.append(row)
+
+    if query['top']:
+        results.sort(key=lambda r: r['value'], reverse=query['order'] == 'desc')
+        return results[:query['top']]
+    return results[:max_results + 1]
+
+
+def window_end(query, now):
+    """Window end in epoch seconds, aligned down to the minute or the bucket width"""
+    align = max(60, query['step'] or 0)
+    return math.floor(now.timestamp() / align) * align
+
+
+def run_query(query, now=None, max_results=10000):
+    """
+    Execute a normalised query as one SQL aggregate.
+
+    The window ends at `now` aligned down to the minute (or to the time
+    bucket width), so results are stable within a cache bucket. Time
+    grouped avg/min/max/count queries on system metrics are answered from
+    the coarsest rollup that divides the bucket width and is retained for
+    the whole window. Buckets the rollup job has not covered yet (from the
+    one holding its last processed row onwards) are read from raw rows.
+    """
+    now = now or datetime.now(timezone.utc)
+    end = datetime.fromtimestamp(window_end(query, now), timezone.utc)
+    start = end - timedelta(hours=query['hours'])
+
+    quantile = int(query['agg'][1:]) / 100.0 if query['agg'].startswith('p') else None
+    resolution = _rollup_resolution(query)
+
+    parts = []
+    raw_start = start
+    if resolution:
+        start = raw_start = datetime.fromtimestamp(
+            math.floor(start.timestamp() / resolution) * resolution, timezone.utc)
+        covered = covered_until()
+        if covered is not None:
+            step = query['step']
+            split = min(end, datetime.fromtimestamp(math.floor(covered.timestamp() / step) * step,
+                                                    timezone.utc))
+            if split > start:
+                parts.append((f'rollup:{resolution}', [
+                    dict(row._mapping) for row in
+                    db.session.execute(_rollup_statement(query, start, split, max_results, resolution))
+                ]))
+                raw_start = split
+
+    if raw_start < end:
+        if quantile is not None and db.engine.dialect.name != 'postgresql':
+            rows = _python_percentiles(query, raw_start, end, max_results, quantile)
+        else:
+            rows = [dict(row._mapping) for row in
+                    db.session.execute(_raw_statement(query, raw_start, end, max_results, quantile))]
+        parts.append(('raw', rows))
+
+    answered_from = ','.join(name for name, _ in parts)
+    results = [row for _, rows in parts for row in rows]
+    if len(parts) > 1:
+        # Time buckets of the two parts are disjoint; restore the single-query order
+        if query['top']:
+            results = [r for r in results if r['value'] is not None]
+            results.sort(key=lambda r: r['value'], reverse=query['order'] == 'desc')
+            results = results[:query['top']]
+        else:
+            results.sort(key=lambda r: (r.get('agent_id') or '', r['bucket']))
+
+    truncated = len(results) > max_results
+    results = results[:max_results]
+
+    for row in results:
+        if row.get('bucket') is not None:
+            row['bucket'] = datetime.fromtimestamp(int(row['bucket']), timezone.utc)\
+                .replace(tzinfo=None).isoformat()
+        # PostgreSQL returns Decimal for some aggregates
+        if row['value'] is not None:
+            row['value'] = int(row['value']) if query['agg'] == 'count' else round(float(row['value']), 3)
+        row['samples'] = int(row['samples'] or 0)
+
+    return {
+        'start': start.replace(tzinfo=None).isoformat(),
+        'end': end.replace(tzinfo=None).isoformat(),
+        'answered_from': answered_from,
+        'truncated': truncated,
+        'results': results,
+    }
+
+
+class QueryCache:
+    """
+    Small LRU of query results.
+
+    Keys combine the normalised query with the aligned window end, so an
+    entry is reused only while the window it covers is unchanged.
+    """
+
+    def __init__(self, max_entries=256, max_results=10000):
+        self.max_entries = max_entries
+        self.max_results = max_results
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, query, now=None):
+        """Returns (result, cached)"""
+        now = now or datetime.now(timezone.utc)
+        key = (cache_key(query), window_end(query, now))
+
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result, True
+
+        result = run_query(query, now, self.max_results)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = result
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result, False
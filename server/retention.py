@@ -0,0 +1,260 @@
+"""
+Data retention job
+Removes expired metrics in bounded chunks, or by dropping daily partitions on PostgreSQL
+"""
+import re
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select, delete, text
+from bootstrap import writing
+from config import Config
+from models import (db, SystemMetric, NetworkCheck, MetricRollup, NetworkStat, NetworkOutage,
+                    HostMetric, FilesystemUsage, ProcessSample)
+
+PARTITION_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+# Tables that init.sql creates as daily range partitions on PostgreSQL
+PARTITIONED_TABLES = ('system_metrics', 'network_checks')
+
+
+def retention_policies():
+    """(label, model, time column, extra filters, ttl days) for every retained series"""
+    policies = [
+        ('system_metrics', SystemMetric, SystemMetric.timestamp, (),
+         Config.RETENTION_SYSTEM_METRICS_DAYS),
+        ('network_checks', NetworkCheck, NetworkCheck.timestamp, (),
+         Config.RETENTION_NETWORK_CHECKS_DAYS),
+        ('network_stats', NetworkStat, NetworkStat.bucket_start, (),
+         Config.RETENTION_NETWORK_STATS_DAYS),
+        ('network_outages', NetworkOutage, NetworkOutage.ended_at, (),
+         Config.RETENTION_NETWORK_STATS_DAYS),
+        ('host_metrics', HostMetric, HostMetric.timestamp, (),
+         Config.RETENTION_HOST_METRICS_DAYS),
+        ('filesystem_usage', FilesystemUsage, FilesystemUsage.timestamp, (),
+         Config.RETENTION_HOST_METRICS_DAYS),
+        ('process_samples', ProcessSample, ProcessSample.timestamp, (),
+         Config.RETENTION_HOST_METRICS_DAYS),
+    ]
+    for resolution, days in sorted(Config.RETENTION_ROLLUP_DAYS.items()):
+        policies.append((
+            f'metric_rollups.{resolution}s', MetricRollup, MetricRollup.bucket_start,
+            (MetricRollup.resolution == resolution,), days
+        ))
+    return policies
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def table_bytes(table):
+    """On-disk size of a table and its indexes, or None if it cannot be measured"""
+    if _dialect() == 'postgresql':
+        return db.session.execute(text(
+            "SELECT COALESCE(SUM(pg_total_relation_size(c.oid)), 0) FROM pg_class c "
+            "WHERE c.relname = :t OR c.oid IN ("
+            "  SELECT i.inhrelid FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhparent "
+            "  WHERE p.relname = :t)"
+        ), {'t': table}).scalar()
+    if _dialect() == 'sqlite':
+        try:
+            return db.session.execute(text(
+                "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN ("
+                "SELECT name FROM sqlite_master WHERE tbl_name = :t)"
+            ), {'t': table}).scalar()
+        except Exception:
+            # dbstat is an optional SQLite compile-time feature
+            db.session.rollback()
+    return None
+
+
+def _is_partitioned(table):
+    if _dialect() != 'postgresql':
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :t"
+    ), {'t': table}).first() is not None
+
+
+def _partitions(table):
+    """(name, lower, upper) for every range partition of a table"""
+    rows = db.session.execute(text(
+        "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+        "FROM pg_inherits i "
+        "JOIN pg_class parent ON parent.oid = i.inhparent "
+        "JOIN pg_class child ON child.oid = i.inhrelid "
+        "WHERE parent.relname = :t"
+    ), {'t': table}).all()
+
+    partitions = []
+    for name, bound in rows:
+        match = PARTITION_BOUND.search(bound or '')
+        if match:  # the DEFAULT partition has no range
+            partitions.append((name, datetime.fromisoformat(match.group(1)),
+                               datetime.fromisoformat(match.group(2))))
+    return partitions
+
+
+def _estimated_rows(name):
+    """Planner row estimate of a table (including its partitions) instead of a full count"""
+    return db.session.execute(text(
+        "SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint FROM pg_class c "
+        "WHERE c.relname = :t OR c.oid IN ("
+        "  SELECT i.inhrelid FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhparent "
+        "  WHERE p.relname = :t)"
+    ), {'t': name}).scalar()
+
+
+def ensure_partitions(table, days_ahead=None, since=None):
+    """
+    Create daily partitions for today and the days ahead (from since, if given).
+
+    Rows of a day that had no partition yet sit in the DEFAULT partition,
+    and PostgreSQL refuses to create a range overlapping them; they are
+    moved into the new partition, which is then attached.
+    """
+    if days_ahead is None:
+        days_ahead = Config.RETENTION_PARTITION_DAYS_AHEAD
+    default = f"{table}_default"
+    has_default = db.session.execute(text("SELECT to_regclass(:n)"), {'n': default}).scalar()
+    today = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0,
+                                               second=0, microsecond=0)
+    first = today
+    if since is not None:
+        first = min(today, since.replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0))
+    created = 0
+    for offset in range((today - first).days + days_ahead + 1):
+        start = first + timedelta(days=offset)
+        end = start + timedelta(days=1)
+        name = f"{table}_p{start:%Y%m%d}"
+        if db.session.execute(text("SELECT to_regclass(:n)"), {'n': name}).scalar():
+            continue
+        bounds = f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        day = {'start': start, 'end': end}
+        stranded = has_default and db.session.execute(text(
+            f"SELECT 1 FROM {default} WHERE timestamp >= :start AND timestamp < :end LIMIT 1"
+        ), day).first()
+        if stranded:
+            db.session.execute(text(
+                f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            ))
+            db.session.execute(text(
+                f"WITH moved AS (DELETE FROM {default} "
+                f"WHERE timestamp >= :start AND timestamp < :end RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ), day)
+            db.session.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} {bounds}"))
+        else:
+            db.session.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {bounds}"))
+        db.session.commit()
+        created += 1
+    return created
+
+
+def drop_expired_partitions(table, cutoff):
+    """Drop partitions entirely older than cutoff; returns (partitions, rows, bytes)"""
+    cutoff = cutoff.replace(tzinfo=None)
+    dropped = rows = reclaimed = 0
+    for name, _, upper in _partitions(table):
+        if upper > cutoff:
+            continue
+        rows += _estimated_rows(name)
+        reclaimed += db.session.execute(
+            text("SELECT pg_total_relation_size(:n)"), {'n': name}
+        ).scalar()
+        # Detach first so the parent is only locked briefly
+        db.session.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        db.session.execute(text(f"DROP TABLE {name}"))
+        db.session.commit()
+        dropped += 1
+    return dropped, rows, reclaimed
+
+
+def delete_in_chunks(model, conditions, chunk_size=5000):
+    """
+    Delete the rows matching conditions in short transactions of at most
+    chunk_size rows.
+
+    Each chunk is bounded by the highest id among the next chunk_size
+    matching rows, so the DELETE needs no list of ids (SQLite allows only
+    999 bound parameters per statement).
+    """
+    deleted = 0
+    while True:
+        chunk = select(model.id).where(*conditions)\
+            .order_by(model.id).limit(chunk_size).subquery()
+        last_id = db.session.execute(select(db.func.max(chunk.c.id))).scalar()
+        if last_id is None:
+            break
+        count = db.session.execute(
+            delete(model).where(*conditions, model.id <= last_id)
+        ).rowcount
+        db.session.commit()
+        deleted += count
+        if count < chunk_size:
+            break
+    return deleted
+
+
+def delete_expired(model, time_column, cutoff, extra=(), chunk_size=5000):
+    """Delete rows older than cutoff in chunks of at most chunk_size rows"""
+    return delete_in_chunks(model, (time_column < cutoff,) + tuple(extra), chunk_size)
+
+
+def run_retention(now=None):
+    """
+    Apply every retention policy once.
+
+    Returns a report per series with rows and bytes reclaimed. Bytes are
+    measured for dropped partitions and on SQLite builds with dbstat;
+    on PostgreSQL they are estimated from the table's average row size
+    using the planner's row estimate. Rows of dropped partitions are
+    planner estimates as well.
+    """
+    now = now or datetime.now(timezone.utc)
+    report = {}
+
+    for label, model, time_column, extra, days in retention_policies():
+        if not days:
+            continue  # 0 keeps data forever
+
+        table = model.__tablename__
+        cutoff = now - timedelta(days=days)
+        entry = {'cutoff': cutoff.isoformat(), 'rows': 0, 'bytes': 0, 'partitions_dropped': 0}
+
+        if table in PARTITIONED_TABLES and _is_partitioned(table):
+            ensure_partitions(table)
+            dropped, rows, reclaimed = drop_expired_partitions(table, cutoff)
+            entry.update(partitions_dropped=dropped, rows=rows, bytes=reclaimed)
+
+        size_before = table_bytes(table)
+        row_count = _estimated_rows(table) if _dialect() == 'postgresql' else None
+
+        # Leftovers: the partition containing the cutoff, the DEFAULT partition,
+        # or the whole table when it is not partitioned
+        deleted = delete_expired(model, time_column, cutoff, extra, Config.RETENTION_CHUNK_SIZE)
+        entry['rows'] += deleted
+
+        if deleted and size_before is not None:
+            size_after = table_bytes(table)
+            if _dialect() == 'sqlite' and size_after < size_before:
+                entry['bytes'] += size_before - size_after
+            elif row_count:
+                # PostgreSQL only frees space after VACUUM; estimate instead
+                entry['bytes'] += int(size_before / row_count * deleted)
+                entry['bytes_estimated'] = True
+
+        report[label] = entry
+
+    return report
+
+
+if __name__ == '__main__':
+    # One-shot run, e.g. from cron when background jobs are disabled
+    import json
+    import os
+    os.environ['BACKGROUND_JOBS'] = 'false'
+    from bootstrap import create_app
+
+    with create_app().app_context():
+        print(json.dumps(run_retention(), indent=2))
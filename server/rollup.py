@@ -0,0 +1,340 @@
+"""
+Metric rollup job
+Maintains 1-minute, 5-minute and 1-hour aggregates of system metrics
+"""
+import calendar
+import math
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select, delete, insert, func
+from bootstrap import writing
+from config import Config
+from models import db, SystemMetric, MetricRollup, JobState, agent_ref
+
+# Bucket widths in seconds, finest first. Each divides the next so an
+# hour of raw rows is enough to rebuild every bucket inside it.
+RESOLUTIONS = (60, 300, 3600)
+
+METRICS = ('cpu', 'memory', 'disk')
+
+STATE_KEY = 'rollup.last_metric_id'
+# Newest raw row id seen by a run, rolled up once it has settled
+PENDING_KEY = 'rollup.pending_metric_id'
+
+
+def to_epoch(ts):
+    """Seconds since epoch for a stored timestamp (naive values are UTC)"""
+    return calendar.timegm(ts.utctimetuple())
+
+
+def bucket_start(ts, resolution):
+    """Start of the bucket containing ts"""
+    epoch = to_epoch(ts)
+    return datetime.fromtimestamp(epoch - epoch % resolution, timezone.utc)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def choose_resolution(window_seconds, max_points, step=None):
+    """
+    Pick the rollup resolution for a history query.
+
+    With an explicit step, use the coarsest resolution not wider than it.
+    Otherwise use the coarsest resolution that still yields at least
+    max_points buckets. Returns None when raw rows should be used.
+    """
+    if step:
+        candidates = [r for r in RESOLUTIONS if r <= step]
+    else:
+        candidates = [r for r in RESOLUTIONS if window_seconds / r >= max_points]
+    return max(candidates) if candidates else None
+
+
+def _aggregate(rows, resolution):
+    """
+    Build rollup rows for one agent from (timestamp, cpu, memory, disk)
+    tuples, optionally followed by the cpu/memory min, max and avg of a
+    high-resolution summary.
+
+    A summarized sample contributes its average to avg/p95 and widens
+    min/max to the extremes seen between samples.
+    """
+    buckets = defaultdict(lambda: ([], [], [], [[], [], []], [[], [], []]))
+    for row in rows:
+        timestamp, points = row[0], row[1:4]
+        # (min, max, avg) per metric; disk is never summarized
+        summary = row[4:] or (None,) * 6
+        summaries = (summary[0:3], summary[3:6], (None, None, None))
+        *values, lows, highs = buckets[bucket_start(timestamp, resolution)]
+        for series, low, high, value, (minimum, maximum, average) in zip(
+                values, lows, highs, points, summaries):
+            value = average if average is not None else value
+            if value is not None:
+                series.append(value)
+            if minimum is not None:
+                low.append(minimum)
+            if maximum is not None:
+                high.append(maximum)
+
+    result = []
+    for start, (*series_list, lows, highs) in buckets.items():
+        row = {'resolution': resolution, 'bucket_start': start,
+               'sample_count': max(len(s) for s in series_list)}
+        for name, series, low, high in zip(METRICS, series_list, lows, highs):
+            series.sort()
+            row[f'{name}_min'] = min(series[:1] + low) if series or low else None
+            row[f'{name}_max'] = max(series[-1:] + high) if series or high else None
+            row[f'{name}_avg'] = sum(series) / len(series) if series else None
+            row[f'{name}_p95'] = percentile(series, 95) if series else None
+        result.append(row)
+    return result
+
+
+def _merge(old, new):
+    """Fold the aggregate of newly rolled-up rows into an existing bucket row"""
+    before, added = old.sample_count, new['sample_count']
+    old.sample_count = before + added
+    for name in METRICS:
+        low, high, average = new[f'{name}_min'], new[f'{name}_max'], new[f'{name}_avg']
+        if low is not None:
+            current = getattr(old, f'{name}_min')
+            setattr(old, f'{name}_min', low if current is None else min(current, low))
+        if high is not None:
+            current = getattr(old, f'{name}_max')
+            setattr(old, f'{name}_max', high if current is None else max(current, high))
+        if average is not None:
+            current = getattr(old, f'{name}_avg')
+            setattr(old, f'{name}_avg', average if current is None else
+                    (current * before + average * added) / (before + added))
+
+
+def _raw_p95(agent, buckets):
+    """Recompute the p95 columns of sub-hour buckets from their raw rows"""
+    first = min(bucket.bucket_start for bucket in buckets)
+    last = max(bucket.bucket_start + timedelta(seconds=bucket.resolution) for bucket in buckets)
+    rows = db.session.execute(
+        select(SystemMetric.timestamp, SystemMetric.cpu_percent,
+               SystemMetric.memory_percent, SystemMetric.disk_percent,
+               SystemMetric.cpu_min, SystemMetric.cpu_max, SystemMetric.cpu_avg,
+               SystemMetric.memory_min, SystemMetric.memory_max, SystemMetric.memory_avg)
+        .where(SystemMetric.agent_ref == agent,
+               SystemMetric.timestamp >= first,
+               SystemMetric.timestamp < last)
+    ).all()
+    for bucket in buckets:
+        start = bucket.bucket_start.replace(tzinfo=timezone.utc)
+        inside = [r for r in rows if bucket_start(r[0], bucket.resolution) == start]
+        for row in _aggregate(inside, bucket.resolution):
+            for name in METRICS:
+                setattr(bucket, f'{name}_p95', row[f'{name}_p95'])
+
+
+def _hour_p95(agent, buckets):
+    """
+    Estimate the p95 columns of hour buckets from their five-minute buckets:
+    the nearest-rank p95 of the five-minute p95s weighted by sample count,
+    so an hour is not re-read every time a sample is added to it
+    """
+    first = min(bucket.bucket_start for bucket in buckets)
+    last = max(bucket.bucket_start for bucket in buckets) + timedelta(hours=1)
+    parts = MetricRollup.query.filter(
+        MetricRollup.agent_ref == agent,
+        MetricRollup.resolution == 300,
+        MetricRollup.bucket_start >= first,
+        MetricRollup.bucket_start < last
+    ).all()
+    for bucket in buckets:
+        inside = [part for part in parts if bucket_start(part.bucket_start, 3600) ==
+                  bucket.bucket_start.replace(tzinfo=timezone.utc)]
+        for name in METRICS:
+            weighted = sorted((getattr(part, f'{name}_p95'), part.sample_count) for part in inside
+                              if getattr(part, f'{name}_p95') is not None)
+            if not weighted:
+                continue
+            rank, seen = math.ceil(0.95 * sum(count for _, count in weighted)), 0
+            for value, count in weighted:
+                seen += count
+                if seen >= rank:
+                    setattr(bucket, f'{name}_p95', value)
+                    break
+
+
+def _update_agent(agent, rows):
+    """
+    Add newly inserted raw rows of one agent (its agents.id) to the rollup
+    buckets they fall into. New buckets are inserted; existing ones get min,
+    max, average and count merged in place and their p95 refreshed. Returns
+    rollup rows written.
+    """
+    written = 0
+    for resolution in RESOLUTIONS:
+        partial = {row['bucket_start']: row for row in _aggregate(rows, resolution)}
+        starts = sorted(partial)
+        existing = MetricRollup.query.filter(
+            MetricRollup.agent_ref == agent,
+            MetricRollup.resolution == resolution,
+            MetricRollup.bucket_start >= starts[0],
+            MetricRollup.bucket_start <= starts[-1]
+        ).all()
+        merged = []
+        for bucket in existing:
+            row = partial.pop(bucket.bucket_start.replace(tzinfo=timezone.utc), None)
+            if row is not None:
+                _merge(bucket, row)
+                merged.append(bucket)
+        if merged:
+            (_hour_p95 if resolution == 3600 else _raw_p95)(agent, merged)
+        if partial:
+            db.session.execute(insert(MetricRollup), [dict(row, agent_ref=agent) for row in partial.values()])
+        # The hour p95 reads the five-minute buckets written above
+        db.session.flush()
+        written += len(merged) + len(partial)
+    return written
+
+
+def _settled_id(settle_seconds):
+    """
+    Highest raw row id that is safe to roll up.
+
+    Ids are handed out when rows are inserted, but on PostgreSQL concurrent
+    transactions commit in any order, so a row can become visible after rows
+    with higher ids have been rolled up. The newest id is therefore noted
+    and only rolled up once it is settle_seconds old, by which time every
+    transaction holding a lower id has committed or rolled back.
+    """
+    newest = db.session.execute(select(func.max(SystemMetric.id))).scalar() or 0
+    if not settle_seconds:
+        return newest
+
+    now = datetime.now(timezone.utc)
+    pending = db.session.get(JobState, PENDING_KEY)
+    if pending is None:
+        db.session.add(JobState(name=PENDING_KEY, value=newest, updated_at=now))
+        return None
+    noted_at = pending.updated_at.replace(tzinfo=pending.updated_at.tzinfo or timezone.utc)
+    if now - noted_at < timedelta(seconds=settle_seconds):
+        return None
+    settled = pending.value
+    pending.value, pending.updated_at = newest, now
+    return settled
+
+
+@writing()
+def run_rollup(chunk_size=50000, max_chunks=10, settle_seconds=None):
+    """
+    Roll up raw rows inserted since the previous run.
+
+    Progress is tracked by row id rather than timestamp so that late
+    samples (for example an agent replaying its spool after an outage)
+    still update the buckets they fall into. Each row is added to its
+    buckets exactly once, up to the id that has settled (ROLLUP_SETTLE_SECONDS;
+    SQLite commits in id order and needs no margin). Returns the number of
+    rollup rows written.
+    """
+    if settle_seconds is None:
+        settle_seconds = 0 if db.engine.dialect.name == 'sqlite' else Config.ROLLUP_SETTLE_SECONDS
+    state = db.session.get(JobState, STATE_KEY)
+    if state is None:
+        state = JobState(name=STATE_KEY, value=0)
+        db.session.add(state)
+
+    settled = _settled_id(settle_seconds)
+    written = 0
+    for _ in range(max_chunks if settled is not None else 0):
+        new_rows = db.session.execute(
+            select(SystemMetric.id, SystemMetric.agent_ref, SystemMetric.timestamp,
+                   SystemMetric.cpu_percent, SystemMetric.memory_percent, SystemMetric.disk_percent,
+                   SystemMetric.cpu_min, SystemMetric.cpu_max, SystemMetric.cpu_avg,
+                   SystemMetric.memory_min, SystemMetric.memory_max, SystemMetric.memory_avg)
+            .where(SystemMetric.id > state.value, SystemMetric.id <= settled)
+            .order_by(SystemMetric.id)
+            .limit(chunk_size)
+        ).all()
+        if not new_rows:
+            break
+
+        by_agent = defaultdict(list)
+        for row in new_rows:
+            by_agent[row[1]].append(row[2:])
+        for agent, rows in by_agent.items():
+            written += _update_agent(agent, rows)
+
+        state.value = new_rows[-1][0]
+        state.updated_at = datetime.now(timezone.utc)
+        db.session.commit()
+
+        if len(new_rows) < chunk_size:
+            break
+
+    db.session.commit()
+    return written
+
+
+def covered_until():
+    """
+    Timestamp of the last raw row the rollup job has processed, or None
+    before its first run. Rollup buckets before it are complete, except for
+    late rows written since and rows newer than the settle margin (they are
+    picked up by a later run).
+    """
+    timestamp = db.session.execute(
+        select(SystemMetric.timestamp)
+        .join(JobState, JobState.value == SystemMetric.id)
+        .where(JobState.name == STATE_KEY)
+    ).scalar()
+    return timestamp.replace(tzinfo=timezone.utc) if timestamp is not None else None
+
+
+def query_rollups(agent_id, resolution, start_time):
+    """Rollup rows for an agent at a resolution since start_time"""
+    return MetricRollup.query.filter(
+        MetricRollup.agent_ref == agent_ref(agent_id),
+        MetricRollup.resolution == resolution,
+        MetricRollup.bucket_start >= bucket_start(start_time, resolution)
+    ).order_by(MetricRollup.bucket_start.asc()).all()
+
+
+def history_columns(agent_id, resolution, start_time, peaks=False):
+    """
+    (timestamp, cpu, memory, disk) tuples for an agent since start_time.
+
+    Reads rollup averages when a resolution is given, otherwise raw
+    samples, in a single column-projected query without building ORM
+    objects. With peaks, each tuple also carries the cpu and memory
+    maximum (a sample's high-resolution max, or its point value).
+    """
+    if resolution:
+        columns = [MetricRollup.bucket_start, MetricRollup.cpu_avg,
+                   MetricRollup.memory_avg, MetricRollup.disk_avg]
+        if peaks:
+            columns += [MetricRollup.cpu_max, MetricRollup.memory_max]
+        query = select(*columns)\
+            .where(MetricRollup.agent_ref == agent_ref(agent_id),
+                   MetricRollup.resolution == resolution,
+                   MetricRollup.bucket_start >= bucket_start(start_time, resolution))\
+            .order_by(MetricRollup.bucket_start.asc())
+    else:
+        columns = [SystemMetric.timestamp, SystemMetric.cpu_percent,
+                   SystemMetric.memory_percent, SystemMetric.disk_percent]
+        if peaks:
+            columns += [func.coalesce(SystemMetric.cpu_max, SystemMetric.cpu_percent),
+                        func.coalesce(SystemMetric.memory_max, SystemMetric.memory_percent)]
+        query = select(*columns)\
+            .where(SystemMetric.agent_ref == agent_ref(agent_id),
+                   SystemMetric.timestamp >= start_time)\
+            .order_by(SystemMetric.timestamp.asc())
+    return db.session.execute(query).all()
+
+
+if __name__ == '__main__':
+    # One-shot run, e.g. from cron when background jobs are disabled
+    import os
+    os.environ['BACKGROUND_JOBS'] = 'false'
+    from bootstrap import create_app
+
+    with create_app().app_context():
+        print(f"Rollup rows written: {run_rollup()}")
@@ -0,0 +1,426 @@
+"""
+Shard router
+Sends each agent's ingest and reads to the shard that owns it and fans
+fleet-wide reads out to every shard, merging the results
+"""
+import argparse
+import hashlib
+import json
+import logging
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify
+import requests
+from columnar import BINARY_MIMETYPE, HEADER
+from config import Config
+from export import control_line
+from ingest import SampleError, decode_body
+from sharding import HashRing, merge_query_results, moved_agents
+from wire import decode_payload
+
+logger = logging.getLogger(__name__)
+
+# Request headers passed on to shards
+FORWARD_HEADERS = ('Content-Type', 'Content-Encoding', 'Accept', 'If-None-Match', 'Authorization')
+# Response headers passed back to clients
+RETURN_HEADERS = ('Content-Type', 'Retry-After', 'X-Resolution', 'ETag', 'Cache-Control',
+                  'Content-Disposition')
+# Window of a handoff export: everything a shard holds
+HANDOFF_START = '1970-01-01T00:00:00+00:00'
+HANDOFF_END = '9999-01-01T00:00:00+00:00'
+# List fields of per-agent reads; a shard that never saw the agent answers them empty
+AGENT_DATA_FIELDS = ('metrics', 'timestamps', 'targets', 'outages', 'filesystems', 'processes',
+                     'alerts')
+
+app = Flask(__name__)
+app.config.from_object(Config)
+
+ring = HashRing(Config.SHARD_URLS or ['http://127.0.0.1:5000'], Config.SHARD_VNODES)
+session = requests.Session()
+adapter = requests.adapters.HTTPAdapter(pool_connections=len(ring.shards),
+                                        pool_maxsize=Config.SHARD_POOL_SIZE)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+fanout = ThreadPoolExecutor(max_workers=max(4, 2 * len(ring.shards)), thread_name_prefix='fanout')
+
+
+class ShardError(Exception):
+    """A shard could not be reached"""
+
+
+def _call(shard, method, path, **kwargs):
+    try:
+        return session.request(method, shard + path, timeout=Config.SHARD_TIMEOUT, **kwargs)
+    except requests.exceptions.RequestException as e:
+        raise ShardError(f'{shard}: {e}')
+
+
+def _forward(shard):
+    """Pass the current request to a shard unchanged"""
+    headers = {k: request.headers[k] for k in FORWARD_HEADERS if k in request.headers}
+    return _call(shard, request.method, request.path, params=request.args,
+                 data=request.get_data(), headers=headers)
+
+
+def _relay(response):
+    """Shard response as the router's response"""
+    headers = {k: response.headers[k] for k in RETURN_HEADERS if k in response.headers}
+    return Response(response.content, status=response.status_code, headers=headers)
+
+
+def _everywhere(method, path, **kwargs):
+    """(shard, response or ShardError) from every shard, in ring order"""
+    futures = [(shard, fanout.submit(_call, shard, method, path, **kwargs)) for shard in ring.shards]
+    results = []
+    for shard, future in futures:
+        try:
+            results.append((shard, future.result()))
+        except ShardError as e:
+            results.append((shard, e))
+    return results
+
+
+def _gather(path, params=None):
+    """JSON bodies of every shard; raises ShardError unless all answered 200"""
+    bodies = []
+    for shard, response in _everywhere('GET', path, params=params):
+        if isinstance(response, ShardError):
+            raise response
+        if response.status_code != 200:
+            raise ShardError(f'{shard} answered {response.status_code}: {response.text[:200]}')
+        bodies.append(response.json())
+    return bodies
+
+
+def _unavailable(e):
+    logger.warning(f"Shard unavailable: {e}")
+    return jsonify({'status': 'error', 'message': f'Shard unavailable: {e}'}), 503
+
+
+def _agent_id(payload):
+    return payload.get('agent_id') if isinstance(payload, dict) else None
+
+
+def _missing(response):
+    """True if a shard has nothing for the agent: a 404, or a 200 with only empty data"""
+    if response.status_code == 404:
+        return True
+    if response.status_code != 200:
+        return False
+    if response.headers.get('Content-Type', '').startswith(BINARY_MIMETYPE):
+        return len(response.content) < HEADER.size or HEADER.unpack_from(response.content)[0] == 0
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    if not isinstance(body, dict):
+        return False
+    data = [body[field] for field in AGENT_DATA_FIELDS if field in body]
+    return bool(data) and not any(data)
+
+
+@app.route('/api/v1/metrics', methods=['POST'])
+@app.route('/api/v1/agents/register', methods=['POST'])
+def route_by_body():
+    """Single samples and compact registrations go to the agent's shard"""
+    try:
+        payload = decode_payload(request.get_data(), request.mimetype)
+        return _relay(_forward(ring.shard_for(str(_agent_id(payload)))))
+    except SampleError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except ShardError as e:
+        return _unavailable(e)
+
+
+@app.route('/api/v1/metrics/compact', methods=['POST'])
+def route_compact():
+    """Compact batches hold one agent's samples; the body is passed on as sent"""
+    try:
+        raw = decode_body(request.get_data(), request.headers.get('Content-Encoding'),
+                          Config.MAX_BATCH_BYTES)
+        payload = decode_payload(raw, request.mimetype)
+        return _relay(_forward(ring.shard_for(str(_agent_id(payload)))))
+    except SampleError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except (OSError, zlib.error) as e:
+        return jsonify({'status': 'error', 'message': f'Invalid request body: {e}'}), 400
+    except ShardError as e:
+        return _unavailable(e)
+
+
+@app.route('/api/v1/metrics/batch', methods=['POST'])
+def route_batch():
+    """
+    Split a batch by owning shard and merge the per-sample results.
+
+    A batch owned by a single shard (the usual case: one agent's spool) is
+    passed through untouched. Samples whose shard failed are reported with
+    status "retry" so the agent keeps them spooled.
+    """
+    try:
+        raw = decode_body(request.get_data(), request.headers.get('Content-Encoding'),
+                          Config.MAX_BATCH_BYTES)
+        payload = json.loads(raw)
+    except SampleError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except (ValueError, OSError, zlib.error) as e:
+        return jsonify({'status': 'error', 'message': f'Invalid request body: {e}'}), 400
+    samples = payload.get('samples') if isinstance(payload, dict) else payload
+    if not isinstance(samples, list):
+        return jsonify({'status': 'error', 'message': 'Expected a list of samples'}), 400
+
+    groups = ring.partition(samples, lambda sample: str(_agent_id(sample)))
+    try:
+        if len(groups) <= 1:
+            return _relay(_forward(next(iter(groups), ring.shards[0])))
+    except ShardError as e:
+        return _unavailable(e)
+
+    futures = {
+        shard: fanout.submit(_call, shard, 'POST', request.path,
+                             json={'samples': [sample for _, sample in entries]})
+        for shard, entries in groups.items()
+    }
+    results = [None] * len(samples)
+    failed, failure = 0, None
+    for shard, future in futures.items():
+        positions = [position for position, _ in groups[shard]]
+        try:
+            response = future.result()
+        except ShardError as e:
+            error = str(e)
+        else:
+            if response.status_code in (200, 202):
+                for result in response.json().get('results', []):
+                    position = positions[result['index']]
+                    results[position] = dict(result, index=position)
+                continue
+            failure = response
+            error = f'{shard} answered {response.status_code}'
+        failed += 1
+        logger.warning(f"Batch part for {shard} failed: {error}")
+        for position in positions:
+            results[position] = {'index': position, 'status': 'retry', 'error': error}
+
+    if failed == len(groups):
+        # Nothing was written; answer as a single server would so the agent backs off
+        return _relay(failure) if failure is not None else _unavailable('no shard answered')
+
+    accepted = sum(1 for r in results if r['status'] in ('accepted', 'queued'))
+    return jsonify({
+        'status': 'success' if accepted == len(samples) else 'partial',
+        'accepted': accepted,
+        'rejected': len(samples) - accepted,
+        'results': results
+    }), 200
+
+
+@app.route('/api/v1/metrics/<agent_id>', methods=['GET'])
+@app.route('/api/v1/metrics/<agent_id>/latest', methods=['GET'])
+@app.route('/api/v1/network/<agent_id>', methods=['GET'])
+@app.route('/api/v1/network/<agent_id>/outages', methods=['GET'])
+@app.route('/api/v1/host/<agent_id>', methods=['GET'])
+def route_agent_read(agent_id):
+    """Per-agent reads go to the owning shard, then to the others if it has nothing (404 or empty)"""
+    owner = ring.shard_for(agent_id)
+    try:
+        response = _forward(owner)
+    except ShardError as e:
+        return _unavailable(e)
+    if _missing(response):
+        # The agent may have reported to another shard before a rebalance
+        for shard in ring.shards:
+            if shard != owner:
+                try:
+                    other = _forward(shard)
+                except ShardError:
+                    continue
+                if not _missing(other):
+                    return _relay(other)
+    return _relay(response)
+
+
+@app.route('/api/v1/export', methods=['GET'])
+def route_export():
+    """An agent's export streams from its shard as the shard writes it"""
+    agent_ids = [a for a in request.args.get('agent_id', '').split(',') if a.strip()]
+    if len(agent_ids) != 1:
+        return jsonify({
+            'status': 'error',
+            'message': 'Through the router, export one agent_id at a time or export from each shard'
+        }), 400
+    try:
+        response = _call(ring.shard_for(agent_ids[0].strip()), 'GET', request.path,
+                         params=request.args, stream=True)
+    except ShardError as e:
+        return _unavailable(e)
+    headers = {k: response.headers[k] for k in RETURN_HEADERS if k in response.headers}
+    return Response(response.iter_content(64 * 1024), status=response.status_code, headers=headers)
+
+
+@app.route('/api/v1/agents', methods=['GET'])
+def list_agents():
+    """Agents of every shard"""
+    try:
+        bodies = _gather(request.path, request.args)
+    except ShardError as e:
+        return _unavailable(e)
+    agents = [agent for body in bodies for agent in body['agents']]
+    return jsonify({'agents': sorted(agents, key=lambda agent: agent['agent_id'])})
+
+
+@app.route('/api/v1/overview', methods=['GET'])
+def overview():
+    """Every shard's overview in one response"""
+    try:
+        bodies = _gather(request.path)
+    except ShardError as e:
+        return _unavailable(e)
+    agents = sorted((agent for body in bodies for agent in body['agents']),
+                    key=lambda agent: agent['agent_id'])
+    body = json.dumps({'agents': agents}, separators=(',', ':'))
+    etag = hashlib.sha1(body.encode()).hexdigest()[:20]
+    response = Response(status=304) if etag in request.if_none_match \
+        else Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/api/v1/alerts', methods=['GET'])
+def list_alerts():
+    """Alerts of the agent's shard, or the newest across all shards"""
+    if request.args.get('agent_id'):
+        return route_agent_read(request.args['agent_id'])
+    try:
+        bodies = _gather(request.path, request.args)
+    except ShardError as e:
+        return _unavailable(e)
+    limit = min(int(request.args.get('limit', 100)), 1000)
+    alerts = sorted((alert for body in bodies for alert in body['alerts']),
+                    key=lambda alert: alert['triggered_at'] or '', reverse=True)
+    return jsonify({'alerts': alerts[:limit]})
+
+
+@app.route('/api/v1/query', methods=['GET'])
+def aggregate_query():
+    """Fleet-wide aggregates computed on every shard and merged"""
+    params = request.args.to_dict()
+    group_by = {g.strip() for g in params.get('group_by', 'agent').split(',')}
+    if 'agent' not in group_by:
+        # Overlapping groups are only ranked after they are combined
+        params.pop('top', None)
+    bodies = []
+    for shard, response in _everywhere('GET', request.path, params=params):
+        if isinstance(response, ShardError):
+            return _unavailable(response)
+        if response.status_code != 200:
+            # Invalid queries are rejected identically by every shard
+            return _relay(response)
+        bodies.append(response.json())
+
+    query = dict(bodies[0]['query'], top=int(request.args.get('top', 0)) or None)
+    return jsonify(dict(merge_query_results(query, bodies), query=query,
+                        shards=len(ring.shards)))
+
+
+@app.route('/internal/shards', methods=['GET'])
+def shards():
+    """Shard list and whether each one answers"""
+    status = {}
+    for shard, response in _everywhere('GET', '/api/v1/agents', params={'status': 'offline'}):
+        status[shard] = 'down' if isinstance(response, ShardError) else response.status_code
+    return jsonify({'vnodes': ring.vnodes, 'shards': status})
+
+
+def _handoff_headers():
+    return {'Authorization': f'Bearer {Config.SHARD_TOKEN}'} if Config.SHARD_TOKEN else {}
+
+
+def _post_rows(shard, agent, source, rows):
+    response = _call(shard, 'POST', f"/internal/agents/{agent['agent_id']}/import",
+                     headers=_handoff_headers(),
+                     json={'agent_name': agent.get('agent_name'), 'source': source, 'rows': rows})
+    if response.status_code != 200:
+        raise ShardError(f'{shard} import answered {response.status_code}: {response.text[:200]}')
+    return response.json()['imported']
+
+
+def hand_off(agent, old, new, batch_rows=2000):
+    """
+    Copy an agent's system and network rows from the shard it left to its
+    new owner, then drop it from the old shard. Returns the rows copied.
+    Imports skip rows already present, so a failed handoff can be rerun.
+    """
+    copied = 0
+    for source in ('system', 'network'):
+        response = _call(old, 'GET', '/api/v1/export', stream=True, params={
+            'agent_id': agent['agent_id'], 'source': source, 'format': 'ndjson',
+            'start': HANDOFF_START, 'end': HANDOFF_END})
+        if response.status_code != 200:
+            raise ShardError(f'{old} export answered {response.status_code}: {response.text[:200]}')
+        batch, complete = [], False
+        for line in response.iter_lines():
+            if not line:
+                continue
+            if control_line(line) is not None:
+                complete = True
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= batch_rows:
+                copied += _post_rows(new, agent, source, batch)
+                batch = []
+        if batch:
+            copied += _post_rows(new, agent, source, batch)
+        if not complete:
+            # Cut off before the closing cursor line: keep the old copy
+            raise ShardError(f'{old} export of {agent["agent_id"]} ended early')
+
+    response = _call(old, 'DELETE', f"/internal/agents/{agent['agent_id']}", headers=_handoff_headers())
+    if response.status_code != 200:
+        raise ShardError(f'{old} delete answered {response.status_code}: {response.text[:200]}')
+    return copied
+
+
+def drain():
+    """Hand every agent stored on a shard that no longer owns it over to its owner"""
+    moved, failed = 0, 0
+    for shard, response in _everywhere('GET', '/api/v1/agents'):
+        if isinstance(response, ShardError):
+            raise response
+        for agent in response.json()['agents']:
+            owner = ring.shard_for(agent['agent_id'])
+            if owner == shard:
+                continue
+            try:
+                rows = hand_off(agent, shard, owner)
+            except ShardError as e:
+                failed += 1
+                print(f"{agent['agent_id']}: {shard} -> {owner} failed: {e}")
+                continue
+            moved += 1
+            print(f"{agent['agent_id']}: {shard} -> {owner} ({rows} rows copied)")
+    print(f"{moved} agents handed over, {failed} failed")
+    return failed == 0
+
+
+if __name__ == '__main__':
+    # python router.py                      serve on ROUTER_PORT
+    # python router.py plan URL [URL ...]   agents that would move to the new shard list
+    # python router.py drain                move agents' rows to their owner under SHARD_URLS
+    parser = argparse.ArgumentParser(description='Shard router')
+    parser.add_argument('command', nargs='?', default='serve', choices=('serve', 'plan', 'drain'))
+    parser.add_argument('shards', nargs='*', help='new shard URLs for plan')
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        agent_ids = [agent['agent_id'] for body in _gather('/api/v1/agents') for agent in body['agents']]
+        moves = moved_agents(ring, HashRing(args.shards, Config.SHARD_VNODES), agent_ids)
+        for agent_id, (old, new) in sorted(moves.items()):
+            print(f"{agent_id}: {old} -> {new}")
+        print(f"{len(moves)} of {len(agent_ids)} agents move")
+    elif args.command == 'drain':
+        sys.exit(0 if drain() else 1)
+    else:
+        app.run(host=Config.HOST, port=Config.ROUTER_PORT, threaded=True)
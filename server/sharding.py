@@ -0,0 +1,106 @@
+"""
+Ingest sharding
+Consistent-hash placement of agents on shards and merging of fan-out results
+"""
+import bisect
+import hashlib
+from collections import OrderedDict
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring of shard URLs.
+
+    Each shard owns `vnodes` points on the ring and an agent belongs to the
+    first point at or after the hash of its agent_id. Adding a shard takes
+    over only the agents that now land on its points (about 1/N of them);
+    every other agent keeps its shard.
+    """
+
+    def __init__(self, shards, vnodes=160):
+        if not shards:
+            raise ValueError('At least one shard is required')
+        self.shards = list(shards)
+        self.vnodes = vnodes
+        points = sorted((_hash(f'{shard}#{i}'), shard) for shard in self.shards for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard_for(self, agent_id):
+        index = bisect.bisect(self._hashes, _hash(agent_id)) % len(self._hashes)
+        return self._owners[index]
+
+    def partition(self, items, key):
+        """Items grouped by owning shard as {shard: [(position, item), ...]}"""
+        groups = OrderedDict()
+        for position, item in enumerate(items):
+            groups.setdefault(self.shard_for(key(item)), []).append((position, item))
+        return groups
+
+
+def moved_agents(old_ring, new_ring, agent_ids):
+    """{agent_id: (old shard, new shard)} for agents whose owner changes"""
+    moves = {}
+    for agent_id in agent_ids:
+        old, new = old_ring.shard_for(agent_id), new_ring.shard_for(agent_id)
+        if old != new:
+            moves[agent_id] = (old, new)
+    return moves
+
+
+def merge_query_results(query, responses):
+    """
+    Combine /api/v1/query responses from every shard.
+
+    Groups that include the agent are disjoint across shards and are just
+    concatenated. Other groups (time buckets, targets) are combined: counts
+    add up, min/max take the extreme and averages are weighted by samples.
+    Percentiles cannot be combined exactly; they are weighted like averages
+    and the result is flagged approximate.
+    """
+    agg = query['agg']
+    merged = OrderedDict()
+    for response in responses:
+        for row in response['results']:
+            key = (row.get('agent_id'), row.get('target'), row.get('bucket'))
+            current = merged.get(key)
+            if current is None:
+                merged[key] = dict(row)
+                continue
+            value, samples = row['value'], row['samples']
+            if value is not None and current['value'] is not None:
+                if agg == 'count':
+                    value = current['value'] + value
+                elif agg == 'min':
+                    value = min(current['value'], value)
+                elif agg == 'max':
+                    value = max(current['value'], value)
+                elif current['samples'] + samples:
+                    value = round((current['value'] * current['samples'] + value * samples) /
+                                  (current['samples'] + samples), 3)
+            elif value is None:
+                value = current['value']
+            current['value'] = value
+            current['samples'] += samples
+
+    results = list(merged.values())
+    if query['top']:
+        present = [r for r in results if r['value'] is not None]
+        present.sort(key=lambda r: r['value'], reverse=query['order'] == 'desc')
+        results = present[:query['top']]
+    else:
+        results.sort(key=lambda r: tuple(r.get(k) or '' for k in ('agent_id', 'target', 'bucket')))
+
+    combined = 'agent' not in query['group_by'] and len(responses) > 1
+    return {
+        'start': min(r['start'] for r in responses),
+        'end': max(r['end'] for r in responses),
+        'answered_from': ','.join(sorted({r['answered_from'] for r in responses})),
+        'truncated': any(r['truncated'] for r in responses),
+        'approximate': combined and agg.startswith('p'),
+        'results': results,
+    }
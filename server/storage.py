@@ -0,0 +1,179 @@
+"""
+Metric storage backends
+Where ingested system metrics are written and history/latest reads come from
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+from sqlalchemy import select
+from chunkstore import COLUMNS, ChunkStore
+from columnar import epoch_ms
+from ingest import RetryLater, write_samples
+from models import db, Agent, SystemMetric, agent_ref
+from rollup import history_columns, query_rollups
+
+
+class SQLStorage:
+    """Row-per-sample tables through SQLAlchemy (the default)"""
+    name = 'sql'
+
+    def write(self, samples):
+        """Write parsed samples; returns None or an error message per sample"""
+        return write_samples(samples)
+
+    def history(self, agent_id, resolution, start_time, peaks=False):
+        """
+        ((timestamp, cpu, memory, disk) rows, resolution used or None for raw);
+        with peaks, rows also end with the cpu and memory maximum
+        """
+        rows = history_columns(agent_id, resolution, start_time, peaks) if resolution else []
+        if not rows:
+            # No suitable rollup yet; fall back to raw samples
+            resolution = None
+            rows = history_columns(agent_id, None, start_time, peaks)
+        return rows, resolution
+
+    def history_records(self, agent_id, resolution, start_time):
+        """(list of dicts, resolution used) for the rows response format"""
+        metrics = query_rollups(agent_id, resolution, start_time) if resolution else []
+        if not metrics:
+            resolution = None
+            metrics = SystemMetric.query.filter(
+                SystemMetric.agent_ref == agent_ref(agent_id),
+                SystemMetric.timestamp >= start_time
+            ).order_by(SystemMetric.timestamp.asc()).all()
+        return [m.to_dict() for m in metrics], resolution
+
+    def latest(self, agent_id):
+        row = SystemMetric.query.filter(SystemMetric.agent_ref == agent_ref(agent_id))\
+            .order_by(SystemMetric.timestamp.desc()).first()
+        return row.to_dict() if row is not None else None
+
+    def latest_many(self, agent_ids, chunk_size=500):
+        """
+        Latest metric dict of each given agent, keyed by agent_id. Each
+        agent's newest row is one index lookup on (agent_ref, timestamp).
+        """
+        agent_ids, latest = list(agent_ids), {}
+        newest = select(SystemMetric.id)\
+            .where(SystemMetric.agent_ref == Agent.id)\
+            .order_by(SystemMetric.timestamp.desc()).limit(1)\
+            .correlate(Agent).scalar_subquery()
+        for start in range(0, len(agent_ids), chunk_size):
+            ids = dict(db.session.execute(
+                select(newest, Agent.agent_id)
+                .where(Agent.agent_id.in_(agent_ids[start:start + chunk_size]))
+            ).all())
+            ids.pop(None, None)
+            for metric in SystemMetric.query.filter(SystemMetric.id.in_(ids)):
+                latest[ids[metric.id]] = metric.to_dict()
+        return latest
+
+
+def _from_ms(timestamp):
+    return datetime.fromtimestamp(timestamp / 1000.0, timezone.utc).replace(tzinfo=None)
+
+
+def _metric_dict(timestamp, values):
+    return {
+        'timestamp': _from_ms(timestamp).isoformat(),
+        'cpu_percent': values[0],
+        'memory_percent': values[1],
+        'disk_percent': values[2]
+    }
+
+
+class ChunkStorage:
+    """
+    System metrics in the embedded chunk store.
+
+    Agents and network checks still go through SQL (usually a local SQLite
+    file); only the per-sample metric series is kept in chunk files.
+    History at a rollup resolution is averaged from the samples on read.
+    """
+    name = 'chunks'
+
+    def __init__(self, path, chunk_samples=240, fsync=False, max_open=256):
+        self.store = ChunkStore(path, chunk_samples, fsync, max_open)
+
+    def write(self, samples):
+        """
+        Append the samples to the chunk store, then write agents and network
+        checks to SQL. An agent whose append fails gets RetryLater before
+        anything reaches SQL, and appends skip samples already stored, so a
+        retry repeats neither the checks nor the samples.
+        """
+        rows = OrderedDict()
+        for sample in samples:
+            metric = sample['metric']
+            rows.setdefault(sample['agent_id'], []).append(
+                (epoch_ms(metric['timestamp']), tuple(metric[c] for c in COLUMNS)))
+        failed = {}
+        for agent_id, agent_rows in rows.items():
+            try:
+                self.store.append(agent_id, agent_rows)
+            except OSError as e:
+                failed[agent_id] = RetryLater(f'Chunk store write failed: {e}')
+        errors = iter(write_samples([s for s in samples if s['agent_id'] not in failed], metrics=False))
+        return [failed[s['agent_id']] if s['agent_id'] in failed else next(errors) for s in samples]
+
+    def history(self, agent_id, resolution, start_time, peaks=False):
+        # cpu, memory and disk percent are the first three columns; summaries
+        # are not kept here, so peaks are the highest sampled values
+        rows = self.store.read(agent_id, epoch_ms(start_time), width=3)
+        if resolution:
+            width = resolution * 1000
+            buckets = OrderedDict()
+            for timestamp, values in rows:
+                buckets.setdefault(timestamp // width * width, []).append(values)
+            return [
+                (_from_ms(bucket),) + tuple(_mean([v[i] for v in values]) for i in range(3)) +
+                (tuple(_max([v[i] for v in values]) for i in range(2)) if peaks else ())
+                for bucket, values in buckets.items()
+            ], resolution
+        return [(_from_ms(timestamp),) + values + (values[:2] if peaks else ())
+                for timestamp, values in rows], None
+
+    def history_records(self, agent_id, resolution, start_time):
+        rows, resolution = self.history(agent_id, resolution, start_time)
+        return [{
+            'timestamp': timestamp.isoformat(),
+            'cpu_percent': cpu,
+            'memory_percent': memory,
+            'disk_percent': disk
+        } for timestamp, cpu, memory, disk in rows], resolution
+
+    def latest(self, agent_id):
+        latest = self.store.latest(agent_id)
+        return _metric_dict(*latest) if latest is not None else None
+
+    def latest_many(self, agent_ids):
+        latest = {}
+        for agent_id in agent_ids:
+            metric = self.latest(agent_id)
+            if metric is not None:
+                latest[agent_id] = metric
+        return latest
+
+    def expire(self, cutoff):
+        """Drop whole chunks older than cutoff; returns samples removed"""
+        return self.store.expire(epoch_ms(cutoff))
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def _max(values):
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def create_storage(config):
+    """Backend selected by STORAGE_BACKEND"""
+    if config.STORAGE_BACKEND == 'sql':
+        return SQLStorage()
+    if config.STORAGE_BACKEND == 'chunks':
+        return ChunkStorage(config.CHUNK_STORE_PATH, config.CHUNK_SAMPLES, config.CHUNK_FSYNC,
+                            config.CHUNK_MAX_OPEN_SERIES)
+    raise ValueError(f'Unknown STORAGE_BACKEND: {config.STORAGE_BACKEND}')
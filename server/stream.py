@@ -0,0 +1,169 @@
+"""
+Event stream server
+Serves /api/v1/stream from a single asyncio event loop, so an open stream
+costs a socket and a small queue instead of a gunicorn request thread.
+Changes are picked up by reloading the latest-state cache from the database
+every STREAM_REFRESH_SECONDS; a reload reads the agents table and only the
+agents whose newest sample moved, and the changed fields are fanned out to
+the subscribers interested in each agent.
+
+Point the web pages at it with STREAM_URL (or route /api/v1/stream to it in
+the reverse proxy). SQL storage only.
+
+Usage:
+    python stream.py [--host 0.0.0.0] [--port 5002]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from urllib.parse import parse_qs, urlsplit
+import bootstrap
+from cache import LatestStateCache
+from config import Config
+from events import format_sse
+from storage import create_storage
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 16384
+
+
+class _Client:
+    """A subscriber's bounded event queue and agent filter"""
+
+    def __init__(self, agent_ids, maxsize):
+        self.agent_ids = frozenset(agent_ids) if agent_ids else None
+        self.queue = asyncio.Queue(maxsize)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A slow client gets a resync marker instead of an unbounded backlog
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(('resync', {}))
+
+
+class StreamServer:
+    """Fans cache changes out to Server-Sent Events clients on one event loop"""
+
+    def __init__(self, app, cache, refresh_interval=2, keepalive=15, queue_size=256):
+        self.app = app
+        self.cache = cache
+        self.refresh_interval = refresh_interval
+        self.keepalive = keepalive
+        self.queue_size = queue_size
+        self._clients = set()
+        self._pending = []  # (agent_id, delta) collected by the cache listener
+        self.published = 0
+
+    def _reload(self):
+        """Reload the cache in a worker thread; returns the changes"""
+        with self.app.app_context():
+            self.cache.load()
+        pending, self._pending = self._pending, []
+        return pending
+
+    def collect(self, agent_id, delta):
+        self._pending.append((agent_id, delta))
+
+    def publish(self, agent_id, event_type, data):
+        self.published += 1
+        for client in list(self._clients):
+            if client.agent_ids is None or agent_id in client.agent_ids:
+                client.put((event_type, data))
+
+    async def refresh(self):
+        """Reload every refresh_interval seconds and publish what changed"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                changes = await loop.run_in_executor(None, self._reload)
+            except Exception as e:
+                logger.error(f"Error reloading the latest-state cache: {e}")
+                changes = []
+            for agent_id, delta in changes:
+                self.publish(agent_id, 'update', dict(delta, agent_id=agent_id))
+            await asyncio.sleep(self.refresh_interval)
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive)
+            method, target = request.split(b'\r\n', 1)[0].decode('latin-1').split(' ')[:2]
+            url = urlsplit(target)
+            if method != 'GET':
+                await self._reply(writer, '405 Method Not Allowed', {'status': 'error', 'message': 'GET only'})
+            elif url.path == '/health':
+                await self._reply(writer, '200 OK', {'status': 'healthy', 'streams': len(self._clients)})
+            elif url.path == '/api/v1/stream':
+                agent_ids = [a for a in parse_qs(url.query).get('agent_id', [''])[0].split(',') if a]
+                await self._stream(writer, agent_ids)
+            else:
+                await self._reply(writer, '404 Not Found', {'status': 'error', 'message': 'Not found'})
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass  # client went away or sent something that is not HTTP
+        finally:
+            writer.close()
+
+    async def _reply(self, writer, status, body):
+        data = json.dumps(body).encode()
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(data)}\r\nAccess-Control-Allow-Origin: *\r\n'
+                     f'Connection: close\r\n\r\n'.encode() + data)
+        await writer.drain()
+
+    async def _stream(self, writer, agent_ids):
+        client = _Client(agent_ids, self.queue_size)
+        self._clients.add(client)
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                         b'Cache-Control: no-cache\r\nX-Accel-Buffering: no\r\n'
+                         b'Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n'
+                         b'retry: 5000\n\n')
+            await writer.drain()
+            while True:
+                try:
+                    event = await asyncio.wait_for(client.queue.get(), self.keepalive)
+                    writer.write(format_sse(*event).encode())
+                except asyncio.TimeoutError:
+                    writer.write(b': keepalive\n\n')
+                await writer.drain()
+        finally:
+            self._clients.discard(client)
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+        logger.info(f"Event stream listening on http://{host}:{port}/api/v1/stream")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.refresh())
+
+
+def create_server():
+    # A bare app: the gunicorn workers manage the schema and run the jobs
+    app = bootstrap.create_app()
+    storage = create_storage(Config)
+    if storage.name != 'sql':
+        raise SystemExit('stream.py needs STORAGE_BACKEND=sql; the chunk store is single-process')
+    stream = StreamServer(app, LatestStateCache(0, storage=storage), Config.STREAM_REFRESH_SECONDS,
+                          Config.STREAM_KEEPALIVE_SECONDS, Config.STREAM_QUEUE_SIZE)
+    stream.cache.listener = stream.collect
+    # Start from the current state, so the first reload only reports changes
+    stream._reload()
+    return stream
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the live event stream')
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('STREAM_PORT', 5002)))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        asyncio.run(create_server().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,193 @@
+"""
+Compact agent wire protocol
+Agent registration and expansion of delta-encoded sample batches
+"""
+import json
+from datetime import datetime, timezone
+from bootstrap import writing
+from models import db, Agent, CHECK_STATUS_NAMES
+from ingest import SampleError, intern_targets, lookup_targets, parse_host
+
+try:
+    import msgpack
+except ImportError:  # compact batches are then JSON only
+    msgpack = None
+
+PROTOCOL_VERSION = 1
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# Metric fields addressed by index in a sample's change list
+FIELDS = ('cpu_percent', 'memory_used', 'memory_percent', 'disk_used', 'disk_percent',
+          'memory_total', 'disk_total',
+          'cpu_min', 'cpu_max', 'cpu_avg', 'cpu_p95',
+          'memory_min', 'memory_max', 'memory_avg', 'memory_p95', 'sample_count')
+
+
+class ResyncRequired(Exception):
+    """The batch refers to registration state this server does not have (HTTP 409)"""
+
+
+def formats():
+    """Body encodings accepted for compact batches"""
+    return ['msgpack', 'json'] if msgpack is not None else ['json']
+
+
+def decode_payload(raw, mimetype):
+    """Request body as JSON or msgpack according to its Content-Type"""
+    if mimetype == MSGPACK_MIMETYPE:
+        if msgpack is None:
+            raise SampleError('msgpack bodies are not supported by this server')
+        try:
+            return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+        except Exception as e:
+            raise SampleError(f'Invalid msgpack body: {e}')
+    try:
+        return json.loads(raw)
+    except ValueError as e:
+        raise SampleError(f'Invalid request body: {e}')
+
+
+def encode_response(data, mimetype):
+    """Response body in the same encoding as the request"""
+    if mimetype == MSGPACK_MIMETYPE and msgpack is not None:
+        return msgpack.packb(data), MSGPACK_MIMETYPE
+    return json.dumps(data, separators=(',', ':')), 'application/json'
+
+
+@writing()
+def register(data):
+    """
+    Store an agent's static attributes and intern its targets.
+
+    Returns the integer target ids the agent uses in compact batches.
+    """
+    if not isinstance(data, dict):
+        raise SampleError('Registration must be an object')
+    agent_id = data.get('agent_id')
+    agent_name = data.get('agent_name')
+    interval = data.get('interval')
+    targets = data.get('targets') or []
+    if not agent_id or not isinstance(agent_id, str):
+        raise SampleError('agent_id must be a non-empty string')
+    if not agent_name or not isinstance(agent_name, str):
+        raise SampleError('agent_name must be a non-empty string')
+    if interval is not None and (not isinstance(interval, (int, float)) or interval <= 0):
+        raise SampleError('interval must be a positive number of seconds')
+    try:
+        targets = {t['target']: t['type'] for t in targets}
+    except (KeyError, TypeError):
+        raise SampleError('targets must be a list of {target, type} objects')
+
+    now = datetime.now(timezone.utc)
+    agent = Agent.query.filter_by(agent_id=agent_id).first()
+    if agent is None:
+        agent = Agent(agent_id=agent_id, agent_name=agent_name, last_seen=now)
+        db.session.add(agent)
+    agent.agent_name = agent_name
+    agent.expected_interval = int(interval) if interval else agent.expected_interval
+    agent.updated_at = now
+    ids = intern_targets(targets)
+    db.session.commit()
+    return ids
+
+
+def _number(value, name):
+    if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        raise SampleError(f'{name} must be a number')
+    return value
+
+
+def expand_batch(payload):
+    """
+    Expand a compact batch into samples shaped like parse_sample output.
+
+    The batch is {"v", "agent_id", "base", "samples"}; each sample is
+    [offset_ms, [field, value, ...], [[target_id, status, latency_ms,
+    offset_ms, error], ...], host]. The optional host entry holds extended
+    host metrics in the JSON sample's format. Offsets are relative to base (epoch ms),
+    change lists carry only fields that differ from the previous sample of
+    the batch, and trailing None check fields may be omitted. Static
+    attributes come from the agent's registration.
+
+    Returns a list holding a parsed sample or SampleError per entry.
+    Raises ResyncRequired if the agent or a target id is unknown.
+    """
+    if not isinstance(payload, dict) or payload.get('v') != PROTOCOL_VERSION:
+        raise SampleError(f'Expected a version {PROTOCOL_VERSION} compact batch')
+    agent_id = payload.get('agent_id')
+    base = payload.get('base')
+    samples = payload.get('samples')
+    if not isinstance(base, int) or not isinstance(samples, list):
+        raise SampleError('Compact batch needs an integer base and a list of samples')
+
+    agent = Agent.query.filter_by(agent_id=agent_id).first()
+    if agent is None:
+        raise ResyncRequired(f'Agent {agent_id} is not registered')
+    target_ids = set()
+    for sample in samples:
+        try:
+            target_ids.update(check[0] for check in sample[2])
+        except (IndexError, TypeError, KeyError):
+            pass
+    targets = lookup_targets(target_ids)
+    if len(targets) < len(target_ids):
+        raise ResyncRequired('Unknown target ids')
+
+    values = dict.fromkeys(FIELDS)
+    results = []
+    for sample in samples:
+        try:
+            results.append(_expand_sample(sample, base, agent, values, targets))
+        except SampleError as e:
+            results.append(e)
+        except (IndexError, TypeError, ValueError, OverflowError):
+            results.append(SampleError('Malformed compact sample'))
+    return results
+
+
+def _timestamp(base, offset):
+    if not isinstance(offset, int):
+        raise SampleError('offsets must be integer milliseconds')
+    return datetime.fromtimestamp((base + offset) / 1000.0, timezone.utc)
+
+
+def _expand_sample(sample, base, agent, values, targets):
+    timestamp = _timestamp(base, sample[0])
+    changes = sample[1] if len(sample) > 1 else []
+    # Applied even if the sample is later rejected, as the agent encodes
+    # every change against the previous entry
+    for i in range(0, len(changes) - 1, 2):
+        field = changes[i]
+        if not isinstance(field, int) or not 0 <= field < len(FIELDS):
+            raise SampleError(f'Unknown field index: {field}')
+        values[FIELDS[field]] = _number(changes[i + 1], FIELDS[field])
+    if values['cpu_percent'] is None or values['memory_percent'] is None or values['disk_percent'] is None:
+        raise SampleError('Sample without cpu, memory and disk values')
+
+    checks = []
+    for check in (sample[2] if len(sample) > 2 else None) or []:
+        check = list(check) + [None] * (5 - len(check))
+        target, check_type = targets[check[0]]
+        status = CHECK_STATUS_NAMES.get(check[1])
+        if status is None:
+            raise SampleError(f'Unknown check status: {check[1]}')
+        checks.append({
+            'agent_id': agent.agent_id,
+            'timestamp': _timestamp(base, check[3]) if check[3] is not None else timestamp,
+            'target': target,
+            'check_type': check_type,
+            'status': status,
+            'latency_ms': _number(check[2], 'latency_ms'),
+            'error_message': check[4]
+        })
+
+    metric = dict(values, agent_id=agent.agent_id, timestamp=timestamp)
+    return {
+        'agent_id': agent.agent_id,
+        'agent_name': agent.agent_name,
+        'timestamp': timestamp,
+        'interval': agent.expected_interval,
+        'metric': metric,
+        'checks': checks,
+        'host': parse_host(sample[3] if len(sample) > 3 else None)
+    }
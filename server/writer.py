@@ -0,0 +1,134 @@
+"""
+Write-behind ingest queue
+Buffers validated samples in memory and group-commits them from one writer thread
+"""
+import logging
+import threading
+import time
+from collections import deque
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue(threading.Thread):
+    """
+    Bounded queue of parsed samples drained by a single writer.
+
+    Requests enqueue whole batches and return at once; the writer commits
+    up to `batch_samples` samples per transaction, as soon as that many are
+    waiting or the oldest has waited `max_delay` seconds. submit() refuses
+    a batch that would overflow `max_samples`, so callers can answer 429.
+
+    Queued samples have already been acknowledged, so a batch whose write
+    raises, and any samples `write` returns, go back to the head of the
+    queue and the writer backs off (`retry_delay` doubling up to
+    `max_retry_delay`) before trying again. The batch being written still
+    counts against `max_samples`, so requeueing never overflows the queue.
+    Samples still queued when the process dies without stop() are lost.
+    """
+
+    def __init__(self, app, write, max_samples=10000, batch_samples=500, max_delay=0.5,
+                 retry_delay=0.5, max_retry_delay=30):
+        super().__init__(name='write-behind', daemon=True)
+        self.app = app
+        # Called with a list of samples inside an app context; returns the
+        # samples to retry later, or raises to retry the whole batch
+        self.write = write
+        self.max_samples = max_samples
+        self.batch_samples = batch_samples
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._cond = threading.Condition()
+        self._queue = deque()  # (enqueued at, sample)
+        self._writing = 0  # samples taken by the writer and not yet written
+        self._resume_at = 0.0  # monotonic time the writer backs off until
+        self._stopping = False
+        self.enqueued = 0
+        self.refused = 0
+        self.commits = 0
+        self.retried = 0
+        self.failed_commits = 0
+
+    def submit(self, samples):
+        """Queue samples; False (nothing queued) if they do not fit"""
+        with self._cond:
+            if self._stopping or len(self._queue) + self._writing + len(samples) > self.max_samples:
+                self.refused += len(samples)
+                return False
+            now = time.monotonic()
+            self._queue.extend((now, sample) for sample in samples)
+            self.enqueued += len(samples)
+            if len(self._queue) >= self.batch_samples or len(self._queue) == len(samples):
+                self._cond.notify()
+            return True
+
+    def _requeue(self, batch, retry):
+        """Release the written batch and put samples to retry back at the head"""
+        with self._cond:
+            self._writing -= len(batch)
+            now = time.monotonic()
+            self._queue.extendleft((now, sample) for sample in reversed(retry))
+
+    def depth(self):
+        """Samples not yet written, including the batch being written"""
+        with self._cond:
+            return len(self._queue) + self._writing
+
+    def stop(self, timeout=30):
+        """Refuse new samples, write everything queued and wait for the writer"""
+        with self._cond:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify()
+        if self.is_alive():
+            self.join(timeout)
+        if self.depth():
+            logger.warning(f"Write-behind queue stopped with {self.depth()} samples unwritten")
+
+    def _next_batch(self):
+        """Wait for a full batch, an old enough sample or shutdown, after any backoff"""
+        with self._cond:
+            while True:
+                backoff = self._resume_at - time.monotonic()
+                if self._queue and backoff > 0:
+                    self._cond.wait(backoff)
+                elif self._queue:
+                    wait = self._queue[0][0] + self.max_delay - time.monotonic()
+                    if len(self._queue) >= self.batch_samples or wait <= 0 or self._stopping:
+                        count = min(len(self._queue), self.batch_samples)
+                        self._writing += count
+                        return [self._queue.popleft()[1] for _ in range(count)]
+                    self._cond.wait(wait)
+                elif self._stopping:
+                    return None
+                else:
+                    self._cond.wait()
+
+    def run(self):
+        delay = 0
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            with self.app.app_context():
+                try:
+                    retry = self.write(batch) or []
+                    self.commits += 1
+                except Exception as e:
+                    db.session.rollback()
+                    retry = batch
+                    self.failed_commits += 1
+                    logger.error(f"Write-behind commit of {len(batch)} samples failed, will retry: {e}")
+                finally:
+                    db.session.remove()
+            self._requeue(batch, retry)
+            if retry:
+                self.retried += len(retry)
+                delay = min(self.max_retry_delay, delay * 2 or self.retry_delay)
+                self._resume_at = time.monotonic() + delay
+            else:
+                delay = 0
@@ -1,3 +1,10 @@
 #!/bin/bash
+set -e
 cd server
-gunicorn --bind 0.0.0.0:$PORT app:app
+# Create or upgrade the schema once, then start the workers without touching it
+python manage.py init-db
+# Optional event stream process (stream.py); point STREAM_URL at it
+if [ -n "$STREAM_PORT" ]; then
+    python stream.py --port "$STREAM_PORT" &
+fi
+exec gunicorn -c gunicorn.conf.py app:app
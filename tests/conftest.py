@@ -0,0 +1,32 @@
+"""
+Shared fixtures: server modules on sys.path and a fresh SQLite database
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server'))
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Bare app on an empty SQLite database, with an app context pushed"""
+    from flask import Flask
+    from bootstrap import configure_engine, init_db
+    from config import Config
+    from ingest import _target_ids, _targets_by_id
+    from models import db
+
+    # Target ids are cached per process, and each test has a new database
+    _target_ids.clear()
+    _targets_by_id.clear()
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'monitoring.db'}"
+    db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine)
+        init_db()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
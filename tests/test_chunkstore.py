@@ -0,0 +1,126 @@
+"""
+Chunk store tests
+Gorilla blocks decode to what was encoded, agents' files are opened behind a
+bounded LRU, and retried writes do not duplicate samples
+"""
+import math
+import os
+import random
+import pytest
+
+from chunkstore import COLUMNS, ChunkStore
+from gorilla import decode, encode
+
+WIDTH = len(COLUMNS)
+
+
+def rows(start, count, step=60000):
+    return [(start + i * step, tuple(float(i % 7) + c for c in range(WIDTH))) for i in range(count)]
+
+
+@pytest.mark.parametrize('timestamps,column', [
+    ([1000], [1.5]),
+    ([0, 60000, 120000, 180000], [1.0, 1.0, 1.0, 1.0]),                    # constant values
+    ([0, 60000, 120500, 179000, 10 ** 12], [0.0, -0.0, 1e-300, 1e300, math.inf]),
+    ([5, 4, 3], [None, 2.0, None]),                                          # out of order, gaps
+    ([-(2 ** 40), 0, 2 ** 40], [float(2 ** 53), 0.1, -7.25]),
+])
+def test_gorilla_round_trip(timestamps, column):
+    decoded_timestamps, (decoded,) = decode(encode(timestamps, [column]), len(timestamps), 1)
+    assert decoded_timestamps == timestamps
+    assert decoded == column
+
+
+def test_gorilla_round_trip_random():
+    generator = random.Random(17)
+    timestamps = sorted(generator.randrange(0, 2 ** 41) for _ in range(500))
+    columns = [[generator.choice([None, generator.uniform(-1e6, 1e6), float(generator.randrange(100))])
+                for _ in timestamps] for _ in range(3)]
+    decoded_timestamps, decoded = decode(encode(timestamps, columns), len(timestamps), 3)
+    assert decoded_timestamps == timestamps
+    assert decoded == columns
+    # Leading columns only
+    assert decode(encode(timestamps, columns), len(timestamps), 1)[1] == columns[:1]
+
+
+def open_descriptors():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def test_open_files_are_bounded(tmp_path):
+    store = ChunkStore(str(tmp_path), chunk_samples=4, max_open=3)
+    before = open_descriptors()
+    for i in range(20):
+        store.append(f'agent-{i}', rows(0, 6))
+    assert len(store._open_files) <= 3
+    assert open_descriptors() - before <= 3 * 3
+
+    # Every agent can still be read and written after its files were closed
+    for i in range(20):
+        store.append(f'agent-{i}', rows(0, 9)[6:])
+        assert store.read(f'agent-{i}', 0) == rows(0, 9)
+    assert len(store._open_files) <= 3
+    assert store.stats()['samples'] == 20 * 9
+    store.close()
+
+
+def test_reopened_store_and_expire_keep_files_closed(tmp_path):
+    store = ChunkStore(str(tmp_path), chunk_samples=4, max_open=2)
+    for i in range(10):
+        store.append(f'agent-{i}', rows(0, 10))
+    store.close()
+
+    store = ChunkStore(str(tmp_path), chunk_samples=4, max_open=2)
+    assert store.expire(4 * 60000) == 10 * 4  # the first chunk of each agent
+    assert len(store._open_files) <= 2
+    for i in range(10):
+        assert store.read(f'agent-{i}', 0) == rows(0, 10)[4:]
+    store.close()
+
+
+def test_retried_append_is_a_no_op(tmp_path):
+    store = ChunkStore(str(tmp_path), chunk_samples=4)
+    batch = rows(0, 10)
+    store.append('a1', batch)
+    store.append('a1', batch)               # whole batch retried
+    store.append('a1', batch[2:3] + rows(10 * 60000, 1))
+    late = [(30000, (9.0,) * WIDTH)]        # a genuinely late sample is kept
+    store.append('a1', late)
+    assert store.read('a1', 0) == sorted(batch + rows(10 * 60000, 1) + late)
+    store.close()
+
+
+def test_failed_append_writes_nothing_to_sql(app, tmp_path, monkeypatch):
+    from datetime import datetime, timezone
+    from ingest import RetryLater, parse_sample
+    from models import NetworkCheck
+    from storage import ChunkStorage
+
+    storage = ChunkStorage(str(tmp_path / 'chunks'), chunk_samples=4)
+    samples = [parse_sample({
+        'agent_id': agent_id, 'agent_name': agent_id,
+        'timestamp': datetime(2026, 3, 2, 10, 0, tzinfo=timezone.utc).isoformat(),
+        'system': {'cpu_percent': 5.0, 'memory': {'used': 1, 'total': 2, 'percent': 50.0},
+                   'disk': {'used': 1, 'total': 2, 'percent': 50.0}},
+        'network': [{'host': 'gateway', 'status': 'up', 'latency_ms': 1.0}]
+    }) for agent_id in ('a1', 'b2')]
+
+    append = storage.store.append
+
+    def failing(agent_id, rows):
+        if agent_id == 'b2':
+            raise OSError('disk full')
+        append(agent_id, rows)
+
+    monkeypatch.setattr(storage.store, 'append', failing)
+    errors = storage.write(samples)
+    assert errors[0] is None and isinstance(errors[1], RetryLater)
+    assert NetworkCheck.query.count() == 1
+
+    # Retrying the sample that failed writes its check once
+    monkeypatch.setattr(storage.store, 'append', append)
+    assert storage.write(samples[1:]) == [None]
+    assert NetworkCheck.query.count() == 2
+    # Appending samples already stored (an SQL retry) stores nothing twice
+    storage.store.append('a1', [(int(samples[0]['metric']['timestamp'].timestamp() * 1000), (1.0,) * 7)])
+    assert [len(storage.store.read(a, 0)) for a in ('a1', 'b2')] == [1, 1]
@@ -0,0 +1,208 @@
+"""
+Sharded cluster test
+Starts SQLite shards and the router as processes and checks that writes
+land on the owning shard, fleet-wide reads are merged, per-agent reads
+find agents that reported to another shard, and that after adding a shard
+`router.py drain` moves moved agents' history to their new owner
+
+Usage:
+    python -m pytest tests/test_cluster.py
+"""
+import os
+import socket
+import sys
+from datetime import datetime, timezone, timedelta
+import pytest
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(REPO_ROOT, 'server')
+sys.path.insert(0, SERVER_DIR)
+
+from cluster import Cluster  # noqa: E402
+from sharding import HashRing  # noqa: E402
+
+AGENTS = [f'agent-{i:02d}' for i in range(12)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_sample(agent_id, cpu=10.0, minutes_ago=2):
+    return {
+        'agent_id': agent_id,
+        'agent_name': agent_id,
+        # Query windows end at the last whole minute
+        'timestamp': (datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)).isoformat(),
+        'system': {
+            'cpu_percent': cpu,
+            'memory': {'used': 1024, 'total': 4096, 'percent': 25.0},
+            'disk': {'used': 2048, 'total': 8192, 'percent': 25.0}
+        },
+        'network': [{'host': 'gateway', 'status': 'up', 'latency_ms': 1.5}]
+    }
+
+
+@pytest.fixture(scope='module')
+def cluster(tmp_path_factory):
+    tmpdir = tmp_path_factory.mktemp('cluster')
+    cluster = Cluster(3, free_port(), free_port(), str(tmpdir / 'shards'),
+                      env={'BACKGROUND_JOBS': 'false', 'WRITE_BEHIND': 'false'},
+                      log_dir=str(tmpdir))
+    cluster.start()
+    try:
+        cluster.wait_ready(timeout=60)
+        yield cluster
+    finally:
+        cluster.stop()
+
+
+@pytest.fixture(scope='module')
+def ring(cluster):
+    # Same vnode count the router reads from the environment
+    from config import Config
+    return HashRing(cluster.shard_urls, Config.SHARD_VNODES)
+
+
+@pytest.fixture(scope='module')
+def ingested(cluster):
+    samples = [make_sample(agent_id, cpu=float(i)) for i, agent_id in enumerate(AGENTS)]
+    response = requests.post(f'{cluster.url}/api/v1/metrics/batch', json={'samples': samples}, timeout=30)
+    assert response.status_code == 200, response.text
+    assert response.json()['accepted'] == len(samples)
+    return samples
+
+
+def test_samples_land_on_owning_shard(cluster, ring, ingested):
+    owners = {ring.shard_for(agent_id) for agent_id in AGENTS}
+    assert len(owners) > 1, 'test agents should spread over several shards'
+
+    for agent_id in AGENTS:
+        owner = ring.shard_for(agent_id)
+        for shard in cluster.shard_urls:
+            response = requests.get(f'{shard}/api/v1/metrics/{agent_id}/latest', timeout=10)
+            assert response.status_code == (200 if shard == owner else 404), (agent_id, shard)
+
+
+def test_fleet_reads_are_merged(cluster, ingested):
+    agents = requests.get(f'{cluster.url}/api/v1/agents', timeout=10).json()['agents']
+    assert [agent['agent_id'] for agent in agents] == AGENTS
+
+    overview = requests.get(f'{cluster.url}/api/v1/overview', timeout=10).json()['agents']
+    assert {agent['agent_id'] for agent in overview} == set(AGENTS)
+
+    response = requests.get(f'{cluster.url}/api/v1/query', timeout=10,
+                            params={'metric': 'cpu', 'agg': 'max', 'group_by': 'agent', 'hours': 1})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body['shards'] == 3
+    values = {row['agent_id']: row['value'] for row in body['results']}
+    assert values == {agent_id: float(i) for i, agent_id in enumerate(AGENTS)}
+
+
+def test_agent_reads_go_through_router(cluster, ingested):
+    for agent_id in AGENTS:
+        latest = requests.get(f'{cluster.url}/api/v1/metrics/{agent_id}/latest', timeout=10)
+        assert latest.status_code == 200
+        history = requests.get(f'{cluster.url}/api/v1/metrics/{agent_id}', params={'hours': 1}, timeout=10)
+        assert len(history.json()['metrics']) == 1
+
+
+def test_reads_fall_back_to_other_shards(cluster, ring):
+    # An agent that reported to a shard it no longer hashes to, as after a rebalance
+    agent_id = 'moved-agent'
+    owner = ring.shard_for(agent_id)
+    other = next(shard for shard in cluster.shard_urls if shard != owner)
+    response = requests.post(f'{other}/api/v1/metrics', json=make_sample(agent_id, cpu=42.0), timeout=10)
+    assert response.status_code in (200, 201, 202), response.text
+
+    # The owner answers 404 for latest but 200 with empty lists for these
+    assert requests.get(f'{owner}/api/v1/metrics/{agent_id}', params={'hours': 1},
+                        timeout=10).json()['metrics'] == []
+
+    latest = requests.get(f'{cluster.url}/api/v1/metrics/{agent_id}/latest', timeout=10)
+    assert latest.status_code == 200
+    history = requests.get(f'{cluster.url}/api/v1/metrics/{agent_id}', params={'hours': 1}, timeout=10)
+    assert [row['cpu_percent'] for row in history.json()['metrics']] == [42.0]
+    columnar = requests.get(f'{cluster.url}/api/v1/metrics/{agent_id}',
+                            params={'hours': 1, 'format': 'columnar'}, timeout=10)
+    assert columnar.json()['cpu'] == [42.0]
+    binary = requests.get(f'{cluster.url}/api/v1/metrics/{agent_id}',
+                          params={'hours': 1, 'format': 'binary'}, timeout=10)
+    assert len(binary.content) > 8
+    network = requests.get(f'{cluster.url}/api/v1/network/{agent_id}', params={'hours': 1}, timeout=10)
+    assert network.json()['targets']
+
+
+def test_unknown_agent_is_still_empty(cluster):
+    response = requests.get(f'{cluster.url}/api/v1/metrics/nobody', params={'hours': 1}, timeout=10)
+    assert response.status_code == 200
+    assert response.json()['metrics'] == []
+    assert requests.get(f'{cluster.url}/api/v1/metrics/nobody/latest', timeout=10).status_code == 404
+
+
+@pytest.fixture
+def growing_cluster(tmp_path):
+    cluster = Cluster(2, free_port(), free_port(), str(tmp_path / 'shards'),
+                      env={'BACKGROUND_JOBS': 'false', 'WRITE_BEHIND': 'false'},
+                      log_dir=str(tmp_path))
+    cluster.start()
+    try:
+        cluster.wait_ready(timeout=60)
+        yield cluster
+    finally:
+        cluster.stop()
+
+
+def _history(cluster, agent_id):
+    response = requests.get(f'{cluster.url}/api/v1/metrics/{agent_id}', params={'hours': 6}, timeout=10)
+    return [row['cpu_percent'] for row in response.json()['metrics']]
+
+
+def test_drain_moves_history_after_adding_a_shard(growing_cluster):
+    from config import Config
+    cluster = growing_cluster
+    agents = [f'fleet-{i:02d}' for i in range(24)]
+    samples = [make_sample(agent_id, cpu=float(minutes), minutes_ago=minutes)
+               for agent_id in agents for minutes in (180, 120, 60)]
+    response = requests.post(f'{cluster.url}/api/v1/metrics/batch', json={'samples': samples}, timeout=30)
+    assert response.json()['accepted'] == len(samples)
+
+    old_ring = HashRing(list(cluster.shard_urls), Config.SHARD_VNODES)
+    cluster.add_shard()
+    cluster.wait_ready(timeout=60)
+    new_shard = cluster.shard_urls[-1]
+    moved = [a for a in agents if HashRing(cluster.shard_urls, Config.SHARD_VNODES).shard_for(a) == new_shard]
+    assert moved, 'some agents should hash to the new shard'
+
+    # A moved agent reports to its new owner, which hides the history left behind
+    agent_id = moved[0]
+    response = requests.post(f'{cluster.url}/api/v1/metrics', json=make_sample(agent_id, cpu=1.0), timeout=10)
+    assert response.status_code == 200
+    assert _history(cluster, agent_id) == [1.0]
+
+    output = cluster.drain()
+    assert f'{len(moved)} agents handed over, 0 failed' in output
+
+    assert _history(cluster, agent_id) == [180.0, 120.0, 60.0, 1.0]
+    for other in moved[1:]:
+        assert _history(cluster, other) == [180.0, 120.0, 60.0]
+        old = old_ring.shard_for(other)
+        assert requests.get(f'{old}/api/v1/metrics/{other}/latest', timeout=10).status_code == 404
+    network = requests.get(f'{cluster.url}/api/v1/network/{agent_id}', params={'hours': 6}, timeout=10)
+    assert network.json()['targets'][0]['checks'] == 4
+
+    export = requests.get(f'{cluster.url}/api/v1/export',
+                          params={'agent_id': agent_id, 'hours': 6}, timeout=10)
+    # Four rows and the closing cursor line
+    assert len(export.text.splitlines()) == 5
+
+    listed = requests.get(f'{cluster.url}/api/v1/agents', timeout=10).json()['agents']
+    assert sorted(agent['agent_id'] for agent in listed) == agents
+
+    # Nothing is left to move, and a second run changes nothing
+    assert '0 agents handed over, 0 failed' in cluster.drain()
+    assert _history(cluster, agent_id) == [180.0, 120.0, 60.0, 1.0]
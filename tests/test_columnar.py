@@ -0,0 +1,67 @@
+"""
+Columnar history encoding tests
+Parallel arrays with rounded values, and the packed binary layout with its
+header, NaN for missing values and 8-byte aligned arrays
+"""
+import math
+import struct
+from datetime import datetime, timezone
+
+from columnar import HEADER, epoch_ms, pack_columns, to_columns
+
+T0 = datetime(2026, 3, 2, 12, 0, 0, 250000)
+T0_MS = 1772452800250
+
+
+def rows(count):
+    return [(T0.replace(second=i), 10.0 + i / 3, None if i == 1 else 50.0, 25.0)
+            for i in range(count)]
+
+
+def test_epoch_ms_treats_naive_timestamps_as_utc():
+    assert epoch_ms(T0) == T0_MS
+    assert epoch_ms(T0.replace(tzinfo=timezone.utc)) == T0_MS
+
+
+def test_to_columns_rounds_and_keeps_missing_values():
+    columns = to_columns(rows(3), precision=1)
+    assert columns == {
+        'timestamps': [T0_MS, T0_MS + 1000, T0_MS + 2000],
+        'cpu': [10.0, 10.3, 10.7],
+        'memory': [50.0, None, 50.0],
+        'disk': [25.0, 25.0, 25.0],
+    }
+
+
+def test_to_columns_with_peaks_and_without_rows():
+    columns = to_columns([(T0, 1.0, 2.0, 3.0, 4.0, 5.0)])
+    assert columns['cpu_max'] == [4.0] and columns['memory_max'] == [5.0]
+    assert to_columns([]) == {'timestamps': [], 'cpu': [], 'memory': [], 'disk': []}
+
+
+def unpack(body):
+    count, resolution = HEADER.unpack_from(body)
+    offset = HEADER.size
+    timestamps = struct.unpack_from(f'<{count}d', body, offset)
+    offset += 8 * count
+    series = []
+    for _ in range(3):
+        assert offset % 8 == 0
+        series.append(struct.unpack_from(f'<{count}f', body, offset))
+        offset += 4 * count + 4 * (count % 2)
+    assert offset == len(body)
+    return resolution, timestamps, series
+
+
+def test_pack_columns_layout():
+    for count in (0, 1, 2, 3):
+        resolution, timestamps, (cpu, memory, disk) = unpack(pack_columns(rows(count), resolution=300))
+        assert resolution == 300
+        assert timestamps == tuple(float(T0_MS + 1000 * i) for i in range(count))
+        assert cpu == tuple(struct.unpack('<f', struct.pack('<f', 10.0 + i / 3))[0] for i in range(count))
+        assert [math.isnan(value) for value in memory] == [i == 1 for i in range(count)]
+        assert disk == (25.0,) * count
+
+
+def test_raw_samples_have_resolution_zero():
+    assert unpack(pack_columns(rows(2)))[0] == 0
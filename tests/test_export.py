@@ -0,0 +1,89 @@
+"""
+Export tests
+Every format closes with the cursor after its last row, and resuming from it
+returns only rows written since
+"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert
+
+from export import (CSV_CURSOR_PREFIX, _last_row, control_line, make_cursor, parse_cursor,
+                    parse_export, stream_export)
+from models import db, Agent, SystemMetric
+
+START = datetime(2026, 3, 2, 10, 0, tzinfo=timezone.utc)
+
+
+def add_samples(minutes, memory_total=None):
+    agent = Agent.query.filter_by(agent_id='a1').first()
+    if agent is None:
+        agent = Agent(agent_id='a1', agent_name='a1', memory_total=4096, disk_total=8192)
+        db.session.add(agent)
+        db.session.flush()
+    db.session.execute(insert(SystemMetric), [{
+        'agent_ref': agent.id, 'timestamp': START + timedelta(minutes=minute),
+        'cpu_percent': float(minute), 'memory_total': memory_total
+    } for minute in minutes])
+    db.session.commit()
+
+
+def export(fmt='ndjson', **args):
+    args = dict({'agent_id': 'a1', 'start': START.isoformat(),
+                 'end': (START + timedelta(hours=1)).isoformat(), 'format': fmt}, **args)
+    return b''.join(stream_export(parse_export(args), chunk_rows=2)).decode()
+
+
+def test_cursor_round_trip():
+    token = make_cursor(datetime(2026, 3, 2, 10, 0, 5), 42)
+    assert parse_cursor(token) == (datetime(2026, 3, 2, 10, 0, 5), 42)
+
+
+def test_ndjson_ends_with_cursor_after_last_row(app):
+    add_samples(range(5))
+    lines = export().splitlines()
+    rows = [json.loads(line) for line in lines[:-1]]
+    assert [row['cpu_percent'] for row in rows] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert json.loads(lines[-1])['rows'] == 5
+    cursor = control_line(lines[-1])
+    assert parse_cursor(cursor) == (datetime.fromisoformat(rows[-1]['timestamp']), rows[-1]['id'])
+    assert all(control_line(line) is None for line in lines[:-1])
+
+    # Resuming from the closing cursor returns only rows added since
+    add_samples(range(5, 7))
+    lines = export(cursor=cursor).splitlines()
+    assert [json.loads(line)['cpu_percent'] for line in lines[:-1]] == [5.0, 6.0]
+    # Totals carried forward across the resume
+    assert json.loads(lines[0])['memory_total'] == 4096
+
+    # Nothing new: the cursor comes back unchanged
+    last = control_line(lines[-1])
+    assert export(cursor=last).splitlines() == [json.dumps({'cursor': last, 'rows': 0})]
+
+
+def test_csv_ends_with_cursor_comment(app):
+    add_samples(range(3))
+    body = export('csv')
+    *rows, closing = body.splitlines()
+    assert closing.startswith(CSV_CURSOR_PREFIX)
+    parsed = list(csv.DictReader(io.StringIO('\n'.join(rows))))
+    assert [row['cpu_percent'] for row in parsed] == ['0.0', '1.0', '2.0']
+    assert parse_cursor(closing[len(CSV_CURSOR_PREFIX):])[1] == int(parsed[-1]['id'])
+
+
+def test_empty_export_returns_the_window_start(app):
+    lines = export().splitlines()
+    assert len(lines) == 1
+    assert parse_cursor(control_line(lines[0])) == (START.replace(tzinfo=None), 0)
+
+
+def test_resume_skips_the_closing_line(app, tmp_path):
+    add_samples(range(3))
+    path = tmp_path / 'dump.ndjson'
+    path.write_text(export())
+    (timestamp, row_id), size = _last_row(str(path), 'ndjson')
+    assert size == len(''.join(path.read_text().splitlines(True)[:3]))
+    path = tmp_path / 'dump.csv'
+    path.write_text(export('csv'))
+    assert _last_row(str(path), 'csv')[0][1] == row_id
@@ -0,0 +1,49 @@
+"""
+Worker metrics tests
+Scrapes of any worker report counters summed over all workers, and gauges
+per live worker
+"""
+import json
+import os
+
+from instrumentation import Registry, WorkerMetrics
+
+
+def make_registry():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests', ('route',))
+    seconds = registry.histogram('seconds', 'Durations', buckets=(0.1, 1.0))
+    depth = registry.gauge('depth', 'Queue depth')
+    return registry, requests, seconds, depth
+
+
+def test_scrape_sums_all_workers(tmp_path):
+    registry, requests, seconds, depth = make_registry()
+    requests.inc(2, route='/a')
+    seconds.observe(0.05)
+    depth.set_function(lambda: 7)
+    shared = WorkerMetrics(registry, str(tmp_path))
+
+    # Another worker that has since exited: its counters still count, its gauge does not
+    other = {'requests_total': [[['/a'], 3], [['/b'], 1]],
+             'seconds': [[[], [[0, 1, 1], 5.5]]],
+             'depth': [[[], 100]]}
+    (tmp_path / '999999999-1.json').write_text(json.dumps(other))
+
+    lines = shared.render().splitlines()
+    assert 'requests_total{route="/a"} 5' in lines
+    assert 'requests_total{route="/b"} 1' in lines
+    assert 'seconds_bucket{le="0.1"} 1' in lines
+    assert 'seconds_bucket{le="+Inf"} 3' in lines
+    assert 'seconds_count 3' in lines
+    assert f'depth{{pid="{os.getpid()}"}} 7' in lines
+    assert not [line for line in lines if line.startswith('depth{pid="999999999"}')]
+
+
+def test_values_are_written_for_other_workers(tmp_path):
+    registry, requests, _, _ = make_registry()
+    shared = WorkerMetrics(registry, str(tmp_path))
+    requests.inc(route='/a')
+    shared.flush()
+    with open(shared.path) as f:
+        assert json.load(f)['requests_total'] == [[['/a'], 1]]
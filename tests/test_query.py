@@ -0,0 +1,141 @@
+"""
+Aggregate query tests
+Aggregations, percentiles, top-k and filters computed in SQL, rollup
+resolution selection, and time-bucketed queries answered from rollups with
+the buckets the rollup job has not reached yet filled in from raw rows
+"""
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import insert
+
+from config import Config
+from ingest import parse_sample, write_samples
+from models import db, Agent, SystemMetric
+from query import QueryCache, QueryError, _rollup_resolution, parse_query, run_query
+from rollup import run_rollup
+
+NOW = datetime(2026, 3, 2, 12, 0, 30, tzinfo=timezone.utc)
+START = datetime(2026, 3, 2, 11, 0, tzinfo=timezone.utc)
+
+
+def add_samples(agent_id, minutes, cpu):
+    agent = Agent.query.filter_by(agent_id=agent_id).first()
+    if agent is None:
+        agent = Agent(agent_id=agent_id, agent_name=agent_id)
+        db.session.add(agent)
+        db.session.flush()
+    db.session.execute(insert(SystemMetric), [{
+        'agent_ref': agent.id,
+        'timestamp': (START + timedelta(minutes=minute)).replace(tzinfo=None),
+        'cpu_percent': cpu(minute),
+        'memory_percent': 50.0,
+        'disk_percent': 10.0
+    } for minute in minutes])
+    db.session.commit()
+
+
+def query(**args):
+    return run_query(parse_query(args), now=NOW)
+
+
+def values(result, key='agent_id'):
+    return {row[key]: row['value'] for row in result['results']}
+
+
+@pytest.fixture
+def fleet(app):
+    add_samples('a1', range(60), float)
+    add_samples('a2', range(0, 60, 2), lambda minute: 50.0)
+
+
+@pytest.mark.parametrize('agg, expected', [
+    ('avg', 29.5), ('min', 0.0), ('max', 59.0), ('count', 60),
+    # Nearest rank over 0..59: the 30th and 57th smallest values
+    ('p50', 29.0), ('p95', 56.0),
+])
+def test_aggregations_per_agent(fleet, agg, expected):
+    result = query(metric='cpu', agg=agg, hours='1')
+    assert result['answered_from'] == 'raw'
+    assert values(result) == {'a1': expected, 'a2': 30 if agg == 'count' else 50.0}
+    assert {row['agent_id']: row['samples'] for row in result['results']} == {'a1': 60, 'a2': 30}
+
+
+def test_top_k_and_filters(fleet):
+    assert values(query(metric='cpu', agg='max', top='1')) == {'a1': 59.0}
+    assert values(query(metric='cpu', agg='max', top='1', order='asc')) == {'a2': 50.0}
+    assert values(query(metric='cpu', agg='avg', agent_id='a2, nobody')) == {'a2': 50.0}
+    # The window ends at the last whole minute and reaches back `hours`
+    assert values(query(metric='cpu', agg='count', hours='0.5')) == {'a1': 30, 'a2': 15}
+
+
+def test_invalid_queries_are_rejected():
+    for args in ({'metric': 'latency'}, {'agg': 'p42'}, {'group_by': 'target'},
+                 {'group_by': 'time'}, {'hours': '0'}, {'step': 'x'}, {'order': 'up'}):
+        with pytest.raises(QueryError):
+            parse_query(args)
+
+
+@pytest.mark.parametrize('args, resolution', [
+    ({'step': '60'}, 60),
+    ({'step': '600'}, 300),
+    ({'step': '7200'}, 3600),
+    ({'step': '90'}, None),                    # no rollup divides the buckets
+    ({'step': '300', 'agg': 'p95'}, None),     # percentiles do not merge
+    ({'step': '300', 'resolution': 'raw'}, None),
+    ({'step': '60', 'hours': str(24 * 30)}, None),  # minute rollups are kept 7 days
+    ({'step': '3600', 'hours': str(24 * 30)}, 3600),
+])
+def test_rollup_resolution_selection(monkeypatch, args, resolution):
+    monkeypatch.setattr(Config, 'RETENTION_ROLLUP_DAYS', {60: 7, 300: 90, 3600: 730})
+    assert _rollup_resolution(parse_query(dict(args, group_by='time', metric='cpu'))) == resolution
+
+
+def test_time_buckets_fill_the_rollup_gap_from_raw_rows(app):
+    add_samples('a1', range(30), float)
+    run_rollup(settle_seconds=0)
+    # Written after the rollup run, so only raw rows have them
+    add_samples('a1', range(30, 60), float)
+
+    args = dict(metric='cpu', agg='avg', group_by='agent,time', step='300', hours='1')
+    mixed = query(**args)
+    raw = query(resolution='raw', **args)
+
+    assert mixed['answered_from'] == 'rollup:300,raw'
+    assert raw['answered_from'] == 'raw'
+    assert mixed['results'] == raw['results']
+    assert [row['bucket'] for row in mixed['results']] == [
+        (START + timedelta(minutes=minute)).replace(tzinfo=None).isoformat()
+        for minute in range(0, 60, 5)]
+    assert [row['value'] for row in mixed['results']] == [minute + 2.0 for minute in range(0, 60, 5)]
+
+
+def test_network_availability_and_latency(app):
+    def sample(minute, status, latency):
+        return parse_sample({
+            'agent_id': 'a1', 'agent_name': 'a1',
+            'timestamp': (START + timedelta(minutes=minute)).isoformat(),
+            'system': {'cpu_percent': 1.0,
+                       'memory': {'used': 1, 'total': 4, 'percent': 25.0},
+                       'disk': {'used': 1, 'total': 4, 'percent': 25.0}},
+            'network': [{'host': 'gateway', 'status': status, 'latency_ms': latency}]
+        })
+    assert write_samples([sample(minute, 'down' if minute % 4 == 0 else 'up', float(minute))
+                          for minute in range(40)]) == [None] * 40
+
+    result = query(source='network', metric='availability', agg='avg', group_by='target')
+    assert values(result, 'target') == {'gateway': 75.0}
+    result = query(source='network', metric='latency', agg='max', group_by='agent,target',
+                   target='gateway')
+    assert [(row['agent_id'], row['target'], row['value'])
+            for row in result['results']] == [('a1', 'gateway', 39.0)]
+
+
+def test_cache_is_keyed_on_the_window(fleet):
+    cache = QueryCache(max_entries=2)
+    parsed = parse_query({'metric': 'cpu', 'agg': 'max'})
+    first, cached = cache.get_or_compute(parsed, now=NOW)
+    assert not cached
+    assert cache.get_or_compute(parsed, now=NOW + timedelta(seconds=20)) == (first, True)
+    # The next minute is a new window
+    assert not cache.get_or_compute(parsed, now=NOW + timedelta(seconds=40))[1]
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -0,0 +1,78 @@
+"""
+Retention tests
+Expired rows are deleted in bounded chunks, one transaction each, and rows
+inside the retention window or of another rollup resolution are kept
+"""
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert
+
+from config import Config
+from models import db, Agent, MetricRollup, SystemMetric
+from retention import delete_expired, run_retention
+
+NOW = datetime(2026, 3, 2, 12, 0, tzinfo=timezone.utc)
+CUTOFF = NOW - timedelta(days=30)
+
+
+def add_metrics(days_ago):
+    agent = Agent.query.filter_by(agent_id='a1').first()
+    if agent is None:
+        agent = Agent(agent_id='a1', agent_name='a1')
+        db.session.add(agent)
+        db.session.flush()
+    db.session.execute(insert(SystemMetric), [{
+        'agent_ref': agent.id,
+        'timestamp': (NOW - timedelta(days=days)).replace(tzinfo=None),
+        'cpu_percent': float(days)
+    } for days in days_ago])
+    db.session.commit()
+    return agent
+
+
+class CommitCounter:
+    def __init__(self, monkeypatch):
+        self.commits = 0
+        commit = db.session.commit
+
+        def counting():
+            self.commits += 1
+            commit()
+        monkeypatch.setattr(db.session, 'commit', counting)
+
+
+def test_expired_rows_are_deleted_in_chunks(app, monkeypatch):
+    add_metrics([40 + day / 10 for day in range(25)] + [1, 2, 3])
+    counter = CommitCounter(monkeypatch)
+
+    deleted = delete_expired(SystemMetric, SystemMetric.timestamp, CUTOFF, chunk_size=10)
+
+    assert deleted == 25
+    assert counter.commits == 3  # 10 + 10 + 5
+    assert sorted(cpu for cpu, in db.session.query(SystemMetric.cpu_percent)) == [1.0, 2.0, 3.0]
+
+
+def test_exact_multiple_of_the_chunk_size(app):
+    add_metrics([40 + day / 10 for day in range(20)])
+    assert delete_expired(SystemMetric, SystemMetric.timestamp, CUTOFF, chunk_size=10) == 20
+    assert SystemMetric.query.count() == 0
+
+
+def test_run_retention_applies_each_policy(app, monkeypatch):
+    agent = add_metrics([45, 31, 29, 1])
+    db.session.execute(insert(MetricRollup), [{
+        'agent_ref': agent.id, 'resolution': resolution, 'sample_count': 1,
+        'bucket_start': (NOW - timedelta(days=days)).replace(tzinfo=None)
+    } for resolution, days in ((60, 8), (60, 6), (300, 8))])
+    db.session.commit()
+    monkeypatch.setattr(Config, 'RETENTION_CHUNK_SIZE', 1)
+    monkeypatch.setattr(Config, 'RETENTION_SYSTEM_METRICS_DAYS', 30)
+    monkeypatch.setattr(Config, 'RETENTION_ROLLUP_DAYS', {60: 7, 300: 90, 3600: 0})
+
+    report = run_retention(now=NOW)
+
+    assert report['system_metrics']['rows'] == 2
+    assert report['metric_rollups.60s']['rows'] == 1
+    assert report['metric_rollups.300s']['rows'] == 0
+    assert 'metric_rollups.3600s' not in report  # 0 keeps data forever
+    assert sorted(cpu for cpu, in db.session.query(SystemMetric.cpu_percent)) == [1.0, 29.0]
+    assert sorted(r.resolution for r in MetricRollup.query.all()) == [60, 300]
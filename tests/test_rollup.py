@@ -0,0 +1,104 @@
+"""
+Rollup tests
+Incremental bucket updates match a rollup of all rows at once, and rows are
+only rolled up once their id has settled
+"""
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import insert, select
+
+from models import db, Agent, MetricRollup, SystemMetric
+from rollup import choose_resolution, run_rollup
+
+START = datetime(2026, 3, 2, 10, 0, tzinfo=timezone.utc)
+
+
+def add_samples(agent_id, minutes, cpu=lambda minute: float(minute)):
+    agent = Agent.query.filter_by(agent_id=agent_id).first()
+    if agent is None:
+        agent = Agent(agent_id=agent_id, agent_name=agent_id)
+        db.session.add(agent)
+        db.session.flush()
+    db.session.execute(insert(SystemMetric), [{
+        'agent_ref': agent.id,
+        'timestamp': START + timedelta(minutes=minute, seconds=second),
+        'cpu_percent': cpu(minute) + second / 60,
+        'memory_percent': 50.0,
+        'disk_percent': 10.0
+    } for minute in minutes for second in (0, 20, 40)])
+    db.session.commit()
+
+
+def rollups():
+    rows = db.session.execute(
+        select(MetricRollup, Agent.agent_id).join(Agent, Agent.id == MetricRollup.agent_ref))
+    return {
+        (agent_id, r.resolution, r.bucket_start): (
+            r.sample_count, r.cpu_min, r.cpu_max, round(r.cpu_avg, 6), r.cpu_p95, r.memory_avg)
+        for r, agent_id in rows
+    }
+
+
+def test_incremental_runs_match_a_single_run(app, tmp_path):
+    # Three runs, the later ones adding to buckets the earlier ones created
+    add_samples('a1', range(0, 7))
+    run_rollup(settle_seconds=0)
+    add_samples('a1', range(7, 70))
+    add_samples('b2', range(0, 3))
+    run_rollup(settle_seconds=0)
+    add_samples('a1', [3])  # late rows for an already rolled-up minute
+    assert run_rollup(settle_seconds=0) == 3
+    incremental = rollups()
+
+    MetricRollup.query.delete()
+    db.session.commit()
+    from models import JobState
+    JobState.query.delete()
+    db.session.commit()
+    run_rollup(settle_seconds=0)
+    full = rollups()
+
+    assert incremental.keys() == full.keys()
+    for key, values in full.items():
+        if key[1] == 3600:
+            # Hour p95 of merged buckets is estimated from the five-minute buckets
+            assert incremental[key][:4] == values[:4], key
+            assert incremental[key][4] == pytest.approx(values[4], abs=5)
+        else:
+            assert incremental[key] == values, key
+
+    minute = full[('a1', 60, datetime(2026, 3, 2, 10, 3))]
+    assert minute[0] == 6  # the late rows were added, not double counted
+    assert full[('a1', 3600, datetime(2026, 3, 2, 10, 0))][0] == 183
+
+
+def test_rows_wait_until_their_id_has_settled(app):
+    add_samples('a1', range(0, 2))
+    # The first run only notes the newest id
+    assert run_rollup(settle_seconds=3600) == 0
+    assert MetricRollup.query.count() == 0
+
+    from models import JobState
+    pending = db.session.get(JobState, 'rollup.pending_metric_id')
+    pending.updated_at = datetime.now(timezone.utc) - timedelta(hours=2)
+    db.session.commit()
+    add_samples('a1', range(2, 4))
+
+    # Rolls up what was noted, and notes the rows added since
+    run_rollup(settle_seconds=3600)
+    assert db.session.get(MetricRollup, 1) is not None
+    counts = {r.resolution: r.sample_count for r in MetricRollup.query.all() if r.resolution != 60}
+    assert counts == {300: 6, 3600: 6}
+    assert db.session.get(JobState, 'rollup.pending_metric_id').value == 12
+
+
+@pytest.mark.parametrize('window,max_points,step,expected', [
+    (3600, 300, None, None),        # an hour of raw rows
+    (86400, 300, None, 60),
+    (7 * 86400, 300, None, 300),
+    (365 * 86400, 300, None, 3600),
+    (86400, 300, 600, 300),         # coarsest resolution not wider than step
+    (86400, 300, 30, None),
+])
+def test_choose_resolution(window, max_points, step, expected):
+    assert choose_resolution(window, max_points, step) == expected
@@ -0,0 +1,72 @@
+"""
+Event stream process tests
+Cache changes found by a reload reach the subscribers interested in them,
+served from one event loop
+"""
+import asyncio
+from contextlib import nullcontext
+
+from stream import StreamServer
+
+
+class FakeApp:
+    def app_context(self):
+        return nullcontext()
+
+
+class FakeCache:
+    """Reports the queued changes on the next load()"""
+
+    def __init__(self):
+        self.listener = None
+        self.changes = []
+
+    def load(self):
+        changes, self.changes = self.changes, []
+        for agent_id, delta in changes:
+            self.listener(agent_id, delta)
+
+
+async def read_event(reader):
+    while True:
+        line = await reader.readline()
+        if line.startswith(b'data: '):
+            return line[6:].strip().decode()
+
+
+async def run_streams():
+    cache = FakeCache()
+    stream = StreamServer(FakeApp(), cache, refresh_interval=0.05, keepalive=5)
+    cache.listener = stream.collect
+    server = await asyncio.start_server(stream.handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    refresh = asyncio.ensure_future(stream.refresh())
+
+    clients = {}
+    for name, query in (('all', ''), ('a1', '?agent_id=a1'), ('b2', '?agent_id=b2')):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'GET /api/v1/stream{query} HTTP/1.1\r\nHost: x\r\n\r\n'.encode())
+        assert (await reader.readline()).startswith(b'HTTP/1.1 200')
+        clients[name] = (reader, writer)
+    while len(stream._clients) < 3:
+        await asyncio.sleep(0.01)
+
+    cache.changes = [('a1', {'latest': {'cpu_percent': 5.0}})]
+    events = {name: await asyncio.wait_for(read_event(reader), 2)
+              for name, (reader, _) in clients.items() if name != 'b2'}
+    cache.changes = [('b2', {'agent': {'status': 'offline'}})]
+    events['all2'] = await asyncio.wait_for(read_event(clients['all'][0]), 2)
+    events['b2'] = await asyncio.wait_for(read_event(clients['b2'][0]), 2)
+
+    for _, writer in clients.values():
+        writer.close()
+    refresh.cancel()
+    server.close()
+    return events
+
+
+def test_changes_reach_interested_subscribers():
+    events = asyncio.run(run_streams())
+    assert events['all'] == events['a1'] == '{"latest":{"cpu_percent":5.0},"agent_id":"a1"}'
+    # b2's first event is its own change, not a1's
+    assert events['b2'] == events['all2'] == '{"agent":{"status":"offline"},"agent_id":"b2"}'
@@ -0,0 +1,120 @@
+"""
+Compact wire protocol tests
+Batches delta-encoded by the agent's CompactEncoder expand on the server to
+the same samples parse_sample makes of the JSON they were encoded from, and
+both sides agree on which field each index addresses
+"""
+import importlib.util
+import json
+import os
+import pytest
+
+import wire
+from ingest import SampleError, parse_sample
+from models import CHECK_STATUS_CODES
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The agent's module is also called wire, so it is loaded under another name
+_spec = importlib.util.spec_from_file_location('agent_wire', os.path.join(REPO_ROOT, 'agent', 'wire.py'))
+agent_wire = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(agent_wire)
+
+
+def make_sample(second, cpu=10.0, memory=25.0, summary=None, network=(), host=None):
+    system = {
+        'cpu_percent': cpu,
+        'memory': {'used': 1024, 'total': 4096, 'percent': memory},
+        'disk': {'used': 2048, 'total': 8192, 'percent': 25.0}
+    }
+    if summary is not None:
+        system['summary'] = summary
+    sample = {
+        'agent_id': 'a1',
+        'agent_name': 'host-1',
+        'interval': 60,
+        'timestamp': f'2026-03-02T12:00:{second:02d}.250000+00:00',
+        'system': system,
+        'network': list(network)
+    }
+    if host is not None:
+        sample['host'] = host
+    return sample
+
+
+def round_trip(samples):
+    encoder = agent_wire.CompactEncoder('/register', '/compact')
+    ids = wire.register(encoder.registration(samples))
+    encoder.registered(samples, {'targets': ids, 'formats': ['json']})
+    body, mimetype = encoder.encode(samples)
+    return wire.expand_batch(wire.decode_payload(body, mimetype))
+
+
+def test_fields_address_the_same_values():
+    assert len(agent_wire.FIELDS) == len(wire.FIELDS)
+    for index, path in enumerate(agent_wire.FIELDS):
+        sample = make_sample(0)
+        sample['system'].setdefault('summary', {'cpu_percent': {}, 'memory_percent': {}})
+        node = sample['system']
+        for key in path[:-1]:
+            node = node[key]
+        node[path[-1]] = 1234.5
+        metric = parse_sample(sample)['metric']
+        assert metric[wire.FIELDS[index]] == 1234.5, (path, wire.FIELDS[index])
+
+
+def test_check_status_codes_match():
+    assert agent_wire.CHECK_STATUS_CODES == CHECK_STATUS_CODES
+
+
+def test_expand_matches_parse_sample(app):
+    summary = {'cpu_percent': {'min': 1.0, 'max': 9.0, 'avg': 5.0, 'p95': 8.5, 'count': 12},
+               'memory_percent': {'min': 20.0, 'max': 30.0, 'avg': 25.0, 'p95': 29.0}}
+    samples = [
+        make_sample(0, summary=summary, network=[
+            {'host': 'gateway', 'status': 'up', 'latency_ms': 1.5},
+            {'url': 'https://example.com', 'status': 'down', 'error': 'timeout',
+             'timestamp': '2026-03-02T12:00:01.500000+00:00'}]),
+        # Unchanged values are left out of the change list
+        make_sample(10, summary=summary),
+        # Dropping the summary sends its fields as None
+        make_sample(20, cpu=55.5, memory=60.0, network=[
+            {'host': 'gateway', 'status': 'degraded', 'latency_ms': 250.0}]),
+        make_sample(30, cpu=0.0, host={'load': [0.5, 0.25, 0.125], 'process_count': 42}),
+    ]
+    assert round_trip(samples) == [parse_sample(sample) for sample in samples]
+
+
+def test_repeated_values_are_sent_once(app):
+    samples = [make_sample(0), make_sample(10), make_sample(20, cpu=11.0)]
+    encoder = agent_wire.CompactEncoder('/register', '/compact')
+    encoder.registered(samples, {'targets': {}, 'formats': ['json']})
+    body, _ = encoder.encode(samples)
+    rows = json.loads(body)['samples']
+    assert [row[0] for row in rows] == [0, 10000, 20000]
+    assert rows[1][1] == []
+    assert rows[2][1] == [0, 11.0]
+
+
+def test_unknown_agent_or_target_needs_resync(app):
+    samples = [make_sample(0, network=[{'host': 'gateway', 'status': 'up'}])]
+    encoder = agent_wire.CompactEncoder('/register', '/compact')
+    encoder.registered(samples, {'targets': {'gateway': 999}, 'formats': ['json']})
+    body, mimetype = encoder.encode(samples)
+    with pytest.raises(wire.ResyncRequired):
+        wire.expand_batch(wire.decode_payload(body, mimetype))
+    wire.register(encoder.registration(samples))
+    with pytest.raises(wire.ResyncRequired):
+        wire.expand_batch(wire.decode_payload(body, mimetype))
+
+
+def test_bad_entries_are_rejected_alone(app):
+    wire.register({'agent_id': 'a1', 'agent_name': 'host-1', 'targets': []})
+    results = wire.expand_batch({'v': 1, 'agent_id': 'a1', 'base': 0, 'samples': [
+        [0, [0, 1.0, 2, 2.0, 4, 3.0]],
+        [1000, [99, 1.0]],
+        ['late', []],
+        [2000, []],
+    ]})
+    assert [type(result) for result in results] == [dict, SampleError, SampleError, dict]
+    assert results[3]['metric']['cpu_percent'] == 1.0
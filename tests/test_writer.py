@@ -0,0 +1,84 @@
+"""
+Write-behind queue tests
+Acknowledged samples survive failed commits and the queue stays bounded
+while they wait to be written again
+"""
+import threading
+import pytest
+from flask import Flask
+
+from models import db
+from writer import WriteBehindQueue
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    return app
+
+
+class FlakyWrite:
+    """Raises for the first `failures` calls, then records what it writes"""
+
+    def __init__(self, failures=0, retry=()):
+        self.failures = failures
+        self.retry = set(retry)
+        self.written = []
+        self.calls = 0
+        self.done = threading.Event()
+
+    def __call__(self, samples):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError('database is locked')
+        retry = [s for s in samples if s in self.retry]
+        self.retry -= set(retry)
+        self.written.extend(s for s in samples if s not in retry)
+        if not self.retry:
+            self.done.set()
+        return retry
+
+
+def start(app, write, **kwargs):
+    kwargs.setdefault('max_delay', 0.01)
+    kwargs.setdefault('retry_delay', 0.01)
+    queue = WriteBehindQueue(app, write, **kwargs)
+    queue.start()
+    return queue
+
+
+def test_failed_commit_is_retried(app):
+    write = FlakyWrite(failures=3)
+    queue = start(app, write)
+    assert queue.submit(list(range(10)))
+    queue.stop()
+    assert write.written == list(range(10))
+    assert queue.failed_commits == 3
+    assert queue.retried == 30
+    assert queue.depth() == 0
+
+
+def test_returned_samples_are_retried_in_order(app):
+    write = FlakyWrite(retry=[2, 3])
+    queue = start(app, write)
+    assert queue.submit([1, 2, 3, 4])
+    assert write.done.wait(5)
+    queue.stop()
+    assert sorted(write.written) == [1, 2, 3, 4]
+    assert write.written[:2] == [1, 4]
+    assert queue.retried == 2
+
+
+def test_batch_being_retried_counts_against_the_limit(app):
+    write = FlakyWrite(failures=1000)
+    queue = start(app, write, max_samples=10, batch_samples=10, retry_delay=0.05)
+    assert queue.submit(list(range(8)))
+    # The writer holds the batch or has put it back; either way it is pending
+    assert not queue.submit([8, 9, 10])
+    assert queue.submit([8, 9])
+    assert queue.depth() == 10
+    assert queue.refused == 3
+    queue.stop(timeout=0.2)
+    assert queue.depth() == 10
@@ -11,17 +11,23 @@ class MetricsCharts {
             memory: 'rgb(16, 185, 129)',   // Green
             disk: 'rgb(245, 158, 11)'      // Orange
         };
+        this.maxPoints = 500;  // server picks a rollup resolution to match
+        this.pending = {};     // in-flight requests shared by the three charts
     }
 
-    async loadHistoricalData(agentId, hours = 24) {
-        try {
-            const response = await fetch(`/api/v1/metrics/${agentId}?hours=${hours}`);
-            const data = await response.json();
-            return data.metrics;
-        } catch (error) {
-            console.error('Error loading historical data:', error);
-            return [];
+    loadHistoricalData(agentId, hours = 24) {
+        // Columnar response: parallel timestamp/cpu/memory/disk arrays
+        const key = `${agentId}:${hours}`;
+        if (!this.pending[key]) {
+            this.pending[key] = fetch(`/api/v1/metrics/${agentId}?hours=${hours}&max_points=${this.maxPoints}&format=columnar`)
+                .then(response => response.json())
+                .catch(error => {
+                    console.error('Error loading historical data:', error);
+                    return null;
+                })
+                .finally(() => delete this.pending[key]);
         }
+        return this.pending[key];
     }
 
     createChart(canvasId, agentId, metricType, label) {
@@ -84,9 +90,9 @@ class MetricsCharts {
     }
 
     async updateChart(canvasId, agentId, metricType, hours = 24) {
-        const metrics = await this.loadHistoricalData(agentId, hours);
+        const history = await this.loadHistoricalData(agentId, hours);
         
-        if (!metrics || metrics.length === 0) {
+        if (!history || !history.count) {
             console.log('No metrics data available');
             return;
         }
@@ -94,24 +100,32 @@ class MetricsCharts {
         const chart = this.charts[canvasId];
         if (!chart) return;
 
-        // Prepare data
-        const labels = metrics.map(m => {
-            const date = new Date(m.timestamp);
-            return date.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
-        });
-
-        let data;
-        if (metricType === 'cpu') {
-            data = metrics.map(m => m.cpu_percent);
-        } else if (metricType === 'memory') {
-            data = metrics.map(m => m.memory_percent);
-        } else if (metricType === 'disk') {
-            data = metrics.map(m => m.disk_percent);
-        }
+        // Timestamps are epoch milliseconds (UTC)
+        const labels = history.timestamps.map(ms =>
+            new Date(ms).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })
+        );
 
-        // Update chart
+        // Value columns go to the chart as-is
         chart.data.labels = labels;
-        chart.data.datasets[0].data = data;
+        chart.data.datasets[0].data = history[metricType];
+
+        // Peaks between samples (high-resolution summaries) as a dashed line
+        const peaks = history[metricType + '_max'];
+        if (peaks) {
+            if (chart.data.datasets.length < 2) {
+                chart.data.datasets.push({
+                    label: chart.data.datasets[0].label + ' (peak)',
+                    data: [],
+                    borderColor: this.colors[metricType],
+                    borderWidth: 1,
+                    borderDash: [4, 4],
+                    tension: 0.4,
+                    fill: false,
+                    pointRadius: 0
+                });
+            }
+            chart.data.datasets[1].data = peaks;
+        }
         chart.update();
     }
 
@@ -7,32 +7,103 @@ class Dashboard {
     constructor() {
         this.updateInterval = 30000; // 30 seconds
         this.apiBase = window.location.origin;
+        this.agents = {};
+        this.streamOpened = false;
+        this.polling = null;
+        // Delay before reopening a refused or dropped stream, doubled per failure
+        this.streamRetryDelay = 5000;
+        this.streamRetryMax = 300000;
     }
 
     init() {
         console.log('Dashboard initialized');
         this.loadAgents();
-        this.startAutoRefresh();
+        
+        if (window.EventSource) {
+            this.startLiveUpdates();
+        } else {
+            this.startAutoRefresh();
+        }
+    }
+
+    startLiveUpdates() {
+        this.openStream();
+        // Keep relative "last seen" times current without refetching
+        setInterval(() => this.render(), this.updateInterval);
+    }
+
+    openStream() {
+        // The server pushes only changed fields as agents report in
+        const source = new EventSource(new URL(window.STREAM_URL || '/api/v1/stream', this.apiBase));
+        
+        source.addEventListener('update', event => this.applyUpdate(JSON.parse(event.data)));
+        source.addEventListener('resync', () => this.loadAgents());
+        source.onopen = () => {
+            // Catch up on anything missed while reconnecting
+            if (this.streamOpened) this.loadAgents();
+            this.streamOpened = true;
+            this.streamRetryDelay = 5000;
+            if (this.polling) {
+                clearInterval(this.polling);
+                this.polling = null;
+            }
+        };
+        source.onerror = () => {
+            // The server refused the stream (too many open): poll meanwhile
+            // and try the stream again later, backing off while it stays busy
+            if (source.readyState !== EventSource.CLOSED) return;
+            if (!this.polling) this.polling = this.startAutoRefresh();
+            setTimeout(() => this.openStream(), this.streamRetryDelay * (0.5 + Math.random()));
+            this.streamRetryDelay = Math.min(this.streamRetryDelay * 2, this.streamRetryMax);
+        };
+    }
+
+    applyUpdate(delta) {
+        const known = this.agents[delta.agent_id];
+        const agent = Object.assign(known || { agent_id: delta.agent_id }, delta.agent || {});
+        if (delta.latest) {
+            agent.latest = Object.assign(agent.latest || {}, delta.latest);
+        }
+        this.agents[delta.agent_id] = agent;
+        
+        if (!known || (delta.agent && delta.agent.status)) {
+            this.render();
+        } else {
+            this.updateSummary(Object.values(this.agents));
+            this.showAgentMetrics(agent.agent_id, agent.latest);
+            document.getElementById(`seen-${agent.agent_id}`).textContent = this.formatTime(agent.last_seen);
+        }
+        this.updateLastRefreshTime();
+    }
+
+    render() {
+        const agents = Object.values(this.agents)
+            .sort((a, b) => a.agent_id.localeCompare(b.agent_id));
+        
+        this.updateSummary(agents);
+        this.renderAgentTable(agents);
+        for (const agent of agents) {
+            this.showAgentMetrics(agent.agent_id, agent.latest);
+        }
     }
 
     async loadAgents() {
         try {
-            const response = await fetch(`${this.apiBase}/api/v1/agents`);
+            // One request for every agent and its latest metrics. The server
+            // sends an ETag, so unchanged polls are answered with a 304.
+            const response = await fetch(`${this.apiBase}/api/v1/overview`);
             const data = await response.json();
             
             console.log('Loaded agents:', data);
             
-            // Update summary cards
-            this.updateSummary(data.agents);
-            
-            // Render agent table
-            this.renderAgentTable(data.agents);
-            
-            // Load metrics for each agent
+            this.agents = {};
             for (const agent of data.agents) {
-                await this.loadAgentMetrics(agent.agent_id);
+                this.agents[agent.agent_id] = agent;
             }
             
+            // Update summary cards, agent table and metrics
+            this.render();
+            
             // Update last refresh time
             this.updateLastRefreshTime();
             
@@ -48,6 +119,13 @@ class Dashboard {
         
         document.getElementById('total-agents').textContent = totalAgents;
         document.getElementById('active-agents').textContent = activeAgents;
+        
+        const reporting = agents.filter(a => a.latest);
+        if (reporting.length > 0) {
+            const avg = key => reporting.reduce((sum, a) => sum + a.latest[key], 0) / reporting.length;
+            document.getElementById('avg-cpu').textContent = avg('cpu_percent').toFixed(1) + '%';
+            document.getElementById('avg-memory').textContent = avg('memory_percent').toFixed(1) + '%';
+        }
     }
 
     renderAgentTable(agents) {
@@ -61,7 +139,7 @@ class Dashboard {
         tbody.innerHTML = agents.map(agent => `
             <tr data-agent-id="${agent.agent_id}">
                 <td>
-                    <span class="badge ${agent.status === 'active' ? 'bg-success' : 'bg-secondary'}">
+                    <span class="badge ${this.statusBadge(agent.status)}">
                         ${agent.status}
                     </span>
                 </td>
@@ -69,7 +147,7 @@ class Dashboard {
                 <td id="cpu-${agent.agent_id}">--</td>
                 <td id="memory-${agent.agent_id}">--</td>
                 <td id="disk-${agent.agent_id}">--</td>
-                <td>${this.formatTime(agent.last_seen)}</td>
+                <td id="seen-${agent.agent_id}">${this.formatTime(agent.last_seen)}</td>
                 <td>
                     <button class="btn btn-sm btn-outline-primary" onclick="dashboard.viewDetails('${agent.agent_id}')">
                         View
@@ -79,21 +157,21 @@ class Dashboard {
         `).join('');
     }
 
-    async loadAgentMetrics(agentId) {
-        try {
-            const response = await fetch(`${this.apiBase}/api/v1/metrics/${agentId}/latest`);
-            const data = await response.json();
-            
-            document.getElementById(`cpu-${agentId}`).innerHTML = 
-                this.formatMetric(data.cpu_percent);
-            document.getElementById(`memory-${agentId}`).innerHTML = 
-                this.formatMetric(data.memory_percent);
-            document.getElementById(`disk-${agentId}`).innerHTML = 
-                this.formatMetric(data.disk_percent);
-            
-        } catch (error) {
-            console.error(`Error loading metrics for ${agentId}:`, error);
-        }
+    statusBadge(status) {
+        if (status === 'active') return 'bg-success';
+        if (status === 'stale') return 'bg-warning';
+        return 'bg-secondary';
+    }
+
+    showAgentMetrics(agentId, metrics) {
+        if (!metrics) return;
+        
+        document.getElementById(`cpu-${agentId}`).innerHTML = 
+            this.formatMetric(metrics.cpu_percent);
+        document.getElementById(`memory-${agentId}`).innerHTML = 
+            this.formatMetric(metrics.memory_percent);
+        document.getElementById(`disk-${agentId}`).innerHTML = 
+            this.formatMetric(metrics.disk_percent);
     }
 
     formatMetric(value) {
@@ -127,7 +205,7 @@ class Dashboard {
     }
 
     startAutoRefresh() {
-        setInterval(() => {
+        return setInterval(() => {
             this.loadAgents();
         }, this.updateInterval);
     }